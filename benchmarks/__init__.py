@@ -0,0 +1,4 @@
+import os
+
+# The directory the benchmarks write their databases to by default, ignored by git.
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".data")
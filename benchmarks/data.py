@@ -0,0 +1,126 @@
+# Generates seeded permission data for the benchmarks.
+#
+# Users, groups and objects are created through the ORM; permission rows, object groups and their
+# members are written with raw SQL in chunks, so tables with millions of rows can be generated with
+# bounded memory. Rows are drawn at random, duplicates are skipped, so the resulting counts can be
+# slightly lower than requested.
+
+import random
+
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+
+from safety.models import ObjectPermission, ObjectGroup, ObjectGroupUser
+from safety_tests.models import FakePost
+
+CODENAMES = ["view_fakepost", "change_fakepost", "delete_fakepost", "add_fakepost"]
+
+
+def _insert(table: str, columns: list[str], rows, chunk_size: int) -> int:
+    sql = "INSERT OR IGNORE INTO {} ({}) VALUES ({})".format(
+        connection.ops.quote_name(table),
+        ", ".join(connection.ops.quote_name(column) for column in columns),
+        ", ".join(["%s"] * len(columns)),
+    )
+
+    with connection.cursor() as cursor:
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= chunk_size:
+                cursor.executemany(sql, chunk)
+                chunk = []
+        if chunk:
+            cursor.executemany(sql, chunk)
+
+        cursor.execute(f"SELECT COUNT(*) FROM {connection.ops.quote_name(table)}")
+        return cursor.fetchone()[0]
+
+
+def _column(model, field: str) -> str:
+    return model._meta.get_field(field).column
+
+
+def generate_data(users=1000, groups=50, objects=10000, permissions=100000, group_permission_ratio=0.1,
+                  object_groups=1000, memberships=10000, groups_per_user=2, seed=0, chunk_size=100000) -> dict:
+    """
+    Populate the database with users, groups, FakePost objects and the permissions between them.
+
+    Args:
+        users (int): The number of users.
+        groups (int): The number of Django groups.
+        objects (int): The number of FakePost objects.
+        permissions (int): The number of ObjectPermission rows.
+        group_permission_ratio (float): The share of ObjectPermission rows granted to groups.
+        object_groups (int): The number of object groups, each holding one or two permissions.
+        memberships (int): The number of ObjectGroupUser rows.
+        groups_per_user (int): The number of Django groups every user is a member of.
+        seed (int): The seed of the random generator.
+        chunk_size (int): The number of rows written per statement.
+
+    Returns:
+        dict: The row counts of the generated tables.
+    """
+
+    rng = random.Random(seed)
+    user_ct = ContentType.objects.get_for_model(get_user_model())
+    group_ct = ContentType.objects.get_for_model(Group)
+    post_ct = ContentType.objects.get_for_model(FakePost)
+    perm_ids = list(Permission.objects.filter(codename__in=CODENAMES, content_type=post_ct)
+                    .values_list("id", flat=True))
+
+    with transaction.atomic():
+        user_model = get_user_model()
+        user_model.objects.bulk_create([user_model(username=f"user{index}") for index in range(users)],
+                                       batch_size=chunk_size)
+        Group.objects.bulk_create([Group(name=f"group{index}") for index in range(groups)], batch_size=chunk_size)
+        FakePost.objects.bulk_create([FakePost(title=f"post{index}", content="") for index in range(objects)],
+                                     batch_size=chunk_size)
+
+        user_ids = list(user_model.objects.values_list("id", flat=True))
+        group_ids = list(Group.objects.values_list("id", flat=True))
+        post_ids = list(FakePost.objects.values_list("id", flat=True))
+
+        _insert(user_model.groups.through._meta.db_table, ["user_id", "group_id"],
+                ((user_id, group_id) for user_id in user_ids
+                 for group_id in rng.sample(group_ids, min(groups_per_user, len(group_ids)))), chunk_size)
+
+        def permission_rows():
+            for _ in range(permissions):
+                if rng.random() < group_permission_ratio:
+                    to_ct, to_id = group_ct.id, rng.choice(group_ids)
+                else:
+                    to_ct, to_id = user_ct.id, rng.choice(user_ids)
+                yield str(to_id), to_ct, rng.choice(perm_ids), post_ct.id, rng.choice(post_ids)
+
+        permission_count = _insert(
+            ObjectPermission._meta.db_table,
+            [_column(ObjectPermission, field) for field in ("to_id", "to_ct", "permission", "object_ct", "object_id")],
+            permission_rows(), chunk_size)
+
+        _insert(ObjectGroup._meta.db_table,
+                [_column(ObjectGroup, field) for field in ("name", "target_ct", "target_id")],
+                ((f"object_group{index}", post_ct.id, rng.choice(post_ids)) for index in range(object_groups)),
+                chunk_size)
+        object_group_ids = list(ObjectGroup.objects.values_list("id", flat=True))
+
+        _insert(ObjectGroup.permissions.through._meta.db_table, ["objectgroup_id", "permission_id"],
+                ((group_id, perm_id) for group_id in object_group_ids
+                 for perm_id in rng.sample(perm_ids, rng.randint(1, 2))), chunk_size)
+
+        membership_count = _insert(
+            ObjectGroupUser._meta.db_table,
+            [_column(ObjectGroupUser, field) for field in ("group", "user")],
+            ((rng.choice(object_group_ids), rng.choice(user_ids)) for _ in range(memberships)) if object_group_ids
+            else iter(()), chunk_size)
+
+    return {
+        "users": len(user_ids),
+        "groups": len(group_ids),
+        "objects": len(post_ids),
+        "object_permissions": permission_count,
+        "object_groups": len(object_group_ids),
+        "object_group_users": membership_count,
+    }
@@ -0,0 +1,79 @@
+# Measures has_gross_perm for users that are members of 1, 10 and 100 groups, showing that the
+# number of queries does not grow with the number of groups.
+#
+# Usage: python -m benchmarks.gross_perm --groups 1 10 100
+
+import argparse
+import json
+import os
+import time
+
+from benchmarks import DATA_DIR
+from boot_django import boot_django
+
+
+def measure(group_count: int, repeat: int) -> dict:
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    from safety.perms import has_gross_perm, set_perm
+    from safety_tests.models import FakePost
+
+    user = get_user_model().objects.create(username=f"user_with_{group_count}_groups")
+    groups = Group.objects.bulk_create([Group(name=f"group{group_count}_{index}") for index in range(group_count)])
+    user.groups.add(*groups)
+    post = FakePost.objects.create(title="post", content="")
+    set_perm(groups[-1], "change_fakepost", post)
+
+    results = {}
+    for name, perm in (("granted", "change_fakepost"), ("denied", "delete_fakepost")):
+        has_gross_perm([user], perm, post)
+
+        with CaptureQueriesContext(connection) as context:
+            has_gross_perm([user], perm, post)
+
+        start = time.perf_counter()
+        for _ in range(repeat):
+            has_gross_perm([user], perm, post)
+
+        results[name] = {
+            "queries": len(context.captured_queries),
+            "mean_ms": (time.perf_counter() - start) / repeat * 1000,
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure has_gross_perm against the number of groups of a user.")
+    parser.add_argument("--groups", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--database", default=os.path.join(DATA_DIR, "safety_gross_perm.sqlite3"))
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        os.remove(args.database)
+    os.makedirs(os.path.dirname(os.path.abspath(args.database)), exist_ok=True)
+
+    boot_django(database_name=args.database)
+
+    from django.core.management import call_command
+
+    call_command("migrate", verbosity=0)
+
+    results = {group_count: measure(group_count, args.repeat) for group_count in args.groups}
+
+    for group_count, result in results.items():
+        print(f"{group_count:>5} groups: " + ", ".join(
+            f"{name} {values['queries']} queries {values['mean_ms']:.3f} ms" for name, values in result.items()))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
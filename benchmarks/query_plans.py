@@ -0,0 +1,132 @@
+# Shows the SQLite query plans and timings of the permission lookups before and after the
+# lookup indexes of safety.0011 are created.
+#
+# Usage: python -m benchmarks.query_plans [--rows 10000000]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+from benchmarks import DATA_DIR
+from boot_django import boot_django
+
+
+def get_query_shapes(rng) -> dict:
+    """
+    Build one queryset per lookup made by safety.perms and safety.object_group.
+    """
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group, Permission
+    from django.contrib.contenttypes.models import ContentType
+
+    from safety.models import ObjectPermission, ObjectGroup, ObjectGroupUser
+    from safety_tests.models import FakePost
+
+    user_ct = ContentType.objects.get_for_model(get_user_model())
+    group_ct = ContentType.objects.get_for_model(Group)
+    post_ct = ContentType.objects.get_for_model(FakePost)
+    user_id = rng.choice(list(get_user_model().objects.values_list("id", flat=True)[:1000]))
+    post_id = rng.choice(list(FakePost.objects.values_list("id", flat=True)[:1000]))
+    permission = Permission.objects.get(codename="view_fakepost", content_type=post_ct)
+
+    return {
+        "has_perm": ObjectPermission.objects.filter(permission=permission, to_id=user_id, to_ct=user_ct,
+                                                    object_id=post_id, object_ct=post_ct).values("pk")[:1],
+        "entity_perms_for_type": ObjectPermission.objects.filter(to_ct=user_ct, to_id=user_id, object_ct=post_ct)
+        .values_list("object_id", "permission__codename"),
+        "group_perms_for_type": ObjectPermission.objects.filter(to_ct=group_ct, object_ct=post_ct,
+                                                                to_id__in=["1", "2"])
+        .values_list("object_id", "permission__codename"),
+        "get_objects_for_entity": ObjectPermission.objects.filter(to_ct=user_ct, to_id=user_id,
+                                                                  permission__codename__in=["view_fakepost"],
+                                                                  permission__content_type=post_ct)
+        .values_list("object_id", flat=True),
+        "get_users_with_perms": ObjectPermission.objects.filter(object_ct=post_ct, object_id=post_id,
+                                                                permission__codename__in=["view_fakepost"],
+                                                                to_ct=user_ct).values_list("to_id", flat=True),
+        "object_groups_of_object": ObjectGroup.objects.filter(target_ct=post_ct, target_id=post_id),
+        "object_group_by_name": ObjectGroup.objects.filter(name="object_group1", target_ct=post_ct,
+                                                           target_id=post_id),
+        "object_groups_of_user": ObjectGroupUser.objects.filter(user_id=user_id).values_list("group_id", flat=True),
+        "object_groups_of_user_for_type": ObjectGroup.objects.filter(target_ct=post_ct, users=user_id),
+    }
+
+
+def explain(queryset) -> list[str]:
+    from django.db import connection
+
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        cursor.execute("EXPLAIN QUERY PLAN " + sql, params)
+        return [row[-1] for row in cursor.fetchall()]
+
+
+def measure(shapes: dict, repeat: int) -> dict:
+    results = {}
+
+    for name, queryset in shapes.items():
+        start = time.perf_counter()
+        for _ in range(repeat):
+            list(queryset.all())
+        results[name] = {
+            "plan": explain(queryset),
+            "mean_ms": (time.perf_counter() - start) / repeat * 1000,
+        }
+
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare query plans before and after the lookup indexes.")
+    parser.add_argument("--rows", type=int, default=10000000, help="Number of ObjectPermission rows.")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--objects", type=int, default=100000)
+    parser.add_argument("--repeat", type=int, default=20, help="Executions per query when timing.")
+    parser.add_argument("--database", default=os.path.join(DATA_DIR, "safety_query_plans.sqlite3"))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    if os.path.exists(args.database):
+        os.remove(args.database)
+    os.makedirs(os.path.dirname(os.path.abspath(args.database)), exist_ok=True)
+
+    boot_django(database_name=args.database)
+
+    from django.core.management import call_command
+    from django.db import connection
+
+    from benchmarks.data import generate_data
+
+    call_command("migrate", verbosity=0)
+    call_command("migrate", "safety", "0010", verbosity=0)
+
+    counts = generate_data(users=args.users, objects=args.objects, permissions=args.rows,
+                           object_groups=args.objects // 10, memberships=args.rows // 10, seed=args.seed)
+    print(f"Generated {counts}", file=sys.stderr)
+
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    before = measure(get_query_shapes(random.Random(args.seed)), args.repeat)
+
+    call_command("migrate", "safety", verbosity=0)
+    with connection.cursor() as cursor:
+        cursor.execute("ANALYZE")
+    after = measure(get_query_shapes(random.Random(args.seed)), args.repeat)
+
+    for name in before:
+        print(f"\n{name}: {before[name]['mean_ms']:.3f} ms -> {after[name]['mean_ms']:.3f} ms")
+        print("  before: " + "\n          ".join(before[name]["plan"]))
+        print("  after:  " + "\n          ".join(after[name]["plan"]))
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump({"counts": counts, "before": before, "after": after}, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
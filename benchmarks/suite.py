@@ -0,0 +1,197 @@
+# Benchmarks the permission API of safety.perms on seeded data, reporting latency percentiles,
+# throughput and queries per call of every operation, optionally as JSON to track regressions.
+#
+# Usage: python -m benchmarks.suite --permissions 1000000 --output results.json [--compare previous.json]
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import time
+from importlib import metadata
+
+from benchmarks import DATA_DIR
+from boot_django import boot_django
+
+
+def get_operations() -> dict:
+    from safety.perms import has_perm, has_gross_perm, get_perms, get_users_with_perms, get_groups_with_perms, \
+        get_objects_for_entity
+
+    return {
+        "has_perm": lambda s: has_perm([s["user"]], s["codename"], s["post"]),
+        "has_gross_perm": lambda s: has_gross_perm([s["user"]], s["codename"], s["post"]),
+        "get_perms": lambda s: get_perms(s["user"], s["post"]),
+        "get_users_with_perms": lambda s: list(get_users_with_perms(s["codename"], s["post"])),
+        "get_groups_with_perms": lambda s: list(get_groups_with_perms(s["codename"], s["post_ct"], s["post"])),
+        "get_objects_for_entity": lambda s: list(get_objects_for_entity(s["user"], s["codename"], s["post_ct"])),
+    }
+
+
+def get_samples(rng, count: int) -> list[dict]:
+    """
+    Pick random users, objects and permissions to run the operations with.
+    """
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.contenttypes.models import ContentType
+
+    from benchmarks.data import CODENAMES
+    from safety_tests.models import FakePost
+
+    user_ids = list(get_user_model().objects.values_list("id", flat=True))
+    post_ids = list(FakePost.objects.values_list("id", flat=True))
+    users = get_user_model().objects.in_bulk(rng.sample(user_ids, min(count, len(user_ids))))
+    posts = FakePost.objects.in_bulk(rng.sample(post_ids, min(count, len(post_ids))))
+    post_ct = ContentType.objects.get_for_model(FakePost)
+
+    return [{
+        "user": rng.choice(list(users.values())),
+        "post": rng.choice(list(posts.values())),
+        "post_ct": post_ct,
+        "codename": rng.choice(CODENAMES[:3]),
+    } for _ in range(count)]
+
+
+def run(operation, samples: list[dict], iterations: int) -> dict:
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    # Warm up process-level caches, such as content types and permission ids, before measuring.
+    for sample in samples:
+        operation(sample)
+
+    with CaptureQueriesContext(connection) as context:
+        for sample in samples:
+            operation(sample)
+    queries_per_call = len(context.captured_queries) / len(samples)
+
+    timings = []
+    for index in range(iterations):
+        sample = samples[index % len(samples)]
+        start = time.perf_counter()
+        operation(sample)
+        timings.append((time.perf_counter() - start) * 1000)
+
+    quantiles = statistics.quantiles(timings, n=100)
+
+    return {
+        "iterations": iterations,
+        "queries_per_call": queries_per_call,
+        "mean_ms": statistics.fmean(timings),
+        "p50_ms": quantiles[49],
+        "p95_ms": quantiles[94],
+        "p99_ms": quantiles[98],
+        "ops_per_s": iterations / (sum(timings) / 1000),
+    }
+
+
+def compare(results: dict, previous: dict, threshold: float) -> list[str]:
+    """
+    List the operations that became slower than the threshold allows, or issue more queries.
+    """
+
+    regressions = []
+
+    for name, result in results.items():
+        before = previous["results"].get(name)
+        if before is None:
+            continue
+        if result["p50_ms"] > before["p50_ms"] * (1 + threshold):
+            regressions.append(f"{name}: p50 {before['p50_ms']:.3f} ms -> {result['p50_ms']:.3f} ms")
+        if result["queries_per_call"] > before["queries_per_call"]:
+            regressions.append(f"{name}: {before['queries_per_call']:.2f} -> {result['queries_per_call']:.2f} "
+                               f"queries per call")
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the permission API of safety.perms.")
+    parser.add_argument("--users", type=int, default=10000)
+    parser.add_argument("--groups", type=int, default=100)
+    parser.add_argument("--objects", type=int, default=100000)
+    parser.add_argument("--permissions", type=int, default=1000000, help="Number of ObjectPermission rows.")
+    parser.add_argument("--object-groups", type=int, default=10000)
+    parser.add_argument("--memberships", type=int, default=100000, help="Number of ObjectGroupUser rows.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--samples", type=int, default=100, help="Distinct users and objects to sample.")
+    parser.add_argument("--iterations", type=int, default=1000, help="Timed calls per operation.")
+    parser.add_argument("--operations", nargs="+", help="Only run these operations.")
+    parser.add_argument("--database", default=os.path.join(DATA_DIR, "safety_benchmark.sqlite3"))
+    parser.add_argument("--reuse", action="store_true", help="Reuse previously generated data in the database.")
+    parser.add_argument("--output", help="Write the results as JSON to this file.")
+    parser.add_argument("--compare", help="Compare with the JSON results of a previous run.")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed relative slowdown when comparing.")
+    args = parser.parse_args()
+
+    reuse = args.reuse and os.path.exists(args.database)
+    if not reuse and os.path.exists(args.database):
+        os.remove(args.database)
+    os.makedirs(os.path.dirname(os.path.abspath(args.database)), exist_ok=True)
+
+    boot_django(database_name=args.database)
+
+    from django.core.management import call_command
+
+    from benchmarks.data import generate_data
+
+    call_command("migrate", verbosity=0)
+
+    data_options = {
+        "users": args.users, "groups": args.groups, "objects": args.objects, "permissions": args.permissions,
+        "object_groups": args.object_groups, "memberships": args.memberships, "seed": args.seed,
+    }
+    start = time.perf_counter()
+    counts = None if reuse else generate_data(**data_options)
+    print(f"Generated {counts} in {time.perf_counter() - start:.1f} s" if counts else "Reusing data",
+          file=sys.stderr)
+
+    samples = get_samples(random.Random(args.seed), args.samples)
+    operations = get_operations()
+    results = {
+        name: run(operation, samples, args.iterations)
+        for name, operation in operations.items() if not args.operations or name in args.operations
+    }
+
+    for name, result in results.items():
+        print(f"{name:<24} {result['queries_per_call']:>6.2f} queries  {result['p50_ms']:>8.3f} ms p50  "
+              f"{result['p95_ms']:>8.3f} ms p95  {result['ops_per_s']:>10.1f} ops/s")
+
+    report = {
+        "meta": {
+            "version": _get_version("django-object-safety"),
+            "django": _get_version("django"),
+            "python": platform.python_version(),
+            "timestamp": time.time(),
+            "data": data_options,
+        },
+        "counts": counts,
+        "results": results,
+    }
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if args.compare:
+        with open(args.compare) as file:
+            regressions = compare(results, json.load(file), args.threshold)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+def _get_version(package: str) -> str | None:
+    try:
+        return metadata.version(package)
+    except metadata.PackageNotFoundError:
+        return None
+
+
+if __name__ == "__main__":
+    main()
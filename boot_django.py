@@ -8,14 +8,14 @@ from django.conf import settings
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), "safety"))
 
 
-def boot_django():
+def boot_django(database_name=None):
     settings.configure(
         BASE_DIR=BASE_DIR,
         DEBUG=True,
         DATABASES={
             "default": {
                 "ENGINE": "django.db.backends.sqlite3",
-                "NAME": os.path.join(BASE_DIR, "db.sqlite3"),
+                "NAME": database_name or os.path.join(BASE_DIR, "db.sqlite3"),
             }
         },
 
@@ -1,6 +1,41 @@
 from django.apps import AppConfig
+from django.contrib.auth import get_user_model
+from django.core.signals import request_started
+from django.db.models.signals import m2m_changed, post_delete, post_migrate, post_save, pre_delete
 
 
 class SafetyConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'safety'
+
+    def ready(self):
+        from django.contrib.auth.models import Group, Permission
+
+        from safety.cache import invalidate_deleted_group_members, invalidate_group_members
+        from safety.cleanup import get_tracked_models, track_deletions
+        from safety.effective import connect_signals, effective_permissions_enabled
+        from safety.hierarchy import get_hierarchical_models, track_hierarchy
+        from safety.registry import clear_registry, register_permission, unregister_permission, warm_registry
+
+        user_model = get_user_model()
+        if hasattr(user_model, 'groups'):
+            m2m_changed.connect(invalidate_group_members, sender=user_model.groups.through,
+                                dispatch_uid='safety_invalidate_group_members')
+            pre_delete.connect(invalidate_deleted_group_members, sender=Group,
+                               dispatch_uid='safety_invalidate_deleted_group_members')
+
+        # Warming the permission registry needs the database, which should not be queried
+        # while apps are loading, so it is deferred to the first request.
+        request_started.connect(warm_registry, dispatch_uid='safety_warm_registry')
+        post_migrate.connect(clear_registry, dispatch_uid='safety_clear_registry')
+        post_save.connect(register_permission, sender=Permission, dispatch_uid='safety_register_permission')
+        post_delete.connect(unregister_permission, sender=Permission, dispatch_uid='safety_unregister_permission')
+
+        for model in get_tracked_models():
+            track_deletions(model)
+
+        for model in get_hierarchical_models():
+            track_hierarchy(model)
+
+        if effective_permissions_enabled():
+            connect_signals()
@@ -0,0 +1,71 @@
+from django.contrib.auth.backends import BaseBackend
+from django.contrib.contenttypes.models import ContentType
+
+from safety.cache import EMPTY_PERMS, PERM_CACHE_NAME, ObjectPerms, load_entity_perms
+from safety.perms import _inherits_perm
+
+
+class ObjectPermissionBackend(BaseBackend):
+    """
+    Authentication backend answering ``user.has_perm(perm, obj)`` with object permissions.
+
+    Only object permissions are handled; model level permissions are left to ``ModelBackend``.
+    Like ``ModelBackend``, the permissions are cached on the user instance, loading every
+    object permission of the user for a content type in a single query.
+
+    Like ``safety.perms``, checks regard the permissions inherited from the ancestors of objects,
+    while the permissions listed are those granted on the objects themselves.
+    """
+
+    def _get_object_perms(self, user_obj, obj) -> tuple[ContentType | None, ObjectPerms]:
+        if not user_obj.is_active or user_obj.is_anonymous or obj is None or obj.pk is None:
+            return None, EMPTY_PERMS
+
+        ct = ContentType.objects.get_for_model(obj)
+        perm_cache = user_obj.__dict__.setdefault(PERM_CACHE_NAME, {})
+
+        if ct.id not in perm_cache:
+            perm_cache[ct.id] = load_entity_perms(user_obj, ct)
+
+        return ct, perm_cache[ct.id].get(obj.pk, EMPTY_PERMS)
+
+    @staticmethod
+    def _format(ct: ContentType, codenames) -> set[str]:
+        return {f'{ct.app_label}.{codename}' for codename in codenames}
+
+    def get_user_permissions(self, user_obj, obj=None) -> set[str]:
+        """
+        Return the permissions granted directly to the user on obj.
+        """
+
+        ct, perms = self._get_object_perms(user_obj, obj)
+        return self._format(ct, perms.direct)
+
+    def get_group_permissions(self, user_obj, obj=None) -> set[str]:
+        """
+        Return the permissions the user has on obj through its groups and object groups.
+        """
+
+        ct, perms = self._get_object_perms(user_obj, obj)
+        return self._format(ct, perms.groups | perms.object_groups)
+
+    def get_all_permissions(self, user_obj, obj=None) -> set[str]:
+        ct, perms = self._get_object_perms(user_obj, obj)
+        return self._format(ct, perms.all)
+
+    def has_perm(self, user_obj, perm: str, obj=None) -> bool:
+        """
+        Return True if the user has the permission on obj, or inherits it from an ancestor of obj.
+        The permission may be given as ``app_label.codename`` or as a bare codename.
+        """
+
+        ct, perms = self._get_object_perms(user_obj, obj)
+
+        if ct is None:
+            return False
+
+        app_label, _, codename = perm.rpartition('.')
+        if app_label and app_label != ct.app_label:
+            return False
+
+        return codename in perms.all or _inherits_perm(user_obj, codename, obj, with_group_users=True)
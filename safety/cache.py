@@ -0,0 +1,675 @@
+import asyncio
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT
+from django.db.models import CharField, Value
+from django.db.models.functions import Cast
+
+from safety.instrumentation import record_cache_hit, record_cache_miss
+from safety.masks import codenames_of, uses_masks
+from safety.models import PermissionMask
+from safety.utils import get_object_permission_model, get_object_group_model, to_id_values
+
+DIRECT = 'direct'
+GROUP = 'group'
+OBJECT_GROUP = 'object_group'
+MASK = ':mask'
+
+PERM_CACHE_NAME = '_safety_perm_cache'
+MODEL_PERM_CACHE_NAME = '_safety_model_perm_cache'
+# The caches of ModelBackend, dropped along with the model permissions cached by safety.
+BACKEND_PERM_CACHE_NAMES = ('_perm_cache', '_user_perm_cache', '_group_perm_cache')
+PREFETCHED_PERMS_NAME = '_safety_prefetched_perms'
+
+_active_cache = ContextVar('safety_permission_cache', default=None)
+
+# Loads in progress, keyed by event loop and load.
+_in_flight = {}
+
+
+class ObjectPerms(NamedTuple):
+    """
+    The permission codenames an entity holds on a single object, split by where they come from.
+    """
+
+    direct: frozenset = frozenset()
+    groups: frozenset = frozenset()
+    object_groups: frozenset = frozenset()
+
+    @property
+    def all(self) -> frozenset:
+        return self.direct | self.groups | self.object_groups
+
+
+EMPTY_PERMS = ObjectPerms()
+
+
+class ModelPerms(NamedTuple):
+    """
+    The model level permissions of an entity as (content type id, codename) pairs, split by where
+    they come from.
+    """
+
+    direct: frozenset = frozenset()
+    groups: frozenset = frozenset()
+
+    @property
+    def all(self) -> frozenset:
+        return self.direct | self.groups
+
+
+EMPTY_MODEL_PERMS = ModelPerms()
+
+
+def _model_perms_rows(entity):
+    def rows(queryset, source: str):
+        # Permissions are ordered by default, which compound statements do not allow.
+        return queryset.order_by().values_list('content_type_id', 'codename', Value(source))
+
+    if isinstance(entity, Group):
+        return rows(Permission.objects.filter(group=entity), DIRECT)
+
+    queries = [rows(Permission.objects.filter(user=entity), DIRECT)]
+
+    if hasattr(entity, 'groups'):
+        queries.append(rows(Permission.objects.filter(group__user=entity), GROUP))
+
+    return queries[0].union(*queries[1:], all=True) if len(queries) > 1 else queries[0]
+
+
+def _collect_model_perms(rows) -> ModelPerms:
+    sources = {DIRECT: set(), GROUP: set()}
+    for ct_id, codename, source in rows:
+        sources[source].add((ct_id, codename))
+
+    return ModelPerms(frozenset(sources[DIRECT]), frozenset(sources[GROUP]))
+
+
+def _has_model_perms(entity) -> bool:
+    return isinstance(entity, (get_user_model(), Group)) and entity.pk is not None
+
+
+def get_model_perms(entity) -> ModelPerms:
+    """
+    Get the model level permissions of a user or group, loading the permissions granted to the
+    entity and to its groups in a single query on first use and caching them on the instance.
+
+    Like the caches of ``ModelBackend``, the permissions of other instances of the entity and of
+    the members of a group are not refreshed when they change.
+
+    Returns:
+        ModelPerms: The permissions of the entity, or no permissions for anonymous users.
+    """
+
+    if not _has_model_perms(entity):
+        return EMPTY_MODEL_PERMS
+
+    if MODEL_PERM_CACHE_NAME in entity.__dict__:
+        record_cache_hit()
+    else:
+        record_cache_miss()
+        entity.__dict__[MODEL_PERM_CACHE_NAME] = _collect_model_perms(_model_perms_rows(entity))
+
+    return entity.__dict__[MODEL_PERM_CACHE_NAME]
+
+
+async def aget_model_perms(entity) -> ModelPerms:
+    """
+    Async version of get_model_perms.
+    """
+
+    if not _has_model_perms(entity):
+        return EMPTY_MODEL_PERMS
+
+    if MODEL_PERM_CACHE_NAME in entity.__dict__:
+        record_cache_hit()
+    else:
+        record_cache_miss()
+        entity.__dict__[MODEL_PERM_CACHE_NAME] = _collect_model_perms(
+            [row async for row in _model_perms_rows(entity)])
+
+    return entity.__dict__[MODEL_PERM_CACHE_NAME]
+
+
+def invalidate_model_perms(entity):
+    """
+    Drop the model level permissions cached on an entity instance, including those cached by
+    ``ModelBackend``.
+    """
+
+    for name in (MODEL_PERM_CACHE_NAME, *BACKEND_PERM_CACHE_NAMES):
+        entity.__dict__.pop(name, None)
+
+
+def _entity_perms_rows(entity, ct: ContentType, object_ids=None):
+    masked = uses_masks(ct)
+    grants = PermissionMask.objects if masked else get_object_permission_model(ct.model_class()).objects
+    object_filter = {} if object_ids is None else {'object_id__in': object_ids}
+
+    def rows(queryset, source: str):
+        # Masks are selected as text, to be combined with the codenames of other sources.
+        if masked:
+            return queryset.values_list('object_id', Cast('mask', output_field=CharField()), Value(source + MASK))
+        return queryset.values_list('object_id', 'permission__codename', Value(source))
+
+    queries = [rows(grants.filter(
+        to_ct=ContentType.objects.get_for_model(entity),
+        to_id=entity.pk,
+        object_ct=ct,
+        **object_filter,
+    ), DIRECT)]
+
+    if not isinstance(entity, Group):
+        if hasattr(entity, 'groups'):
+            queries.append(rows(grants.filter(
+                to_ct=ContentType.objects.get_for_model(Group),
+                to_id__in=to_id_values(entity.groups.all()),
+                object_ct=ct,
+                **object_filter,
+            ), GROUP))
+
+        queries.append(get_object_group_model().objects.filter(
+            users=entity,
+            target_ct=ct,
+            permissions__isnull=False,
+            **({} if object_ids is None else {'target_id__in': object_ids}),
+        ).values_list('target_id', 'permissions__codename', Value(OBJECT_GROUP)))
+
+    return queries[0].union(*queries[1:], all=True) if len(queries) > 1 else queries[0]
+
+
+def _collect_entity_perms(ct: ContentType, rows) -> dict[int, ObjectPerms]:
+    sources = {}
+    for object_id, codename, source in rows:
+        found = sources.setdefault(object_id, {DIRECT: set(), GROUP: set(), OBJECT_GROUP: set()})
+        if source.endswith(MASK):
+            found[source.removesuffix(MASK)].update(codenames_of(ct, int(codename)))
+        else:
+            found[source].add(codename)
+
+    return {
+        object_id: ObjectPerms(frozenset(found[DIRECT]), frozenset(found[GROUP]), frozenset(found[OBJECT_GROUP]))
+        for object_id, found in sources.items()
+    }
+
+
+def load_entity_perms(entity, ct: ContentType, object_ids=None) -> dict[int, ObjectPerms]:
+    """
+    Load every object permission an entity holds on objects of a content type in a single query.
+
+    For users, the result includes permissions granted to their groups and to the object groups
+    they are a member of.
+
+    Args:
+        entity: The user or group to load the permissions for.
+        ct (ContentType): The content type of the objects.
+        object_ids: Restrict the result to these object ids.
+
+    Returns:
+        dict[int, ObjectPerms]: The permissions of the entity, keyed by object id.
+    """
+
+    return _collect_entity_perms(ct, _entity_perms_rows(entity, ct, object_ids))
+
+
+async def aload_entity_perms(entity, ct: ContentType, object_ids=None) -> dict[int, ObjectPerms]:
+    """
+    Async version of load_entity_perms.
+    """
+
+    return _collect_entity_perms(ct, [row async for row in _entity_perms_rows(entity, ct, object_ids)])
+
+
+async def coalesce(key, load):
+    """
+    Run a load, unless the same load is already running, in which case its result is awaited
+    instead, so that concurrent checks of the same permissions cost a single query.
+
+    Args:
+        key: Identifies the load.
+        load: A callable returning the coroutine to run.
+    """
+
+    loop = asyncio.get_running_loop()
+    task = _in_flight.get((loop, key))
+
+    if task is None:
+        task = _in_flight[loop, key] = loop.create_task(load())
+
+        def forget(done):
+            if _in_flight.get((loop, key)) is done:
+                del _in_flight[loop, key]
+
+        task.add_done_callback(forget)
+
+    # A caller being cancelled must not cancel the load for the others.
+    return await asyncio.shield(task)
+
+
+def _entity_key(entity) -> tuple:
+    return ContentType.objects.get_for_model(entity).id, str(entity.pk)
+
+
+class SharedPermissionCache:
+    """
+    Stores the resolved permissions of an entity on an object in a Django cache backend,
+    so they can be shared between processes.
+
+    Entries are keyed by a version counter of the entity and one of the object. Changing a
+    permission bumps the relevant counter instead of deleting entries, so stale entries are
+    never served, even by processes that have not seen the change.
+    """
+
+    def __init__(self, alias: str, timeout=DEFAULT_TIMEOUT, prefix: str = 'safety'):
+        self.alias = alias
+        self.timeout = timeout
+        self.prefix = prefix
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def backend(self):
+        return caches[self.alias]
+
+    def _entity_version_key(self, entity) -> str:
+        return '{}:version:entity:{}:{}'.format(self.prefix, *_entity_key(entity))
+
+    def _object_version_key(self, ct_id: int, object_id) -> str:
+        return f'{self.prefix}:version:object:{ct_id}:{object_id}'
+
+    def _versions(self, keys: list[str]) -> dict:
+        """
+        Get version counters, starting missing ones at the current time so that a counter
+        which was evicted can never fall back to a value it had before.
+        """
+
+        versions = self.backend.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+
+        if missing:
+            start = time.time_ns()
+            # Cache backends have no batched add. Adding never overwrites a counter that another
+            # process started or bumped in the meantime, so the counters are read back at once.
+            for key in missing:
+                self.backend.add(key, start, None)
+            versions.update({key: start for key in missing})
+            versions.update(self.backend.get_many(missing))
+
+        return versions
+
+    def _bump(self, key: str):
+        try:
+            self.backend.incr(key)
+        except ValueError:
+            self.backend.set(key, time.time_ns(), None)
+
+    def _entry_keys(self, entity, ct: ContentType, object_ids) -> dict:
+        entity_version_key = self._entity_version_key(entity)
+        object_version_keys = {object_id: self._object_version_key(ct.id, object_id) for object_id in object_ids}
+        versions = self._versions([entity_version_key, *object_version_keys.values()])
+
+        return {
+            object_id: '{}:perms:{}:{}:{}:{}:{}:{}'.format(self.prefix, *_entity_key(entity), ct.id, object_id,
+                                                           versions[entity_version_key], versions[version_key])
+            for object_id, version_key in object_version_keys.items()
+        }
+
+    def get(self, entity, obj) -> ObjectPerms | None:
+        """
+        Get the permissions an entity holds on an object.
+
+        Returns:
+            ObjectPerms | None: The cached permissions, or None if they are not cached.
+        """
+
+        key = self._entry_keys(entity, ContentType.objects.get_for_model(obj), [obj.pk])[obj.pk]
+        entry = self.backend.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return ObjectPerms(*entry)
+
+    def set_many(self, entity, ct: ContentType, perms: dict):
+        """
+        Store the permissions an entity holds on objects of a content type.
+
+        Args:
+            entity: The user or group the permissions belong to.
+            ct (ContentType): The content type of the objects.
+            perms (dict[int, ObjectPerms]): The permissions, keyed by object id.
+        """
+
+        keys = self._entry_keys(entity, ct, list(perms))
+        self.backend.set_many({keys[object_id]: tuple(entry) for object_id, entry in perms.items()}, self.timeout)
+
+    def get_or_load(self, entity, obj) -> ObjectPerms:
+        """
+        Get the permissions an entity holds on an object, loading and storing them on a miss.
+        """
+
+        perms = self.get(entity, obj)
+
+        if perms is not None:
+            record_cache_hit()
+        else:
+            record_cache_miss()
+            ct = ContentType.objects.get_for_model(obj)
+            perms = load_entity_perms(entity, ct, [obj.pk]).get(obj.pk, EMPTY_PERMS)
+            self.set_many(entity, ct, {obj.pk: perms})
+
+        return perms
+
+    def bump_entity(self, entity):
+        self._bump(self._entity_version_key(entity))
+
+    def bump_object(self, obj=None, ct: ContentType = None, object_id=None):
+        if obj is not None:
+            ct, object_id = ContentType.objects.get_for_model(obj), obj.pk
+        self._bump(self._object_version_key(ct.id, object_id))
+
+    def stats(self) -> dict:
+        return {'hits': self.hits, 'misses': self.misses}
+
+    def reset_stats(self):
+        self.hits = 0
+        self.misses = 0
+
+
+_shared_caches = {}
+
+
+def get_shared_cache() -> SharedPermissionCache | None:
+    """
+    Returns:
+        SharedPermissionCache | None: The cache configured by the ``SAFETY_SHARED_CACHE`` setting, or None
+        if the shared cache is disabled.
+    """
+
+    alias = getattr(settings, 'SAFETY_SHARED_CACHE', None)
+    if alias is None:
+        return None
+
+    timeout = getattr(settings, 'SAFETY_SHARED_CACHE_TIMEOUT', DEFAULT_TIMEOUT)
+    shared = _shared_caches.get(alias)
+
+    if shared is None or shared.timeout != timeout:
+        shared = _shared_caches[alias] = SharedPermissionCache(alias, timeout)
+
+    return shared
+
+
+class PermissionCache:
+    """
+    Remembers the object permissions of entities for the lifetime of a request.
+
+    The permissions of an entity are loaded per content type, so checking many objects of
+    the same type costs a single query. If the shared cache is enabled, it is consulted
+    first, and everything loaded from the database is stored in it.
+    """
+
+    def __init__(self):
+        self._entries = {}
+        self._shared_entries = {}
+
+    @staticmethod
+    def _key(entity, ct: ContentType) -> tuple:
+        return *_entity_key(entity), ct.id
+
+    def get(self, entity, obj) -> ObjectPerms:
+        """
+        Get the permissions an entity holds on an object, loading them if necessary.
+
+        Args:
+            entity: The user or group to get the permissions for.
+            obj: The object to get the permissions on.
+
+        Returns:
+            ObjectPerms: The permissions of the entity on the object.
+        """
+
+        ct = ContentType.objects.get_for_model(obj)
+        key = self._key(entity, ct)
+
+        if key in self._entries:
+            record_cache_hit()
+            return self._entries[key].get(obj.pk, EMPTY_PERMS)
+
+        shared = get_shared_cache()
+
+        if shared is not None:
+            if (key, obj.pk) not in self._shared_entries:
+                self._shared_entries[key, obj.pk] = shared.get(entity, obj)
+            if self._shared_entries[key, obj.pk] is not None:
+                record_cache_hit()
+                return self._shared_entries[key, obj.pk]
+
+        record_cache_miss()
+        self._entries[key] = load_entity_perms(entity, ct)
+
+        if shared is not None:
+            # Only the requested object is written back, so a miss costs a bounded number of round trips.
+            shared.set_many(entity, ct, {obj.pk: self._entries[key].get(obj.pk, EMPTY_PERMS)})
+
+        return self._entries[key].get(obj.pk, EMPTY_PERMS)
+
+    async def aget(self, entity, obj) -> ObjectPerms:
+        """
+        Async version of get. Concurrent loads of the same permissions are coalesced, and the
+        shared cache is only consulted for entries that are not cached in the request.
+        """
+
+        ct = ContentType.objects.get_for_model(obj)
+        key = self._key(entity, ct)
+
+        if key in self._entries:
+            record_cache_hit()
+            return self._entries[key].get(obj.pk, EMPTY_PERMS)
+
+        shared = get_shared_cache()
+
+        if shared is not None:
+            if (key, obj.pk) not in self._shared_entries:
+                self._shared_entries[key, obj.pk] = await sync_to_async(shared.get)(entity, obj)
+            if self._shared_entries[key, obj.pk] is not None:
+                record_cache_hit()
+                return self._shared_entries[key, obj.pk]
+
+        record_cache_miss()
+        self._entries[key] = await coalesce(('entity_perms', id(self), key), lambda: aload_entity_perms(entity, ct))
+
+        if shared is not None:
+            await sync_to_async(shared.set_many)(entity, ct, {obj.pk: self._entries[key].get(obj.pk, EMPTY_PERMS)})
+
+        return self._entries[key].get(obj.pk, EMPTY_PERMS)
+
+    def invalidate(self, entity=None, ct: ContentType = None):
+        """
+        Forget cached permissions. If both entity and ct are given, only that entry is
+        dropped; otherwise every entry matching the given entity or content type is.
+
+        Args:
+            entity: The user or group whose permissions changed.
+            ct (ContentType): The content type of the objects whose permissions changed.
+        """
+
+        entity_key = _entity_key(entity) if entity is not None else None
+
+        def matches(key):
+            return (entity_key is None or key[:2] == entity_key) and (ct is None or key[2] == ct.id)
+
+        self._entries = {key: value for key, value in self._entries.items() if not matches(key)}
+        self._shared_entries = {key: value for key, value in self._shared_entries.items() if not matches(key[0])}
+
+
+def get_active_cache() -> PermissionCache | None:
+    """
+    Returns:
+        PermissionCache | None: The cache of the current request, or None if caching is not active.
+    """
+
+    return _active_cache.get()
+
+
+def attach_prefetched_perms(entity, obj, perms: ObjectPerms):
+    """
+    Remember the permissions an entity holds on an object on the object instance itself.
+    """
+
+    obj.__dict__.setdefault(PREFETCHED_PERMS_NAME, {})[_entity_key(entity)] = perms
+
+
+def get_cached_perms(entity, obj) -> ObjectPerms | None:
+    """
+    Get the permissions an entity holds on an object from the permissions prefetched on the
+    object, from the request cache, or from the shared cache if no request cache is active.
+
+    Returns:
+        ObjectPerms | None: The permissions, or None if no cache is enabled.
+    """
+
+    prefetched = obj.__dict__.get(PREFETCHED_PERMS_NAME)
+    if prefetched is not None and _entity_key(entity) in prefetched:
+        record_cache_hit()
+        return prefetched[_entity_key(entity)]
+
+    cache = get_active_cache()
+    if cache is not None:
+        return cache.get(entity, obj)
+
+    shared = get_shared_cache()
+    if shared is not None:
+        return shared.get_or_load(entity, obj)
+
+    return None
+
+
+async def aget_cached_perms(entity, obj) -> ObjectPerms | None:
+    """
+    Async version of get_cached_perms.
+    """
+
+    prefetched = obj.__dict__.get(PREFETCHED_PERMS_NAME)
+    if prefetched is not None and _entity_key(entity) in prefetched:
+        record_cache_hit()
+        return prefetched[_entity_key(entity)]
+
+    cache = get_active_cache()
+    if cache is not None:
+        return await cache.aget(entity, obj)
+
+    shared = get_shared_cache()
+    if shared is not None:
+        return await sync_to_async(shared.get_or_load)(entity, obj)
+
+    return None
+
+
+@contextmanager
+def permission_cache():
+    """
+    Cache object permissions within the block. Nested blocks reuse the outer cache.
+    """
+
+    if _active_cache.get() is not None:
+        yield _active_cache.get()
+        return
+
+    token = _active_cache.set(PermissionCache())
+    try:
+        yield _active_cache.get()
+    finally:
+        _active_cache.reset(token)
+
+
+def invalidate(entity=None, obj=None, ct: ContentType = None, object_ids=None):
+    """
+    Drop cached permissions after they were changed.
+
+    Permissions granted to a group or to an object group affect every member, so
+    only the entity is targeted when it is not a group. In the shared cache, this bumps
+    the version of the entity, or of the objects if no user is targeted.
+
+    Args:
+        entity: The user or group whose permissions changed.
+        obj: The object whose permissions changed.
+        ct (ContentType): The content type of the objects, if obj is not provided.
+        object_ids: The ids of the objects of type ct whose permissions changed, if obj is not provided.
+    """
+
+    if obj is not None:
+        ct, object_ids = ContentType.objects.get_for_model(obj), [obj.pk]
+        obj.__dict__.pop(PREFETCHED_PERMS_NAME, None)
+
+    if entity is not None:
+        invalidate_model_perms(entity)
+
+    if isinstance(entity, Group):
+        entity = None
+    elif entity is not None:
+        entity.__dict__.pop(PERM_CACHE_NAME, None)
+
+    shared = get_shared_cache()
+    if shared is not None:
+        if entity is not None:
+            shared.bump_entity(entity)
+        elif object_ids is not None:
+            for object_id in object_ids:
+                shared.bump_object(ct=ct, object_id=object_id)
+
+    cache = get_active_cache()
+    if cache is not None:
+        cache.invalidate(entity, ct)
+
+    # Loads that started before the change must not be joined afterwards.
+    _in_flight.clear()
+
+
+async def ainvalidate(entity=None, obj=None, ct: ContentType = None, object_ids=None):
+    """
+    Async version of invalidate. The shared cache backend is only reached from a thread.
+    """
+
+    if get_shared_cache() is None:
+        invalidate(entity, obj, ct, object_ids)
+    else:
+        await sync_to_async(invalidate)(entity, obj, ct, object_ids)
+
+
+def invalidate_group_members(sender, instance, action, reverse, pk_set, **kwargs):
+    """
+    Signal receiver dropping cached permissions of users whose Django groups changed.
+    """
+
+    if action not in ('post_add', 'post_remove', 'post_clear' if not reverse else 'pre_clear'):
+        return
+
+    if not reverse:
+        invalidate(instance)
+    elif action == 'pre_clear':
+        for user in instance.user_set.all():
+            invalidate(user)
+    else:
+        for pk in pk_set:
+            invalidate(get_user_model()(pk=pk))
+
+
+def invalidate_deleted_group_members(sender, instance, **kwargs):
+    """
+    Signal receiver dropping cached permissions of the members of a group that is being deleted,
+    whose memberships are removed without sending ``m2m_changed``.
+    """
+
+    for user in instance.user_set.all():
+        invalidate(user)
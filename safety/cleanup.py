@@ -0,0 +1,392 @@
+from contextvars import ContextVar
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models.signals import post_delete
+
+from safety.cache import invalidate
+from safety.effective import effective_permissions_enabled, refresh_effective_permissions, \
+    suspend_effective_permissions
+from safety.managers import PermissionQuerySetMixin
+from safety.models import EffectivePermission, PermissionMask
+from safety.utils import get_object_permission_model, get_object_group_model
+
+# Ids of deleted objects whose grants are yet to be removed, keyed by content type id.
+_pending = ContextVar('safety_pending_cleanup', default=None)
+
+
+def _to_pk(model, value):
+    try:
+        return model._meta.pk.to_python(value)
+    except ValidationError:
+        return None
+
+
+def missing_object_ids(ct: ContentType, object_ids) -> set:
+    """
+    Get the ids of objects that do not exist, e.g. to find orphaned grants.
+
+    Args:
+        ct (ContentType): The content type of the objects.
+        object_ids: The ids of the objects, as stored in object permissions or in the objects.
+
+    Returns:
+        set: The ids that do not belong to an object, as given.
+    """
+
+    model = ct.model_class()
+    object_ids = set(object_ids)
+
+    if model is None:
+        return object_ids
+
+    pks = {object_id: _to_pk(model, object_id) for object_id in object_ids}
+    existing = set(model._base_manager.filter(pk__in={pk for pk in pks.values() if pk is not None})
+                   .values_list('pk', flat=True))
+
+    return {object_id for object_id, pk in pks.items() if pk is None or pk not in existing}
+
+
+def delete_object_grants(ct: ContentType, object_ids, batch_size=1000) -> tuple[int, int]:
+    """
+    Remove the object permissions, object groups and effective permissions of objects, in
+    batches of a limited number of objects per statement.
+
+    Args:
+        ct (ContentType): The content type of the objects.
+        object_ids: The ids of the objects.
+        batch_size (int): The maximum number of objects per statement.
+
+    Returns:
+        tuple: The number of object permissions and permission masks, and of object groups removed.
+    """
+
+    permission_model = get_object_permission_model(ct.model_class())
+    object_group_model = get_object_group_model()
+    object_ids = list(object_ids)
+    permissions = object_groups = 0
+
+    with transaction.atomic(), suspend_effective_permissions():
+        for start in range(0, len(object_ids), batch_size):
+            batch = object_ids[start:start + batch_size]
+
+            permissions += permission_model.objects.filter(object_ct=ct, object_id__in=batch).delete()[1] \
+                .get(permission_model._meta.label, 0)
+            object_groups += object_group_model.objects.filter(target_ct=ct, target_id__in=batch).delete()[1] \
+                .get(object_group_model._meta.label, 0)
+            permissions += PermissionMask.objects.filter(object_ct=ct, object_id__in=batch).delete()[0]
+            EffectivePermission.objects.filter(object_ct=ct, object_id__in=batch).delete()
+
+            invalidate(ct=ct, object_ids=batch)
+
+    return permissions, object_groups
+
+
+def flush_deleted_objects():
+    """
+    Remove the grants of the objects deleted since the last flush. Objects that still exist,
+    because the transaction deleting them was rolled back, keep their grants.
+    """
+
+    pending = _pending.get()
+    if not pending:
+        return
+
+    _pending.set(None)
+
+    for ct_id, object_ids in pending.items():
+        ct = ContentType.objects.get_for_id(ct_id)
+        delete_object_grants(ct, missing_object_ids(ct, object_ids),
+                             batch_size=getattr(settings, 'SAFETY_CLEANUP_BATCH_SIZE', 1000))
+
+
+def object_deleted(sender, instance, using, **kwargs):
+    """
+    Signal receiver collecting deleted objects, whose grants are removed once the transaction
+    commits. QuerySet deletes run in a transaction, so their objects are cleaned up in bulk.
+    """
+
+    pending = _pending.get()
+    if pending is None:
+        pending = {}
+        _pending.set(pending)
+
+    pending.setdefault(ContentType.objects.get_for_model(sender).id, set()).add(instance.pk)
+
+    # Registered for every object, as the callbacks of a rolled back transaction are dropped.
+    # The first one to run flushes all deletions, leaving nothing to do for the others.
+    transaction.on_commit(flush_deleted_objects, using=using)
+
+
+def get_tracked_models() -> list:
+    """
+    Get the models whose grants are removed when their objects are deleted. These are the models
+    listed as ``app_label.ModelName`` in the ``SAFETY_CLEANUP_MODELS`` setting, all models if it is
+    ``__all__``, or by default the models whose default manager has a ``PermissionQuerySet``.
+
+    Note that Django cannot fast delete objects of models whose deletions are tracked.
+    """
+
+    labels = getattr(settings, 'SAFETY_CLEANUP_MODELS', None)
+
+    if labels is None:
+        # pylint: disable-next=protected-access
+        return [model for model in apps.get_models()
+                if issubclass(model._default_manager._queryset_class, PermissionQuerySetMixin)]
+
+    if labels == '__all__':
+        return [model for model in apps.get_models() if model._meta.app_label != 'safety']
+
+    return [apps.get_model(label) for label in labels]
+
+
+def track_deletions(model):
+    """
+    Remove the grants of the objects of a model when they are deleted.
+    """
+
+    post_delete.connect(object_deleted, sender=model, dispatch_uid=f'safety_cleanup_{model._meta.label}')
+
+
+def untrack_deletions(model):
+    post_delete.disconnect(sender=model, dispatch_uid=f'safety_cleanup_{model._meta.label}')
+
+
+def _batches(queryset, batch_size: int, last_pk=None):
+    """
+    Iterate over the rows of a values_list queryset starting with the primary key, in batches
+    of primary key order, so memory use is bounded by the batch size.
+    """
+
+    queryset = queryset.order_by('pk')
+
+    while True:
+        batch = list((queryset if last_pk is None else queryset.filter(pk__gt=last_pk))[:batch_size])
+        if not batch:
+            return
+        last_pk = batch[-1][0]
+        yield batch
+
+
+def _by_ct(references) -> dict[int, set]:
+    by_ct = {}
+    for ct_id, object_id in references:
+        by_ct.setdefault(ct_id, set()).add(object_id)
+    return by_ct
+
+
+def _missing(references) -> set[tuple]:
+    """
+    Get the (content type id, object id) pairs that do not refer to an existing object.
+    """
+
+    return {(ct_id, object_id) for ct_id, object_ids in _by_ct(references).items()
+            for object_id in missing_object_ids(ContentType.objects.get_for_id(ct_id), object_ids)}
+
+
+def _delete_effective_permissions(references):
+    for ct_id, object_ids in _by_ct(references).items():
+        EffectivePermission.objects.filter(object_ct_id=ct_id, object_id__in=list(object_ids)).delete()
+
+
+def _canonical_id(ct: ContentType, value) -> str:
+    model = ct.model_class()
+    pk = _to_pk(model, str(value).strip()) if model is not None else None
+    return str(value) if pk is None else str(pk)
+
+
+def _collect_object_permissions(batch: list, dry_run: bool, compact: bool) -> dict:
+    model = get_object_permission_model()
+    missing_objects = _missing((object_ct_id, object_id) for _, _, _, _, object_ct_id, object_id in batch
+                               if object_id is not None)
+
+    missing_entities = missing_permissions = set()
+    if compact:
+        permission_ids = {row[1] for row in batch}
+        missing_permissions = permission_ids - set(Permission.objects.filter(pk__in=permission_ids)
+                                                   .values_list('pk', flat=True))
+        missing_entities = _missing((to_ct_id, to_id) for _, _, to_ct_id, to_id, _, _ in batch)
+
+    orphan_pks = []
+    renamed = []
+    for pk, permission_id, to_ct_id, to_id, object_ct_id, object_id in batch:
+        if permission_id in missing_permissions or (to_ct_id, to_id) in missing_entities \
+                or (object_ct_id, object_id) in missing_objects:
+            orphan_pks.append(pk)
+        elif compact and isinstance(to_id, str):
+            canonical = _canonical_id(ContentType.objects.get_for_id(to_ct_id), to_id)
+            if canonical != to_id:
+                renamed.append((pk, canonical))
+
+    duplicates = normalized = 0
+    with transaction.atomic(), suspend_effective_permissions():
+        for pk, canonical in renamed:
+            row = model.objects.filter(pk=pk).values('permission', 'to_ct', 'object_ct', 'object_id').get()
+            if model.objects.filter(to_id=canonical, **row).exists():
+                duplicates += 1
+                if not dry_run:
+                    model.objects.filter(pk=pk).delete()
+            else:
+                normalized += 1
+                if not dry_run:
+                    model.objects.filter(pk=pk).update(to_id=canonical)
+                    if effective_permissions_enabled() and row['object_id'] is not None:
+                        refresh_effective_permissions(None, ContentType.objects.get_for_id(row['object_ct']),
+                                                      [row['object_id']])
+
+        if orphan_pks and not dry_run:
+            model.objects.filter(pk__in=orphan_pks).delete()
+            _delete_effective_permissions(missing_objects)
+
+    if not compact:
+        return {'orphaned': len(orphan_pks)}
+
+    return {'orphaned': len(orphan_pks), 'duplicates': duplicates, 'normalized': normalized}
+
+
+def _collect_permission_masks(batch: list, dry_run: bool, compact: bool) -> dict:
+    missing_entities = _missing((to_ct_id, to_id) for _, to_ct_id, to_id, _, _ in batch) if compact else set()
+    missing_objects = _missing((object_ct_id, object_id) for _, _, _, object_ct_id, object_id in batch)
+    orphan_pks = [pk for pk, to_ct_id, to_id, object_ct_id, object_id in batch
+                  if (to_ct_id, to_id) in missing_entities or (object_ct_id, object_id) in missing_objects]
+
+    if orphan_pks and not dry_run:
+        with transaction.atomic(), suspend_effective_permissions():
+            PermissionMask.objects.filter(pk__in=orphan_pks).delete()
+            _delete_effective_permissions(missing_objects)
+
+    return {'orphaned': len(orphan_pks)}
+
+
+def _collect_object_groups(batch: list, dry_run: bool, compact: bool) -> dict:
+    missing = _missing((target_ct_id, target_id) for _, target_ct_id, target_id in batch if target_id is not None)
+    orphan_pks = [pk for pk, target_ct_id, target_id in batch if (target_ct_id, target_id) in missing]
+
+    if orphan_pks and not dry_run:
+        with transaction.atomic(), suspend_effective_permissions():
+            get_object_group_model().objects.filter(pk__in=orphan_pks).delete()
+            _delete_effective_permissions(missing)
+
+    return {'orphaned': len(orphan_pks)}
+
+
+def _collect_object_group_users(batch: list, dry_run: bool, compact: bool) -> dict:
+    group_ids = set(get_object_group_model().objects.filter(pk__in={row[1] for row in batch})
+                    .values_list('pk', flat=True))
+    user_ids = set(get_user_model().objects.filter(pk__in={row[2] for row in batch}).values_list('pk', flat=True))
+    orphan_pks = [pk for pk, group_id, user_id in batch if group_id not in group_ids or user_id not in user_ids]
+
+    if orphan_pks and not dry_run:
+        get_object_group_model().users.through.objects.filter(pk__in=orphan_pks).delete()
+
+    return {'orphaned': len(orphan_pks)}
+
+
+def _tables(compact: bool) -> list[tuple]:
+    """
+    Get the tables swept for garbage, with the fields of their rows read per batch and the
+    function collecting the garbage of a batch. Object group users only refer to rows whose
+    deletion cascades to them, so they are only swept when compacting.
+    """
+
+    object_group_model = get_object_group_model()
+    tables = [
+        (get_object_permission_model(), ('pk', 'permission_id', 'to_ct_id', 'to_id', 'object_ct_id', 'object_id'),
+         _collect_object_permissions),
+        (object_group_model, ('pk', 'target_ct_id', 'target_id'), _collect_object_groups),
+        (object_group_model.users.through, ('pk', 'group_id', 'user_id'), _collect_object_group_users),
+        (PermissionMask, ('pk', 'to_ct_id', 'to_id', 'object_ct_id', 'object_id'), _collect_permission_masks),
+    ]
+
+    return tables if compact else [table for table in tables if table[2] is not _collect_object_group_users]
+
+
+def _sweep(tables: list[tuple], batch_size: int, dry_run: bool, compact: bool, skip: int, last_pk):
+    for index, (model, fields, collect) in enumerate(tables[skip:], skip):
+        for batch in _batches(model.objects.values_list(*fields), batch_size, last_pk if index == skip else None):
+            yield model._meta.label, batch[-1][0], collect(batch, dry_run, compact)
+
+
+def sweep_orphaned_grants(batch_size=1000, dry_run=False, checkpoint: tuple[str, int] | None = None,
+                          compact=False):
+    """
+    Remove the object permissions, object groups and permission masks of objects that no longer
+    exist. The tables are scanned in primary key order, one batch per transaction, so locks are
+    held briefly and memory use is bounded by the batch size.
+
+    Args:
+        batch_size (int): The number of rows scanned per batch.
+        dry_run (bool): Count the rows without changing them.
+        checkpoint (tuple): The label of a model and the last primary key handled, to resume from.
+        compact (bool): Also collect the garbage described in ``collect_garbage``.
+
+    Returns:
+        Iterator[tuple]: The label of the model and the last primary key of each batch, which serve
+        as checkpoint, and the number of rows that were orphaned, and if compacting duplicates or
+        normalized.
+
+    Raises:
+        ValueError: If the checkpoint names a model that is not swept.
+    """
+
+    tables = _tables(compact)
+    labels = [model._meta.label for model, _, _ in tables]
+
+    if checkpoint and checkpoint[0] not in labels:
+        raise ValueError(f"The checkpoint refers to {checkpoint[0]}, which is not one of {', '.join(labels)}.")
+
+    # Validated eagerly, the rows are only swept as the batches are iterated.
+    return _sweep(tables, batch_size, dry_run, compact, labels.index(checkpoint[0]) if checkpoint else 0,
+                  checkpoint[1] if checkpoint else None)
+
+
+def delete_orphaned_grants(batch_size=1000, dry_run=False) -> tuple[int, int]:
+    """
+    Remove the object permissions and object groups of objects that no longer exist, see
+    ``sweep_orphaned_grants``.
+
+    Args:
+        batch_size (int): The number of rows scanned per batch.
+        dry_run (bool): Count the orphaned rows without removing them.
+
+    Returns:
+        tuple: The number of orphaned object permissions and permission masks, and of object groups.
+    """
+
+    object_group_label = get_object_group_model()._meta.label
+    permissions = object_groups = 0
+
+    for label, _, counts in sweep_orphaned_grants(batch_size, dry_run):
+        if label == object_group_label:
+            object_groups += counts['orphaned']
+        else:
+            permissions += counts['orphaned']
+
+    return permissions, object_groups
+
+
+def collect_garbage(batch_size=1000, dry_run=False, checkpoint: tuple[str, int] | None = None):
+    """
+    Extend the sweep of orphaned grants to object permissions and permission masks referring to
+    missing users, groups or permissions and to object group users of missing users or object
+    groups, and merge object permissions whose ``to_id`` only differs in formatting, e.g.
+    ``' 42'`` and ``'42'``.
+
+    Args:
+        batch_size (int): The number of rows scanned per batch.
+        dry_run (bool): Count the rows without changing them.
+        checkpoint (tuple): The label of a model and the last primary key handled, to resume from.
+
+    Returns:
+        Iterator[tuple]: The batches, as yielded by ``sweep_orphaned_grants``.
+
+    Raises:
+        ValueError: If the checkpoint names a model that is not swept.
+    """
+
+    return sweep_orphaned_grants(batch_size, dry_run, checkpoint, compact=True)
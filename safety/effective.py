@@ -0,0 +1,384 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.models import Group, Permission
+from django.contrib.contenttypes.models import ContentType
+from django.db import connections, transaction
+from django.db.models import Q
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+
+from safety.masks import mask_permission_ids
+from safety.models import EffectivePermission, PermissionMask
+from safety.utils import get_object_permission_model, get_object_group_model, to_id_values
+
+_suspended = ContextVar('safety_effective_permissions_suspended', default=False)
+
+# Instances being deleted, keyed by (model, pk), with the users whose permissions they affected,
+# the database alias and the on_commit callback registered for the deletion.
+_deleting = ContextVar('safety_effective_permissions_deleting', default=None)
+
+
+def effective_permissions_enabled() -> bool:
+    return getattr(settings, 'SAFETY_EFFECTIVE_PERMISSIONS', False)
+
+
+@contextmanager
+def suspend_effective_permissions():
+    """
+    Ignore changes within the block, for bulk operations that refresh the affected
+    permissions themselves once they are done.
+    """
+
+    token = _suspended.set(True)
+    try:
+        yield
+    finally:
+        _suspended.reset(token)
+
+
+def _memberships(user_ids=None, group_ids=None) -> list[tuple]:
+    """
+    Get the Django group memberships of users, or the members of groups, as (user id, group id) pairs.
+    """
+
+    user_model = get_user_model()
+    if not hasattr(user_model, 'groups'):
+        return []
+
+    field = user_model.groups.field
+    user_field, group_field = field.m2m_field_name(), field.m2m_reverse_field_name()
+    memberships = user_model.groups.through.objects.all()
+
+    if user_ids is not None:
+        memberships = memberships.filter(**{f'{user_field}__in': user_ids})
+    if group_ids is not None:
+        memberships = memberships.filter(**{f'{group_field}__in': group_ids})
+
+    return list(memberships.values_list(user_field, group_field))
+
+
+def _is_pending(using: str, callback) -> bool:
+    # The on_commit callbacks of a transaction or savepoint are discarded when it is rolled back,
+    # so a deletion whose callback is gone failed, and its post_delete signal will never come.
+    return any(entry[1] is callback for entry in connections[using].run_on_commit)
+
+
+def _pending_deletions() -> dict:
+    """
+    Get the instances being deleted, forgetting those whose deletion was rolled back.
+    """
+
+    deleting = _deleting.get() or {}
+    pending = {key: value for key, value in deleting.items() if _is_pending(*value[1:])}
+
+    if len(pending) < len(deleting):
+        _deleting.set(pending)
+
+    return pending
+
+
+def _forget_deletion(key):
+    deleting = dict(_deleting.get() or {})
+    if deleting.pop(key, None) is not None:
+        _deleting.set(deleting)
+
+
+def _deleted_pks(model) -> set:
+    return {pk for deleted_model, pk in _pending_deletions() if deleted_model is model}
+
+
+def _grants(object_filter: Q, entity_filter: Q):
+    """
+    Iterate over the object permissions and the permissions set in masks matching the filters, as
+    (to id, permission id, object content type id, object id) rows. Permissions being deleted are left out.
+    """
+
+    deleted = _deleted_pks(Permission)
+
+    yield from get_object_permission_model().objects.filter(object_filter, entity_filter).exclude(
+        permission__in=deleted).values_list('to_id', 'permission_id', 'object_ct_id', 'object_id')
+
+    masks = PermissionMask.objects.filter(object_filter, entity_filter)
+    for to_id, object_ct_id, object_id, mask in masks.values_list('to_id', 'object_ct_id', 'object_id', 'mask'):
+        for permission_id in mask_permission_ids(ContentType.objects.get_for_id(object_ct_id), mask):
+            if permission_id not in deleted:
+                yield to_id, permission_id, object_ct_id, object_id
+
+
+def compute_effective_permissions(user_ids=None, ct: ContentType = None, object_ids=None) -> set[tuple]:
+    """
+    Resolve the permissions users hold on objects from direct grants, grants to their groups
+    and their object groups. Users, permissions and object groups that are being deleted are left out.
+
+    Args:
+        user_ids: Restrict the result to these users.
+        ct (ContentType): Restrict the result to objects of this content type.
+        object_ids: Restrict the result to these objects of type ct.
+
+    Returns:
+        set[tuple]: The permissions, as (user id, permission id, object content type id, object id) rows.
+    """
+
+    user_model = get_user_model()
+    rows = set()
+
+    object_filter = Q(object_ct__isnull=False, object_id__isnull=False)
+    target_filter = Q(group__target_id__isnull=False, group__permissions__isnull=False)
+    if ct is not None:
+        object_filter &= Q(object_ct=ct)
+        target_filter &= Q(group__target_ct=ct)
+    if object_ids is not None:
+        object_filter &= Q(object_id__in=object_ids)
+        target_filter &= Q(group__target_id__in=object_ids)
+
+    # Grants to users that no longer exist are left behind, as to_id is not a foreign key.
+    users = user_model.objects.all() if user_ids is None else user_model.objects.filter(pk__in=user_ids)
+    for to_id, *grant in _grants(object_filter, Q(to_ct=ContentType.objects.get_for_model(user_model),
+                                                  to_id__in=to_id_values(users))):
+        rows.add((user_model._meta.pk.to_python(to_id), *grant))
+
+    group_grants = {}
+    memberships = _memberships(user_ids=user_ids) if user_ids is not None else None
+    group_filter = Q(to_ct=ContentType.objects.get_for_model(Group))
+    if memberships is not None:
+        group_ids = {group_id for _, group_id in memberships}
+        group_filter &= Q(to_id__in=to_id_values(Group.objects.filter(pk__in=group_ids)))
+    for to_id, *grant in _grants(object_filter, group_filter):
+        group_grants.setdefault(Group._meta.pk.to_python(to_id), []).append(tuple(grant))
+
+    if memberships is None:
+        memberships = _memberships(group_ids=list(group_grants))
+    for user_id, group_id in memberships:
+        rows.update((user_id, *grant) for grant in group_grants.get(group_id, ()))
+
+    object_group_model = get_object_group_model()
+    object_group_users = object_group_model.users.through.objects.filter(target_filter).exclude(
+        group__in=_deleted_pks(object_group_model)).exclude(group__permissions__in=_deleted_pks(Permission))
+    if user_ids is not None:
+        object_group_users = object_group_users.filter(user__in=user_ids)
+    rows.update(object_group_users.values_list('user_id', 'group__permissions', 'group__target_ct_id',
+                                               'group__target_id'))
+
+    deleted_users = _deleted_pks(user_model)
+    return {row for row in rows if row[0] not in deleted_users}
+
+
+def refresh_effective_permissions(user_ids=None, ct: ContentType = None, object_ids=None, dry_run=False,
+                                  batch_size=1000) -> tuple[int, int]:
+    """
+    Bring the effective permissions within a scope in line with the grants they are derived
+    from, writing only the rows that changed.
+
+    Args:
+        user_ids: Restrict the refresh to these users.
+        ct (ContentType): Restrict the refresh to objects of this content type.
+        object_ids: Restrict the refresh to these objects of type ct.
+        dry_run (bool): Only count the rows that are out of date.
+        batch_size (int): The number of rows written per query.
+
+    Returns:
+        tuple[int, int]: The number of rows that were missing and of rows that were stale.
+    """
+
+    if user_ids is not None:
+        user_ids = list(user_ids)
+        if not user_ids:
+            return 0, 0
+
+    existing = EffectivePermission.objects.all()
+    if user_ids is not None:
+        existing = existing.filter(user__in=user_ids)
+    if ct is not None:
+        existing = existing.filter(object_ct=ct)
+    if object_ids is not None:
+        existing = existing.filter(object_id__in=object_ids)
+
+    current = {
+        tuple(row): pk for pk, *row in
+        existing.values_list('pk', 'user_id', 'permission_id', 'object_ct_id', 'object_id')
+    }
+    expected = compute_effective_permissions(user_ids, ct, object_ids)
+
+    stale = [pk for row, pk in current.items() if row not in expected]
+    missing = [row for row in expected if row not in current]
+
+    if not dry_run:
+        with transaction.atomic():
+            for start in range(0, len(stale), batch_size):
+                EffectivePermission.objects.filter(pk__in=stale[start:start + batch_size]).delete()
+            EffectivePermission.objects.bulk_create([
+                EffectivePermission(user_id=user_id, permission_id=permission_id, object_ct_id=object_ct_id,
+                                    object_id=object_id)
+                for user_id, permission_id, object_ct_id, object_id in missing
+            ], batch_size=batch_size, ignore_conflicts=True)
+
+    return len(missing), len(stale)
+
+
+def _entity_user_ids(entity_ct: ContentType, entity_id) -> list:
+    if entity_ct.model_class() is Group:
+        return [user_id for user_id, _ in _memberships(group_ids=[entity_id])]
+
+    return [entity_id]
+
+
+def refresh_entities(entities: list, ct: ContentType, object_ids: list):
+    """
+    Refresh the effective permissions of users and of the members of groups on objects.
+    """
+
+    if not effective_permissions_enabled():
+        return
+
+    user_ids = set()
+    for entity in entities:
+        user_ids.update(_entity_user_ids(ContentType.objects.get_for_model(entity), entity.pk))
+
+    refresh_effective_permissions(user_ids, ct, object_ids)
+
+
+def _active() -> bool:
+    return effective_permissions_enabled() and not _suspended.get()
+
+
+def object_permission_changed(sender, instance, **kwargs):
+    if not _active() or instance.object_ct_id is None or instance.object_id is None:
+        return
+
+    refresh_effective_permissions(_entity_user_ids(ContentType.objects.get_for_id(instance.to_ct_id), instance.to_id),
+                                  ContentType.objects.get_for_id(instance.object_ct_id), [instance.object_id])
+
+
+def object_group_user_changed(sender, instance, **kwargs):
+    if not _active() or instance.group_id in _deleted_pks(get_object_group_model()):
+        return
+
+    group = instance.group
+    refresh_effective_permissions([instance.user_id], group.target_ct, [group.target_id])
+
+
+def object_group_users_added(sender, instance, action, reverse, pk_set, **kwargs):
+    # Removed members are handled by object_group_user_changed, as their rows are deleted one by one.
+    if not _active() or action != 'post_add':
+        return
+
+    if reverse:
+        for group in get_object_group_model().objects.filter(pk__in=pk_set):
+            refresh_effective_permissions([instance.pk], group.target_ct, [group.target_id])
+    else:
+        refresh_effective_permissions(pk_set, instance.target_ct, [instance.target_id])
+
+
+def object_group_permissions_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not _active() or action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+
+    groups = get_object_group_model().objects.filter(pk__in=pk_set) if reverse else [instance]
+    for group in groups:
+        refresh_effective_permissions(None, group.target_ct, [group.target_id])
+
+
+def group_members_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not _active():
+        return
+
+    if reverse and action == 'pre_clear':
+        instance._safety_cleared_members = [user_id for user_id, _ in _memberships(group_ids=[instance.pk])]
+    elif action in ('post_add', 'post_remove'):
+        refresh_effective_permissions(pk_set if reverse else [instance.pk])
+    elif action == 'post_clear':
+        refresh_effective_permissions(instance.__dict__.pop('_safety_cleared_members', []) if reverse
+                                      else [instance.pk])
+
+
+def instance_deleting(sender, instance, using, **kwargs):
+    """
+    Remember instances being deleted, so rows derived from them are not recreated while their
+    dependents are deleted, and the users a deleted group or object group affected. If the delete
+    fails, the instance is forgotten once its transaction or savepoint is rolled back.
+    """
+
+    if not _active():
+        return
+
+    if sender is Group:
+        affected = [user_id for user_id, _ in _memberships(group_ids=[instance.pk])]
+    else:
+        affected = None
+
+    key = (sender, instance.pk)
+    # Each deletion gets its own callback, so the liveness of the deletion can be told by it.
+    callback = partial(_forget_deletion, key)
+    _deleting.set({**_pending_deletions(), key: (affected, using, callback)})
+    transaction.on_commit(callback, using=using)
+
+
+def instance_deleted(sender, instance, **kwargs):
+    deleting = dict(_pending_deletions())
+    if (sender, instance.pk) not in deleting:
+        return
+
+    affected, _, _ = deleting.pop((sender, instance.pk))
+    _deleting.set(deleting)
+
+    if not _active():
+        return
+
+    if sender is Group:
+        refresh_effective_permissions(affected)
+    elif sender is get_object_group_model() and instance.target_id is not None:
+        refresh_effective_permissions(None, instance.target_ct, [instance.target_id])
+
+
+def connect_signals():
+    """
+    Maintain the effective permissions on every change of the grants they are derived from.
+    """
+
+    user_model = get_user_model()
+    object_group_model = get_object_group_model()
+
+    post_save.connect(object_permission_changed, sender=get_object_permission_model(),
+                      dispatch_uid='safety_effective_object_permission')
+    post_delete.connect(object_permission_changed, sender=get_object_permission_model(),
+                        dispatch_uid='safety_effective_object_permission')
+
+    post_save.connect(object_group_user_changed, sender=object_group_model.users.through,
+                      dispatch_uid='safety_effective_object_group_user')
+    post_delete.connect(object_group_user_changed, sender=object_group_model.users.through,
+                        dispatch_uid='safety_effective_object_group_user')
+    m2m_changed.connect(object_group_users_added, sender=object_group_model.users.through,
+                        dispatch_uid='safety_effective_object_group_users')
+    m2m_changed.connect(object_group_permissions_changed, sender=object_group_model.permissions.through,
+                        dispatch_uid='safety_effective_object_group_permissions')
+
+    if hasattr(user_model, 'groups'):
+        m2m_changed.connect(group_members_changed, sender=user_model.groups.through,
+                            dispatch_uid='safety_effective_group_members')
+
+    for model in (user_model, Group, Permission, object_group_model):
+        pre_delete.connect(instance_deleting, sender=model, dispatch_uid=f'safety_effective_deleting_{model._meta}')
+        post_delete.connect(instance_deleted, sender=model, dispatch_uid=f'safety_effective_deleted_{model._meta}')
+
+
+def disconnect_signals():
+    user_model = get_user_model()
+    object_group_model = get_object_group_model()
+
+    post_save.disconnect(sender=get_object_permission_model(), dispatch_uid='safety_effective_object_permission')
+    post_delete.disconnect(sender=get_object_permission_model(), dispatch_uid='safety_effective_object_permission')
+    post_save.disconnect(sender=object_group_model.users.through, dispatch_uid='safety_effective_object_group_user')
+    post_delete.disconnect(sender=object_group_model.users.through, dispatch_uid='safety_effective_object_group_user')
+    m2m_changed.disconnect(sender=object_group_model.users.through, dispatch_uid='safety_effective_object_group_users')
+    m2m_changed.disconnect(sender=object_group_model.permissions.through,
+                           dispatch_uid='safety_effective_object_group_permissions')
+
+    if hasattr(user_model, 'groups'):
+        m2m_changed.disconnect(sender=user_model.groups.through, dispatch_uid='safety_effective_group_members')
+
+    for model in (user_model, Group, Permission, object_group_model):
+        pre_delete.disconnect(sender=model, dispatch_uid=f'safety_effective_deleting_{model._meta}')
+        post_delete.disconnect(sender=model, dispatch_uid=f'safety_effective_deleted_{model._meta}')
@@ -0,0 +1,139 @@
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from django.utils.translation import gettext_lazy as _
+
+ID_FIELDS = {
+    'char': lambda verbose_name, **kwargs: models.CharField(verbose_name, max_length=255, **kwargs),
+    'integer': models.IntegerField,
+    'bigint': models.BigIntegerField,
+    'uuid': models.UUIDField,
+}
+
+
+def get_id_type(setting: str, default: str) -> str:
+    """
+    Get the id column type selected by a setting.
+
+    The type is read when the models are loaded and when the migrations run, so switching an
+    existing database to another type is done by migrating back to ``safety 0011`` and forward again.
+    Note that migrating back drops the tables created after 0011 along with their rows, so:
+
+    1. Save the grants stored as masks, if any: ``dumpdata safety.PermissionMask > masks.json``.
+    2. Run ``migrate safety 0011``, change the settings and run ``migrate safety``.
+    3. Restore the masks with ``loaddata masks.json``, rebuild the effective permissions with
+       ``safety_effective_permissions rebuild`` if they are enabled, and the ancestors of
+       hierarchical models with ``safety_rebuild_ancestors``.
+
+    Args:
+        setting (string): The name of the setting.
+        default (string): The type used if the setting is absent.
+    Returns:
+        The selected type, one of ``char``, ``integer``, ``bigint`` and ``uuid``.
+    """
+
+    id_type = getattr(settings, setting, default)
+
+    if id_type not in ID_FIELDS:
+        raise ImproperlyConfigured(f"{setting} must be one of {', '.join(ID_FIELDS)}, not {id_type!r}.")
+
+    return id_type
+
+
+def get_entity_id_type() -> str:
+    return get_id_type('SAFETY_ENTITY_ID_TYPE', 'char')
+
+
+def get_object_id_type() -> str:
+    return get_id_type('SAFETY_OBJECT_ID_TYPE', 'integer')
+
+
+def entity_id_field() -> models.Field:
+    """
+    The field storing the primary key of the user or group a permission is granted to. It
+    should match the primary key type of both the user and group models.
+    """
+
+    return ID_FIELDS[get_entity_id_type()](_('Target ID'))
+
+
+def object_id_field(verbose_name, **kwargs) -> models.Field:
+    """
+    The field storing the primary key of an object that permissions or object groups refer to.
+    """
+
+    return ID_FIELDS[get_object_id_type()](verbose_name, **kwargs)
+
+
+def normalize_id(id_type: str, value) -> str | int | None:
+    """
+    Convert a stored id to the form expected by a column of the given type.
+
+    Returns:
+        The normalized id, or None if the value cannot be converted.
+    """
+
+    if value is None:
+        return None
+
+    try:
+        if id_type in ('integer', 'bigint'):
+            return int(str(value).strip())
+        if id_type == 'uuid':
+            return uuid.UUID(str(value).strip()).hex
+    except ValueError:
+        return None
+
+    return str(value)
+
+
+def normalize_id_columns(apps, schema_editor, chunk_size=10000):
+    """
+    Rewrite the id columns of object permissions and object groups in the form of the
+    selected types, before the columns are altered. Permissions that become duplicates
+    are removed.
+
+    Raises:
+        ValueError: If stored ids cannot be converted to the selected types.
+    """
+
+    columns = (
+        (apps.get_model('safety', 'ObjectPermission'), 'to_id', get_entity_id_type(),
+         ('to_ct', 'to_id', 'permission', 'object_ct', 'object_id')),
+        (apps.get_model('safety', 'ObjectPermission'), 'object_id', get_object_id_type(),
+         ('to_ct', 'to_id', 'permission', 'object_ct', 'object_id')),
+        (apps.get_model('safety', 'ObjectGroup'), 'target_id', get_object_id_type(), None),
+    )
+
+    for model, column, id_type, unique_fields in columns:
+        invalid = 0
+        last_pk = 0
+
+        while True:
+            rows = list(model.objects.filter(pk__gt=last_pk).order_by('pk').values_list('pk', column)[:chunk_size])
+            if not rows:
+                break
+            last_pk = rows[-1][0]
+
+            for pk, value in rows:
+                normalized = normalize_id(id_type, value)
+
+                if normalized is None and value is not None:
+                    invalid += 1
+                    continue
+                if normalized is None or str(normalized) == str(value):
+                    continue
+
+                if unique_fields is not None:
+                    row = model.objects.filter(pk=pk).values(*unique_fields).get()
+                    row[column] = normalized
+                    if model.objects.filter(**row).exclude(pk=pk).exists():
+                        model.objects.filter(pk=pk).delete()
+                        continue
+
+                model.objects.filter(pk=pk).update(**{column: normalized})
+
+        if invalid:
+            raise ValueError(f"{invalid} rows of {model._meta.db_table}.{column} cannot be converted to {id_type}.")
@@ -0,0 +1,222 @@
+from functools import cache
+from itertools import islice
+
+from django.apps import apps
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Q
+from django.db.models.signals import post_delete, post_save
+
+from safety.models import ObjectAncestor
+
+def is_hierarchical(ct: ContentType) -> bool:
+    """
+    Return True if the objects of a content type have parents, whose permissions they inherit.
+    """
+
+    model = ct.model_class()
+    return model is not None and hasattr(model, 'get_permission_parent')
+
+
+def get_hierarchical_models() -> list:
+    """
+    Get the models whose objects inherit the permissions of their parents. These are the models
+    with a ``get_permission_parent`` method returning the parent of an object, or None for roots.
+
+    Grants on an ancestor are inherited by codename, so the models of a hierarchy should share
+    the codenames that are meant to be inherited, e.g. through ``Meta.permissions``.
+
+    The ancestors are maintained by the save and delete signals, assuming that the parent of an
+    object only depends on its foreign keys. Writes that send no signals, such as ``bulk_create``
+    and ``QuerySet.update()`` of a parent, leave them stale until ``sync_ancestors`` is called for
+    the objects or ``rebuild_ancestors`` is run.
+    """
+
+    return [model for model in apps.get_models() if hasattr(model, 'get_permission_parent')]
+
+
+def _ancestors_of(ct_id: int, object_id) -> list[tuple]:
+    return list(ObjectAncestor.objects.filter(descendant_ct_id=ct_id, descendant_id=object_id)
+                .values_list('ancestor_ct_id', 'ancestor_id', 'depth'))
+
+
+def _detach(ct_id: int, object_id):
+    """
+    Remove the rows linking an object and its descendants to the ancestors of the object. The rows
+    within the subtree stay, as the subtree moves as a whole.
+    """
+
+    ancestors = _ancestors_of(ct_id, object_id)
+    if not ancestors:
+        return
+
+    in_subtree = Q(descendant_ct_id=ct_id, descendant_id=object_id) | Q(Exists(ObjectAncestor.objects.filter(
+        ancestor_ct_id=ct_id,
+        ancestor_id=object_id,
+        descendant_ct=OuterRef('descendant_ct'),
+        descendant_id=OuterRef('descendant_id'),
+    )))
+
+    for ancestor_ct_id, ancestor_id, _ in ancestors:
+        ObjectAncestor.objects.filter(in_subtree, ancestor_ct_id=ancestor_ct_id, ancestor_id=ancestor_id).delete()
+
+
+def _attach(ct_id: int, object_id, parent, batch_size: int):
+    """
+    Link an object and its descendants to parent and the ancestors of parent.
+    """
+
+    parent_ct_id = ContentType.objects.get_for_model(parent).id
+    ancestors = [(parent_ct_id, parent.pk, 1)] + [(ancestor_ct_id, ancestor_id, depth + 1) for
+                                                  ancestor_ct_id, ancestor_id, depth in
+                                                  _ancestors_of(parent_ct_id, parent.pk)]
+
+    if (ct_id, str(object_id)) in {(ancestor_ct_id, str(ancestor_id)) for ancestor_ct_id, ancestor_id, _ in ancestors}:
+        raise ValueError("An object cannot be moved under itself or one of its descendants.")
+
+    subtree = [(ct_id, object_id, 0)] + list(ObjectAncestor.objects.filter(ancestor_ct_id=ct_id, ancestor_id=object_id)
+                                             .values_list('descendant_ct_id', 'descendant_id', 'depth'))
+
+    rows = (ObjectAncestor(ancestor_ct_id=ancestor_ct_id, ancestor_id=ancestor_id, descendant_ct_id=descendant_ct_id,
+                           descendant_id=descendant_id, depth=ancestor_depth + descendant_depth)
+            for descendant_ct_id, descendant_id, descendant_depth in subtree
+            for ancestor_ct_id, ancestor_id, ancestor_depth in ancestors)
+
+    while batch := list(islice(rows, batch_size)):
+        ObjectAncestor.objects.bulk_create(batch)
+
+
+def sync_ancestors(obj, created=False, batch_size=1000) -> bool:
+    """
+    Update the ancestors of an object and its descendants after the parent of the object may have
+    changed. Only the rows linking the subtree of the object to its former and new ancestors are
+    replaced. Called when objects are saved; objects created with ``bulk_create`` or moved with
+    ``QuerySet.update()`` need to be synced explicitly.
+
+    Args:
+        obj: The object, whose model has a ``get_permission_parent`` method.
+        created (bool): The object was just created, so it has neither ancestors nor descendants.
+        batch_size (int): The maximum number of rows inserted per statement.
+
+    Returns:
+        bool: True if the object was moved, False if its parent did not change.
+    """
+
+    ct_id = ContentType.objects.get_for_model(obj).id
+    parent = obj.get_permission_parent()
+    parent_key = None if parent is None else (ContentType.objects.get_for_model(parent).id, str(parent.pk))
+
+    current = None if created else ObjectAncestor.objects.filter(
+        descendant_ct_id=ct_id, descendant_id=obj.pk, depth=1).values_list('ancestor_ct_id', 'ancestor_id').first()
+
+    if (current and (current[0], str(current[1]))) == parent_key:
+        return False
+
+    with transaction.atomic():
+        if not created:
+            _detach(ct_id, obj.pk)
+        if parent is not None:
+            _attach(ct_id, obj.pk, parent, batch_size)
+
+    return True
+
+
+@cache
+def _parent_fields(model) -> tuple[tuple[str, str], ...]:
+    """
+    Get the names and attribute names of the fields the parent of an object may be derived from,
+    the foreign keys including those of generic foreign keys.
+    """
+
+    fields = [(field.name, field.attname) for field in model._meta.concrete_fields if field.is_relation]
+    fields += [(field.fk_field, field.fk_field) for field in model._meta.private_fields
+               if isinstance(field, GenericForeignKey)]
+
+    return tuple(fields)
+
+
+def object_saved(sender, instance, created, raw=False, update_fields=None, **kwargs):
+    """
+    Signal receiver syncing the ancestors of a saved object. Saves whose ``update_fields`` leave
+    out its foreign keys cost no queries, other saves compare the parent with the stored one.
+    """
+
+    if raw:
+        return
+
+    if not created and update_fields is not None and \
+            not any({name, attname} & update_fields for name, attname in _parent_fields(sender)):
+        return
+
+    sync_ancestors(instance, created=created)
+
+
+def object_deleted(sender, instance, **kwargs):
+    """
+    Signal receiver removing a deleted object from the hierarchy. Its descendants that are not
+    deleted along with it, e.g. through ``SET_NULL``, become roots of their own subtrees.
+    """
+
+    ct_id = ContentType.objects.get_for_model(sender).id
+
+    with transaction.atomic():
+        _detach(ct_id, instance.pk)
+        ObjectAncestor.objects.filter(ancestor_ct_id=ct_id, ancestor_id=instance.pk).delete()
+
+
+def track_hierarchy(model):
+    """
+    Maintain the ancestors of the objects of a model as they are saved and deleted.
+    """
+
+    post_save.connect(object_saved, sender=model, dispatch_uid=f'safety_hierarchy_save_{model._meta.label}')
+    post_delete.connect(object_deleted, sender=model, dispatch_uid=f'safety_hierarchy_delete_{model._meta.label}')
+
+
+def untrack_hierarchy(model):
+    post_save.disconnect(sender=model, dispatch_uid=f'safety_hierarchy_save_{model._meta.label}')
+    post_delete.disconnect(sender=model, dispatch_uid=f'safety_hierarchy_delete_{model._meta.label}')
+
+
+def rebuild_ancestors(batch_size=1000) -> int:
+    """
+    Rebuild the ancestors of all objects of the hierarchical models from their parents, e.g.
+    after adding ``get_permission_parent`` to a model with existing objects. The parents of all
+    objects are held in memory while the table is rebuilt.
+
+    Args:
+        batch_size (int): The number of objects loaded and rows inserted per statement.
+
+    Returns:
+        int: The number of rows created.
+    """
+
+    parents = {}
+
+    for model in get_hierarchical_models():
+        ct_id = ContentType.objects.get_for_model(model).id
+        for obj in model._base_manager.iterator(chunk_size=batch_size):
+            parent = obj.get_permission_parent()
+            if parent is not None:
+                parents[(ct_id, obj.pk)] = (ContentType.objects.get_for_model(parent).id, parent.pk)
+
+    def ancestors(key):
+        depth = 0
+        while (key := parents.get(key)) is not None:
+            depth += 1
+            if depth > len(parents):
+                raise ValueError("The parents of the objects contain a cycle.")
+            yield key, depth
+
+    rows = (ObjectAncestor(ancestor_ct_id=ancestor[0], ancestor_id=ancestor[1], descendant_ct_id=descendant[0],
+                           descendant_id=descendant[1], depth=depth)
+            for descendant in parents for ancestor, depth in ancestors(descendant))
+    created = 0
+
+    with transaction.atomic():
+        ObjectAncestor.objects.all().delete()
+        while batch := list(islice(rows, batch_size)):
+            created += len(ObjectAncestor.objects.bulk_create(batch))
+
+    return created
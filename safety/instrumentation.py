@@ -0,0 +1,151 @@
+import functools
+import inspect
+import time
+from contextlib import contextmanager, ExitStack
+from contextvars import ContextVar
+from typing import NamedTuple
+
+from asgiref.sync import sync_to_async
+from django.db import connections
+from django.dispatch import Signal
+
+# Sent after every call to a public function of safety.perms and safety.object_group, with
+# the PermissionCall describing it as the ``call`` argument and the function as the sender.
+permission_called = Signal()
+
+_current_call = ContextVar('safety_current_call', default=None)
+
+
+class PermissionCall(NamedTuple):
+    """
+    The cost of a single call to the permission API.
+    """
+
+    function: str
+    duration: float
+    queries: int
+    cache_hits: int
+    cache_misses: int
+
+    @property
+    def cache_status(self) -> str | None:
+        """
+        ``miss`` if any permissions had to be loaded, ``hit`` if all of them were served from
+        a cache, or None if no cache was consulted.
+        """
+
+        if self.cache_misses:
+            return 'miss'
+        if self.cache_hits:
+            return 'hit'
+        return None
+
+
+class _Counters:
+    __slots__ = ('queries', 'cache_hits', 'cache_misses', 'executing')
+
+    def __init__(self):
+        self.queries = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.executing = False
+
+
+def _count_query(execute, sql, params, many, context):
+    # The current call is looked up in the context, which is also that of the threads running
+    # the queries of async calls, so concurrent calls sharing a connection are told apart. Each
+    # of them installs the wrapper, so a query only counts in the outermost one.
+    counters = _current_call.get()
+    if counters is None or counters.executing:
+        return execute(sql, params, many, context)
+
+    counters.queries += 1
+    counters.executing = True
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        counters.executing = False
+
+
+def _count_queries() -> ExitStack:
+    """
+    Count the queries of the current call on the connections of the current thread until the
+    returned stack is closed. The wrappers are only installed while a call is measured, so the
+    wrappers of the caller are left alone and other queries pay nothing.
+    """
+
+    stack = ExitStack()
+    # Creating the connection of an alias does not connect to the database, so connections
+    # first used by the call are counted as well.
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(_count_query))
+    return stack
+
+
+def record_cache_hit():
+    counters = _current_call.get()
+    if counters is not None:
+        counters.cache_hits += 1
+
+
+def record_cache_miss():
+    counters = _current_call.get()
+    if counters is not None:
+        counters.cache_misses += 1
+
+
+@contextmanager
+def _measure(func, name: str):
+    counters = _Counters()
+    token = _current_call.set(counters)
+    start = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        duration = time.perf_counter() - start
+        _current_call.reset(token)
+        permission_called.send(sender=func, call=PermissionCall(
+            name, duration, counters.queries, counters.cache_hits, counters.cache_misses))
+
+
+def _should_measure() -> bool:
+    return _current_call.get() is None and permission_called.has_listeners()
+
+
+def instrumented(func):
+    """
+    Report every call to a permission API function through the ``permission_called`` signal.
+
+    Calls made from within another instrumented function are accounted to the outer call.
+    Nothing is measured while no receiver is connected.
+    """
+
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    if inspect.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def async_wrapper(*args, **kwargs):
+            if not _should_measure():
+                return await func(*args, **kwargs)
+
+            with _measure(func, name):
+                # The queries run in the thread of sync_to_async, whose connections are not
+                # those of the event loop.
+                stack = await sync_to_async(_count_queries)()
+                try:
+                    return await func(*args, **kwargs)
+                finally:
+                    await sync_to_async(stack.close)()
+
+        return async_wrapper
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if not _should_measure():
+            return func(*args, **kwargs)
+
+        with _measure(func, name), _count_queries():
+            return func(*args, **kwargs)
+
+    return wrapper
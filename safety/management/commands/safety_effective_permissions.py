@@ -0,0 +1,37 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from safety.effective import refresh_effective_permissions
+
+
+class Command(BaseCommand):
+    help = "Rebuild the effective permissions, or check that they match the grants they are derived from."
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=('rebuild', 'check'))
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="The number of users whose permissions are handled in one transaction.")
+
+    def handle(self, *args, **options):
+        check = options['action'] == 'check'
+        batch_size = options['batch_size']
+        users = get_user_model().objects.order_by('pk').values_list('pk', flat=True)
+        missing = stale = 0
+        last_pk = None
+
+        while True:
+            user_ids = list((users if last_pk is None else users.filter(pk__gt=last_pk))[:batch_size])
+            if not user_ids:
+                break
+            last_pk = user_ids[-1]
+
+            batch_missing, batch_stale = refresh_effective_permissions(user_ids, dry_run=check, batch_size=batch_size)
+            missing += batch_missing
+            stale += batch_stale
+
+        if check:
+            if missing or stale:
+                raise CommandError(f"{missing} effective permissions are missing and {stale} are stale.")
+            self.stdout.write("The effective permissions are consistent.")
+        else:
+            self.stdout.write(f"Added {missing} and removed {stale} effective permissions.")
@@ -0,0 +1,59 @@
+import json
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+
+from safety.cleanup import sweep_orphaned_grants
+
+
+class Command(BaseCommand):
+    help = ("Remove the object permissions, object groups and permission masks of objects that no longer exist. "
+            "Unless --orphans-only is given, also remove those referring to missing users, groups or permissions "
+            "and object group users of missing users, and merge object permissions whose to_id only differs in "
+            "formatting.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="The number of rows scanned and changed in one transaction.")
+        parser.add_argument('--dry-run', action='store_true', help="Count the rows without changing them.")
+        parser.add_argument('--orphans-only', action='store_true',
+                            help="Only remove the grants of objects that no longer exist.")
+        parser.add_argument('--checkpoint',
+                            help="A file recording the progress after every batch. If it exists, the collection "
+                                 "resumes where it stopped; it is removed once the collection completes.")
+
+    def handle(self, *args, **options):
+        path = options['checkpoint']
+        checkpoint = None
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as file:
+                    state = json.load(file)
+                checkpoint = (state['model'], state['pk'])
+            except (KeyError, TypeError, ValueError) as e:
+                raise CommandError(f"The checkpoint file {path} is invalid: {e}") from e
+            self.stdout.write(f"Resuming after {state['model']} {state['pk']}.")
+
+        try:
+            batches = sweep_orphaned_grants(options['batch_size'], options['dry_run'], checkpoint,
+                                            compact=not options['orphans_only'])
+        except ValueError as e:
+            raise CommandError(str(e)) from e
+
+        totals = {}
+        for label, last_pk, counts in batches:
+            for key, count in counts.items():
+                totals.setdefault(label, {}).setdefault(key, 0)
+                totals[label][key] += count
+
+            if path:
+                with open(path, 'w') as file:
+                    json.dump({'model': label, 'pk': last_pk}, file)
+
+        if path and os.path.exists(path):
+            os.remove(path)
+
+        action = "Found" if options['dry_run'] else "Collected"
+        for label, counts in totals.items():
+            self.stdout.write(f"{action} {label}: " + ", ".join(f"{count} {key}" for key, count in counts.items()))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from safety.hierarchy import rebuild_ancestors
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ancestors of the objects of hierarchical models from their parents."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help="The number of objects loaded and rows inserted per statement.")
+
+    def handle(self, *args, **options):
+        created = rebuild_ancestors(options['batch_size'])
+        self.stdout.write(f"Created {created} object ancestors.")
@@ -0,0 +1,39 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db import models
+
+
+class PermissionQuerySetMixin:
+    """
+    Adds permission checks evaluated in the database to the QuerySet of a model protected by safety.
+    """
+
+    def with_perm(self, entity, codename: str, alias: str = None, with_group_users=False):
+        """
+        Annotate every row with whether the entity has a permission on it. The check runs in
+        the database, so the rows can be filtered, ordered and aggregated on the annotation.
+
+        Args:
+            entity: The user or group to check the permission for.
+            codename (string): The permission to check.
+            alias (string): The name of the annotation, defaults to ``has_<codename>``.
+            with_group_users (bool): Regard permissions granted to the groups of a user, like has_gross_perm.
+
+        Returns:
+            QuerySet: The annotated QuerySet.
+        """
+
+        # pylint: disable-next=import-outside-toplevel
+        from safety.perms import _has_perm_expression
+
+        condition = _has_perm_expression(entity, codename, ContentType.objects.get_for_model(self.model),
+                                         with_group_users=with_group_users)
+
+        return self.annotate(**{alias or f"has_{codename}": models.ExpressionWrapper(
+            condition, output_field=models.BooleanField())})
+
+
+class PermissionQuerySet(PermissionQuerySetMixin, models.QuerySet):
+    pass
+
+
+PermissionManager = models.Manager.from_queryset(PermissionQuerySet)
@@ -0,0 +1,135 @@
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.core.exceptions import ImproperlyConfigured
+from django.db.models import F, QuerySet
+from django.db.models.lookups import GreaterThan
+
+from safety.models import PermissionMask
+from safety.registry import permission_registry
+
+# The number of bits of a signed 64-bit column, leaving out the sign bit.
+MAX_CODENAMES = 63
+
+_registered = {}
+
+
+def register_permission_mask(model, codenames: list[str]):
+    """
+    Store the object permissions of a model as bitmasks over a list of codenames, in addition
+    to the models listed in the ``SAFETY_PERMISSION_MASKS`` setting as ``{'app_label.ModelName':
+    [codenames]}``. The position of a codename is its bit, so codenames may only be appended.
+
+    Args:
+        model: The model whose object permissions are stored as bitmasks.
+        codenames (list[str]): The codenames that can be granted on objects of the model.
+    """
+
+    if len(codenames) > MAX_CODENAMES:
+        raise ImproperlyConfigured(f"At most {MAX_CODENAMES} codenames can be stored in a permission mask.")
+
+    _registered[model._meta.label_lower] = list(codenames)
+
+
+def get_mask_codenames(ct: ContentType) -> list[str] | None:
+    """
+    Get the codenames of the bits of the permission masks of a content type.
+
+    Returns:
+        list[str] | None: The codenames, or None if the object permissions are not stored as bitmasks.
+    """
+
+    label = f'{ct.app_label}.{ct.model}'
+
+    if label in _registered:
+        return _registered[label]
+
+    for key, codenames in getattr(settings, 'SAFETY_PERMISSION_MASKS', {}).items():
+        if key.lower() == label:
+            if len(codenames) > MAX_CODENAMES:
+                raise ImproperlyConfigured(f"At most {MAX_CODENAMES} codenames can be stored in a permission mask.")
+            return codenames
+
+    return None
+
+
+def _masked_labels() -> list[str]:
+    return sorted({*_registered, *(key.lower() for key in getattr(settings, 'SAFETY_PERMISSION_MASKS', {}))})
+
+
+def get_masked_models() -> list:
+    """
+    Get the models whose object permissions are stored as bitmasks.
+    """
+
+    return [apps.get_model(label) for label in _masked_labels()]
+
+
+def masked_content_types() -> list[ContentType]:
+    """
+    Get the content types whose object permissions are stored as bitmasks. This may query the
+    content types, which async code should have cached with ``get_masked_models`` beforehand.
+    """
+
+    return [ContentType.objects.get_by_natural_key(*label.split('.')) for label in _masked_labels()]
+
+
+def uses_masks(ct: ContentType) -> bool:
+    return get_mask_codenames(ct) is not None
+
+
+def mask_of(ct: ContentType, perms: list[str], strict=False) -> int:
+    """
+    Get the bits of permissions in the masks of a content type.
+
+    Args:
+        ct (ContentType): The content type of the objects.
+        perms (list[str]): The codenames of the permissions.
+        strict (bool): Raise a ValueError for codenames that are not registered, instead of ignoring them.
+    """
+
+    codenames = get_mask_codenames(ct)
+    mask = 0
+
+    for perm in perms:
+        if perm in codenames:
+            mask |= 1 << codenames.index(perm)
+        elif strict:
+            raise ValueError(f"{perm} is not in the permission mask of {ct.app_label}.{ct.model}.")
+
+    return mask
+
+
+def codenames_of(ct: ContentType, mask: int) -> list[str]:
+    """
+    Get the codenames of the permissions set in a mask, in registration order.
+    """
+
+    return [codename for bit, codename in enumerate(get_mask_codenames(ct) or []) if mask & (1 << bit)]
+
+
+def with_bits(bits: int):
+    return F('mask').bitor(bits)
+
+
+def without_bits(bits: int):
+    # Subtracting the bits that are set clears them, as expressions have no bitwise not.
+    return F('mask') - F('mask').bitand(bits)
+
+
+def mask_grants(ct: ContentType, perms: list[str]) -> QuerySet:
+    """
+    Select the masks granting any of the permissions on objects of a content type. Like object
+    permissions, the rows have ``to_ct``, ``to_id``, ``object_ct`` and ``object_id`` fields.
+    """
+
+    return PermissionMask.objects.filter(GreaterThan(F('mask').bitand(mask_of(ct, perms)), 0), object_ct=ct)
+
+
+def mask_permission_ids(ct: ContentType, mask: int) -> list[int]:
+    """
+    Get the ids of the permissions set in a mask, leaving out permissions that do not exist.
+    """
+
+    return [permission_id for permission_id in (permission_registry.get_id(ct, codename)
+                                                for codename in codenames_of(ct, mask)) if permission_id is not None]
@@ -0,0 +1,79 @@
+import logging
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from safety.cache import permission_cache
+from safety.instrumentation import PermissionCall, permission_called
+
+logger = logging.getLogger('safety.instrumentation')
+
+_request_calls = ContextVar('safety_request_calls', default=None)
+
+
+class PermissionCacheMiddleware:
+    """
+    Caches object permissions for the duration of each request, so repeated calls to
+    ``has_perm``, ``has_gross_perm`` and ``get_perms`` are answered from memory.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        with permission_cache():
+            return self.get_response(request)
+
+
+def collect_permission_call(sender, call: PermissionCall, **kwargs):
+    calls = _request_calls.get()
+    if calls is not None:
+        calls.append(call)
+
+
+def summarize_calls(calls: list[PermissionCall]) -> dict:
+    """
+    Aggregate the calls made to the permission API.
+
+    Returns:
+        dict: The number of calls, queries, cache hits and misses, and the total duration in milliseconds.
+    """
+
+    return {
+        'calls': len(calls),
+        'queries': sum(call.queries for call in calls),
+        'time_ms': round(sum(call.duration for call in calls) * 1000, 3),
+        'cache_hits': sum(call.cache_hits for call in calls),
+        'cache_misses': sum(call.cache_misses for call in calls),
+    }
+
+
+class PermissionInstrumentationMiddleware:
+    """
+    Aggregates the calls made to the permission API during each request and logs them to the
+    ``safety.instrumentation`` logger. If the ``SAFETY_INSTRUMENTATION_HEADER`` setting names a
+    header, the summary is also added to the response, e.g. ``calls=3;queries=2;time_ms=1.5;...``.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        permission_called.connect(collect_permission_call, dispatch_uid='safety_collect_permission_call')
+
+    def __call__(self, request):
+        calls = []
+        token = _request_calls.set(calls)
+        try:
+            response = self.get_response(request)
+        finally:
+            _request_calls.reset(token)
+
+        if calls:
+            summary = summarize_calls(calls)
+            logger.info('%s %s: %s', request.method, request.path,
+                        ', '.join(f'{key}={value}' for key, value in summary.items()))
+
+            header = getattr(settings, 'SAFETY_INSTRUMENTATION_HEADER', None)
+            if header:
+                response[header] = ';'.join(f'{key}={value}' for key, value in summary.items())
+
+        return response
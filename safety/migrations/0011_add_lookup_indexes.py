@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-17 01:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('safety', '0010_alter_objectgroupuser_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='objectgroup',
+            index=models.Index(fields=['target_ct', 'target_id', 'name'], name='safety_obje_target__9b0b16_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objectgroupuser',
+            index=models.Index(fields=['user', 'group'], name='safety_obje_user_id_54f9f3_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='objectpermission',
+            index=models.Index(fields=['object_ct', 'object_id', 'permission'], name='safety_obje_object__794222_idx'),
+        ),
+    ]
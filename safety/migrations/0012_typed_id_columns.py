@@ -0,0 +1,34 @@
+from django.db import migrations
+from django.utils.translation import gettext_lazy as _
+
+from safety.fields import entity_id_field, normalize_id_columns, object_id_field
+
+
+class Migration(migrations.Migration):
+    """
+    Gives the id columns the types selected by the SAFETY_ENTITY_ID_TYPE and SAFETY_OBJECT_ID_TYPE
+    settings. With the default settings, the columns are unchanged.
+    """
+
+    dependencies = [
+        ('safety', '0011_add_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalize_id_columns, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='objectpermission',
+            name='to_id',
+            field=entity_id_field(),
+        ),
+        migrations.AlterField(
+            model_name='objectpermission',
+            name='object_id',
+            field=object_id_field(_('Object ID'), null=True),
+        ),
+        migrations.AlterField(
+            model_name='objectgroup',
+            name='target_id',
+            field=object_id_field(_('Target ID'), null=True),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:04
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.translation import gettext_lazy as _
+
+from safety.fields import object_id_field
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('auth', '0012_alter_user_first_name_max_length'),
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('safety', '0012_typed_id_columns'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EffectivePermission',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('object_id', object_id_field(_('Object ID'))),
+                ('object_ct', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='effective_object_of', to='contenttypes.contenttype', verbose_name='Target Content Type')),
+                ('permission', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='auth.permission', verbose_name='Permission')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User')),
+            ],
+            options={
+                'verbose_name': 'Effective Permission',
+                'verbose_name_plural': 'Effective Permissions',
+                'indexes': [models.Index(fields=['object_ct', 'object_id'], name='safety_effe_object__0dd133_idx')],
+                'unique_together': {('user', 'object_ct', 'permission', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:26
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.translation import gettext_lazy as _
+
+from safety.fields import entity_id_field, object_id_field
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('safety', '0013_effective_permissions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PermissionMask',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('to_id', entity_id_field()),
+                ('object_id', object_id_field(_('Object ID'))),
+                ('mask', models.BigIntegerField(default=0, verbose_name='Mask')),
+                ('object_ct', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mask_object_of', to='contenttypes.contenttype', verbose_name='Target Content Type')),
+                ('to_ct', models.ForeignKey(limit_choices_to={'model__in': ('user', 'group')}, on_delete=django.db.models.deletion.CASCADE, related_name='mask_entity_of', to='contenttypes.contenttype', verbose_name='Content Type')),
+            ],
+            options={
+                'verbose_name': 'Permission Mask',
+                'verbose_name_plural': 'Permission Masks',
+                'indexes': [models.Index(fields=['object_ct', 'object_id'], name='safety_perm_object__b60162_idx')],
+                'unique_together': {('to_ct', 'to_id', 'object_ct', 'object_id')},
+            },
+        ),
+    ]
@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-17 02:35
+
+from django.db import migrations, models
+import django.db.models.deletion
+from django.utils.translation import gettext_lazy as _
+
+from safety.fields import object_id_field
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('safety', '0014_permission_masks'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ObjectAncestor',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('ancestor_id', object_id_field(_('Ancestor ID'))),
+                ('descendant_id', object_id_field(_('Descendant ID'))),
+                ('depth', models.PositiveIntegerField(verbose_name='Depth')),
+                ('ancestor_ct', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_of', to='contenttypes.contenttype', verbose_name='Ancestor Content Type')),
+                ('descendant_ct', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_of', to='contenttypes.contenttype', verbose_name='Descendant Content Type')),
+            ],
+            options={
+                'verbose_name': 'Object Ancestor',
+                'verbose_name_plural': 'Object Ancestors',
+                'indexes': [models.Index(fields=['ancestor_ct', 'ancestor_id'], name='safety_obje_ancesto_f6fac2_idx')],
+                'unique_together': {('descendant_ct', 'descendant_id', 'ancestor_ct', 'ancestor_id')},
+            },
+        ),
+    ]
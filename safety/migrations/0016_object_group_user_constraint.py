@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-17 03:02
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('safety', '0015_object_ancestors'),
+    ]
+
+    # The constraint is created first, as some databases require an index on the foreign key at all times.
+    operations = [
+        migrations.AddConstraint(
+            model_name='objectgroupuser',
+            constraint=models.UniqueConstraint(fields=('user', 'group'), name='safety_objectgroupuser_user_group_uniq'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='objectgroupuser',
+            unique_together=set(),
+        ),
+        migrations.RemoveIndex(
+            model_name='objectgroupuser',
+            name='safety_obje_user_id_54f9f3_idx',
+        ),
+        migrations.AlterField(
+            model_name='objectgroupuser',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='User'),
+        ),
+    ]
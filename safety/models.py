@@ -3,6 +3,8 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.db import models
 from django.utils.translation import gettext_lazy as _
 
+from safety.fields import entity_id_field, object_id_field
+
 
 class AbstractObjectPermission(models.Model):
     """
@@ -12,11 +14,11 @@ class AbstractObjectPermission(models.Model):
     permission = models.ForeignKey('auth.Permission', on_delete=models.CASCADE, verbose_name=_('Permission'))
 
     to = GenericForeignKey('to_ct', 'to_id')
-    to_id = models.CharField(_('Target ID'), max_length=255)
+    to_id = entity_id_field()
     to_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE, verbose_name=_('Content Type'),
                               limit_choices_to={'model__in': ('user', 'group')}, related_name='entity_of')
 
-    object_id = models.IntegerField(_('Object ID'), null=True)
+    object_id = object_id_field(_('Object ID'), null=True)
     object_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE,
                                   verbose_name=_('Target Content Type'), related_name='object_of', blank=True,
                                   null=True)
@@ -24,6 +26,11 @@ class AbstractObjectPermission(models.Model):
 
     class Meta:
         unique_together = (('to_ct', 'to_id', 'permission', 'object_ct', 'object_id'),)
+        indexes = [
+            # Lookups by entity are served by the unique constraint, lookups by object are not,
+            # e.g. has_perm and get_users_with_perms.
+            models.Index(fields=['object_ct', 'object_id', 'permission']),
+        ]
         abstract = True
 
     def __str__(self):
@@ -43,11 +50,16 @@ class AbstractObjectGroupUser(models.Model):
 
     group = models.ForeignKey('safety.ObjectGroup', on_delete=models.CASCADE, verbose_name=_('Group'))
 
-    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('User'))
+    # Lookups by user are served by the constraint below.
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('User'),
+                             db_index=False)
 
     class Meta:
         abstract = True
-        unique_together = (('group', 'user'),)
+        constraints = [
+            # Leads with the user for the object groups of a user; lookups by group use its foreign key.
+            models.UniqueConstraint(fields=['user', 'group'], name='%(app_label)s_%(class)s_user_group_uniq'),
+        ]
 
     def __str__(self):
         return f'{self.user} is in {self.group}'
@@ -70,18 +82,114 @@ class AbstractObjectGroup(models.Model):
     users = models.ManyToManyField(settings.AUTH_USER_MODEL, through=ObjectGroupUser, verbose_name=_('Users'))
 
     target = GenericForeignKey('target_ct', 'target_id')
-    target_id = models.IntegerField(_('Target ID'), null=True)
+    target_id = object_id_field(_('Target ID'), null=True)
     target_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE,
                                   verbose_name=_('Target Content Type'), related_name='obj_group_target_ct_of')
 
     class Meta:
         abstract = True
+        indexes = [
+            models.Index(fields=['target_ct', 'target_id', 'name']),
+        ]
 
     def __str__(self):
         return self.name
 
 
 class ObjectGroup(AbstractObjectGroup):
-    class Meta:
+    class Meta(AbstractObjectGroup.Meta):
         verbose_name = _('Permission Group')
         verbose_name_plural = _('Permission Groups')
+
+
+class EffectivePermission(models.Model):
+    """
+    A permission a user holds on an object, directly, through one of their groups or through an
+    object group. The rows are derived from the other models and maintained by safety when
+    ``SAFETY_EFFECTIVE_PERMISSIONS`` is enabled, so that checks regarding every source of
+    permissions are a single indexed lookup.
+    """
+
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, verbose_name=_('User'))
+    permission = models.ForeignKey('auth.Permission', on_delete=models.CASCADE, verbose_name=_('Permission'))
+
+    object_id = object_id_field(_('Object ID'))
+    object_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE,
+                                  verbose_name=_('Target Content Type'), related_name='effective_object_of')
+    object = GenericForeignKey('object_ct', 'object_id')
+
+    class Meta:
+        # Serves both checks on an object and listing the objects a user has a permission on.
+        unique_together = (('user', 'object_ct', 'permission', 'object_id'),)
+        indexes = [
+            models.Index(fields=['object_ct', 'object_id']),
+        ]
+        verbose_name = _('Effective Permission')
+        verbose_name_plural = _('Effective Permissions')
+
+    def __str__(self):
+        return f'{self.user} has {self.permission} on {self.object}'
+
+
+class PermissionMask(models.Model):
+    """
+    The object permissions of a user or group on an object, stored as one row with a bit per
+    codename registered for the model of the object, see ``SAFETY_PERMISSION_MASKS``. Models
+    registered there have their object permissions stored here instead of in ObjectPermission.
+    """
+
+    to = GenericForeignKey('to_ct', 'to_id')
+    to_id = entity_id_field()
+    to_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE, verbose_name=_('Content Type'),
+                              limit_choices_to={'model__in': ('user', 'group')}, related_name='mask_entity_of')
+
+    object_id = object_id_field(_('Object ID'))
+    object_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE,
+                                  verbose_name=_('Target Content Type'), related_name='mask_object_of')
+    object = GenericForeignKey('object_ct', 'object_id')
+
+    mask = models.BigIntegerField(_('Mask'), default=0)
+
+    class Meta:
+        unique_together = (('to_ct', 'to_id', 'object_ct', 'object_id'),)
+        indexes = [
+            models.Index(fields=['object_ct', 'object_id']),
+        ]
+        verbose_name = _('Permission Mask')
+        verbose_name_plural = _('Permission Masks')
+
+    def __str__(self):
+        return f'{self.to} has permissions {self.mask:#x} on {self.object}'
+
+
+class ObjectAncestor(models.Model):
+    """
+    A row of the closure table of the object hierarchy: the ancestor is the parent of the descendant,
+    the parent of its parent and so on, ``depth`` levels up. Objects inherit the permissions granted
+    on their ancestors. The rows are maintained by safety for models with a ``get_permission_parent``
+    method, see ``safety.hierarchy``.
+    """
+
+    ancestor_id = object_id_field(_('Ancestor ID'))
+    ancestor_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE,
+                                    verbose_name=_('Ancestor Content Type'), related_name='ancestor_of')
+    ancestor = GenericForeignKey('ancestor_ct', 'ancestor_id')
+
+    descendant_id = object_id_field(_('Descendant ID'))
+    descendant_ct = models.ForeignKey('contenttypes.ContentType', on_delete=models.CASCADE,
+                                      verbose_name=_('Descendant Content Type'), related_name='descendant_of')
+    descendant = GenericForeignKey('descendant_ct', 'descendant_id')
+
+    depth = models.PositiveIntegerField(_('Depth'))
+
+    class Meta:
+        # The ancestors of an object, joined by checks; the index serves moving the descendants of an object.
+        unique_together = (('descendant_ct', 'descendant_id', 'ancestor_ct', 'ancestor_id'),)
+        indexes = [
+            models.Index(fields=['ancestor_ct', 'ancestor_id']),
+        ]
+        verbose_name = _('Object Ancestor')
+        verbose_name_plural = _('Object Ancestors')
+
+    def __str__(self):
+        return f'{self.ancestor} is an ancestor of {self.descendant}'
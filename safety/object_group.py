@@ -1,11 +1,19 @@
+from django.conf import settings
 from django.contrib.auth import get_user_model
-from django.contrib.auth.models import Permission
 from django.contrib.contenttypes.models import ContentType
+from django.db import connection, transaction
+from django.db.models import QuerySet
 
+from safety.cache import PERM_CACHE_NAME, invalidate
+from safety.effective import effective_permissions_enabled, refresh_effective_permissions, \
+    suspend_effective_permissions
+from safety.instrumentation import instrumented
 from safety.models import ObjectGroup
+from safety.registry import permission_registry
 from safety.utils import get_object_group_model
 
 
+@instrumented
 def retrieve_object_group(name: str, obj) -> ObjectGroup:
     """
     Get an object group.
@@ -22,6 +30,29 @@ def retrieve_object_group(name: str, obj) -> ObjectGroup:
                                                 target_ct=ContentType.objects.get_for_model(obj))
 
 
+@instrumented
+def get_object_groups_for_user(user: get_user_model(), model_or_ct) -> QuerySet:
+    """
+    Get the object groups a user is a member of on objects of a type, e.g. to list the
+    projects of a user along with their role in each.
+
+    The memberships are found through the index of object group users by user, and the
+    targets of the groups are fetched with one query when the QuerySet is evaluated.
+
+    Args:
+        user: The user to get the groups of.
+        model_or_ct: The model, or its content type, of the objects the groups are on.
+
+    Returns:
+        QuerySet: The object groups, ordered by primary key, with their targets prefetched.
+    """
+
+    ct = model_or_ct if isinstance(model_or_ct, ContentType) else ContentType.objects.get_for_model(model_or_ct)
+
+    return get_object_group_model().objects.filter(target_ct=ct, users=user).prefetch_related('target').order_by('pk')
+
+
+@instrumented
 def create_object_group(name: str, permissions: list[str], obj) -> ObjectGroup:
     """
     Create an object group.
@@ -35,15 +66,16 @@ def create_object_group(name: str, permissions: list[str], obj) -> ObjectGroup:
         Group: The group object.
     """
 
-    perm_group = get_object_group_model().objects.create(name=name, target_id=obj.id,
-                                                         target_ct=ContentType.objects.get_for_model(obj))
+    ct = ContentType.objects.get_for_model(obj)
+    perm_group = get_object_group_model().objects.create(name=name, target_id=obj.id, target_ct=ct)
 
-    for permission in permissions:
-        perm_group.permissions.add(Permission.objects.get_or_create(codename=permission)[0])
+    perm_group.permissions.add(*[permission_registry.get_id(ct, permission, create=True) for permission in permissions])
 
+    invalidate(obj=obj)
     return perm_group
 
 
+@instrumented
 def delete_object_group(name: str, obj) -> bool:
     """
     Remove an object group.
@@ -62,9 +94,11 @@ def delete_object_group(name: str, obj) -> bool:
         return False
 
     group.delete()
+    invalidate(obj=obj)
     return True
 
 
+@instrumented
 def add_user_to_object_group(user: get_user_model(), name: str, obj) -> bool:
     """
     Add a user to an object group.
@@ -80,9 +114,11 @@ def add_user_to_object_group(user: get_user_model(), name: str, obj) -> bool:
 
     get_object_group_model().objects.get(name=name, target_id=obj.id,
                                          target_ct=ContentType.objects.get_for_model(obj)).users.add(user)
+    invalidate(user, obj)
     return True
 
 
+@instrumented
 def remove_user_from_object_group(user: get_user_model(), name: str, obj) -> bool:
     """
     Remove a user from an object group.
@@ -100,4 +136,126 @@ def remove_user_from_object_group(user: get_user_model(), name: str, obj) -> boo
 
     ObjectGroup.objects.get(name=name, target_id=obj.id,
                             target_ct=ContentType.objects.get_for_model(obj)).users.remove(user)
+    invalidate(user, obj)
     return True
+
+
+def _chunk_size() -> int:
+    return getattr(settings, 'SAFETY_BULK_CHUNK_SIZE', 1000)
+
+
+def _invalidate_members(users: list, obj):
+    for user in users:
+        user.__dict__.pop(PERM_CACHE_NAME, None)
+
+    invalidate(obj=obj)
+
+
+@instrumented
+def create_object_groups_bulk(groups: dict[str, list[str]], objects) -> list[ObjectGroup]:
+    """
+    Create object groups with their permissions on many objects at once. Every object is given
+    every group.
+
+    The permissions are resolved once per content type, and the groups and their permissions
+    are inserted in bulk, inside one transaction.
+
+    Args:
+        groups (dict): The permissions of each group, keyed by the name of the group.
+        objects: The objects to add the groups to.
+
+    Returns:
+        list: The created groups.
+    """
+
+    model = get_object_group_model()
+    through = model.permissions.through
+    source, target = model.permissions.field.m2m_field_name(), model.permissions.field.m2m_reverse_field_name()
+    objects = list(objects)
+
+    with transaction.atomic():
+        created = [model(name=name, target_id=obj.pk, target_ct=ContentType.objects.get_for_model(obj))
+                   for obj in objects for name in groups]
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            model.objects.bulk_create(created, batch_size=_chunk_size())
+        else:
+            for group in created:
+                group.save()
+
+        through.objects.bulk_create([
+            through(**{f'{source}_id': group.pk, f'{target}_id': permission_id})
+            for group in created
+            for permission_id in {permission_registry.get_id(group.target_ct, permission, create=True)
+                                  for permission in groups[group.name]}
+        ], batch_size=_chunk_size(), ignore_conflicts=True)
+
+    for obj in objects:
+        invalidate(obj=obj)
+
+    return created
+
+
+@instrumented
+def add_users_to_object_group(users, name: str, obj) -> int:
+    """
+    Add many users to an object group at once. Users already in the group are left as they are.
+
+    Args:
+        users: The users to add to the group, as a list or QuerySet.
+        name: The name of the perm group.
+        obj: The object for the perm group.
+
+    Returns:
+        int: The number of users added.
+    """
+
+    model = get_object_group_model()
+    through = model.users.through
+    source, target = model.users.field.m2m_field_name(), model.users.field.m2m_reverse_field_name()
+    users = list(users)
+    group = retrieve_object_group(name, obj)
+
+    with transaction.atomic():
+        existing = set(through.objects.filter(**{source: group, f'{target}__in': [user.pk for user in users]})
+                       .values_list(f'{target}_id', flat=True))
+        added = [user for user in users if user.pk not in existing]
+
+        through.objects.bulk_create([through(**{source: group, f'{target}_id': user.pk}) for user in added],
+                                    batch_size=_chunk_size(), ignore_conflicts=True)
+        if effective_permissions_enabled():
+            refresh_effective_permissions([user.pk for user in added], ContentType.objects.get_for_model(obj), [obj.pk])
+
+    _invalidate_members(users, obj)
+    return len(added)
+
+
+@instrumented
+def remove_users_from_object_group(users, name: str, obj) -> int:
+    """
+    Remove many users from an object group at once.
+
+    Args:
+        users: The users to remove from the group, as a list or QuerySet.
+        name: The name of the perm group.
+        obj: The object of the perm group.
+
+    Returns:
+        int: The number of users removed.
+    """
+
+    model = get_object_group_model()
+    through = model.users.through
+    source, target = model.users.field.m2m_field_name(), model.users.field.m2m_reverse_field_name()
+    users = list(users)
+    group = retrieve_object_group(name, obj)
+    user_ids = [user.pk for user in users]
+
+    with transaction.atomic(), suspend_effective_permissions():
+        removed = through.objects.filter(**{source: group, f'{target}__in': user_ids}).delete()[1] \
+            .get(through._meta.label, 0)
+        if effective_permissions_enabled():
+            refresh_effective_permissions(user_ids, ContentType.objects.get_for_model(obj), [obj.pk])
+
+    _invalidate_members(users, obj)
+    return removed
@@ -1,15 +1,148 @@
 import itertools
 import warnings
 from functools import reduce
-from operator import concat
+from operator import or_
 
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Exists, F, OuterRef, Q, QuerySet, Value
+from django.db.models.lookups import GreaterThan
+
+from safety.cache import EMPTY_PERMS, aget_cached_perms, aget_model_perms, ainvalidate, attach_prefetched_perms, \
+    coalesce, get_cached_perms, get_model_perms, invalidate, invalidate_model_perms, load_entity_perms
+from safety.effective import effective_permissions_enabled, refresh_entities, suspend_effective_permissions
+from safety.hierarchy import is_hierarchical
+from safety.instrumentation import instrumented
+from safety.masks import codenames_of, get_masked_models, mask_grants, mask_of, masked_content_types, uses_masks, \
+    with_bits, without_bits
+from safety.models import EffectivePermission, ObjectAncestor, PermissionMask
+from safety.registry import permission_registry
+from safety.utils import get_object_permission_model, get_object_group_model, entity_pk_values, to_id_values
+
+
+def _entity_status(entity) -> bool | None:
+    """
+    Decide a check from the state of a user alone: False for inactive and anonymous users,
+    True for superusers, or None if the permissions of the entity need to be checked.
+    """
+
+    if not getattr(entity, "is_active", True):
+        return False
+    if getattr(entity, "is_superuser", False):
+        return True
+    if not getattr(entity, "is_authenticated", True):
+        return False
+    if not hasattr(entity, "is_authenticated"):
+        warnings.warn("The entity does not have an is_authenticated attribute, assuming True.")
+
+    return None
+
+
+def _model_perm_key(perm: str, content_type: ContentType | None) -> tuple:
+    return content_type.id if content_type is not None else None, perm
+
+
+def _model_permissions(entity):
+    return entity.user_permissions if isinstance(entity, get_user_model()) else entity.permissions
+
+
+def _grant_lookup(entity, obj) -> dict:
+    return {
+        "to_id": entity.id,
+        "to_ct": ContentType.objects.get_for_model(entity),
+        "object_id": obj.id,
+        "object_ct": ContentType.objects.get_for_model(obj),
+    }
+
+
+def _object_perm_lookup(entity, obj, permission_id: int) -> dict:
+    return {"permission_id": permission_id, **_grant_lookup(entity, obj)}
+
+
+def _object_perm_queries(entity, obj, perm: str, permission_id: int) -> list[QuerySet]:
+    """
+    Build the queries that has_perm checks in turn, any of which grants the permission on obj
+    itself. Inherited grants are checked separately, as they do not need the permission to exist
+    for the model of obj.
+    """
+
+    ct = ContentType.objects.get_for_model(obj)
+
+    if uses_masks(ct):
+        queries = [mask_grants(ct, [perm]).filter(**_grant_lookup(entity, obj))]
+    else:
+        queries = [get_object_permission_model(obj).objects.filter(**_object_perm_lookup(entity, obj, permission_id))]
+
+    # Check the PermissionGroup object
+    if isinstance(entity, get_user_model()):
+        queries.append(get_object_group_model().objects.filter(target_id=obj.id,
+                                                               target_ct=ContentType.objects.get_for_model(obj),
+                                                               permissions=permission_id,
+                                                               users__in=[entity]))
+
+    return queries
+
+
+def _inherited_perm_query(entity, perm: str, obj, with_group_users=False) -> QuerySet | None:
+    """
+    Build the query checking the permission on the ancestors of obj, or None if obj has no parents.
+    """
+
+    ancestors = _inherited_grants(entity, [perm], ContentType.objects.get_for_model(obj),
+                                  _entity_grants(entity, with_group_users))
+
+    return None if ancestors is None else ancestors.filter(descendant_id=obj.pk)
+
+
+def _inherits_perm(entity, perm: str, obj, with_group_users=False) -> bool:
+    # Cached permissions are those granted on the object itself, inherited ones are looked up.
+    query = _inherited_perm_query(entity, perm, obj, with_group_users)
+    return query is not None and query.exists()
+
+
+async def _ainherits_perm(entity, perm: str, obj, with_group_users=False) -> bool:
+    query = _inherited_perm_query(entity, perm, obj, with_group_users)
+    return query is not None and await query.aexists()
+
+
+def _perm_in_cached(entity, perm: str, obj_perms) -> bool:
+    return perm in (obj_perms.direct if isinstance(entity, Group) else obj_perms.direct | obj_perms.object_groups)
+
+
+def _check_key(name: str, entity, *args) -> tuple:
+    return name, ContentType.objects.get_for_model(entity).id, str(entity.pk), *args
+
+
+async def _awarm_content_types(*models):
+    """
+    Make sure the content types of the models, and of the models whose permissions are stored as
+    masks, are cached, so that the query builders shared with the sync API can look them up from
+    async code without querying.
+    """
 
-from safety.utils import get_object_permission_model, get_object_group_model
+    models = (*models, *get_masked_models())
 
+    try:
+        for model in models:
+            # pylint: disable-next=protected-access
+            ContentType.objects._get_from_cache(model._meta.concrete_model._meta)
+    except KeyError:
+        await sync_to_async(ContentType.objects.get_for_models)(*models)
 
+
+async def _aexists_any(queries: list[QuerySet]) -> bool:
+    for query in queries:
+        if await query.aexists():
+            return True
+
+    return False
+
+
+@instrumented
 def has_perm(entities: list, perm: str, obj=None, content_type=None) -> bool:
     """
     Return True if the user has the specified permission. If obj is provided,
@@ -26,48 +159,83 @@ def has_perm(entities: list, perm: str, obj=None, content_type=None) -> bool:
         bool: True if the user has the specified permission, otherwise False.
     """
 
-    all_have_perm = False
-
-    for index, entity in enumerate(entities):
-        if index == 0:
-            all_have_perm = True
-        if not all_have_perm or not getattr(entity, "is_active", True):
+    for entity in entities:
+        entity_has_perm = _entity_status(entity)
+
+        if entity_has_perm is None:
+            if obj is None:
+                entity_has_perm = _model_perm_key(perm, content_type) in get_model_perms(entity).direct
+            elif (obj_perms := get_cached_perms(entity, obj)) is not None:
+                entity_has_perm = _perm_in_cached(entity, perm, obj_perms) or _inherits_perm(entity, perm, obj)
+            elif isinstance(entity, (get_user_model(), Group)):
+                permission_id = permission_registry.get_id(ContentType.objects.get_for_model(obj), perm)
+                entity_has_perm = permission_id is not None and any(
+                    query.exists() for query in _object_perm_queries(entity, obj, perm, permission_id)) \
+                    or _inherits_perm(entity, perm, obj)
+            else:
+                entity_has_perm = False
+
+        if not entity_has_perm:
             return False
-        if getattr(entity, "is_superuser", False):
-            continue
-        if not getattr(entity, "is_authenticated", True):
-            return False
-        if not hasattr(entity, "is_authenticated"):
-            warnings.warn("The entity does not have an is_authenticated attribute, assuming True.")
-        if obj is None:
-            all_have_perm = entity.user_permissions.filter(codename=perm, content_type=content_type).exists()
-            continue
-
-        try:
-            permission = Permission.objects.get(codename=perm)
-        except Permission.DoesNotExist:
+
+    return len(entities) > 0
+
+
+@instrumented
+async def ahas_perm(entities: list, perm: str, obj=None, content_type=None) -> bool:
+    """
+    Async version of has_perm. Concurrent checks of the same permission are answered by a
+    single query.
+    """
+
+    await _awarm_content_types(get_user_model(), Group, *{type(entity) for entity in entities},
+                               *([type(obj)] if obj is not None else []))
+
+    for entity in entities:
+        entity_has_perm = _entity_status(entity)
+
+        if entity_has_perm is None:
+            if obj is None:
+                entity_has_perm = _model_perm_key(perm, content_type) in (await aget_model_perms(entity)).direct
+            elif (obj_perms := await aget_cached_perms(entity, obj)) is not None:
+                entity_has_perm = _perm_in_cached(entity, perm, obj_perms) or await _ainherits_perm(entity, perm, obj)
+            elif isinstance(entity, (get_user_model(), Group)):
+                obj_ct = ContentType.objects.get_for_model(obj)
+                permission_id = await permission_registry.aget_id(obj_ct, perm)
+                entity_has_perm = permission_id is not None and await coalesce(
+                    _check_key("has_perm", entity, permission_id, obj_ct.id, obj.pk),
+                    lambda: _aexists_any(_object_perm_queries(entity, obj, perm, permission_id))) \
+                    or await _ainherits_perm(entity, perm, obj)
+            else:
+                entity_has_perm = False
+
+        if not entity_has_perm:
             return False
 
-        if isinstance(entity, get_user_model()):
-            all_have_perm = get_object_permission_model(obj).objects.filter(permission=permission, to_id=entity.id,
-                                                                            to_ct=ContentType.objects.get_for_model(
-                                                                                entity),
-                                                                            object_id=obj.id).exists()
-            # Check the PermissionGroup object
-            if not all_have_perm:
-                all_have_perm = get_object_group_model().objects.filter(target_id=obj.id,
-                                                                        permissions__in=[permission],
-                                                                        users__in=[entity]).exists()
-        elif isinstance(entity, Group):
-            all_have_perm = get_object_permission_model(obj).objects.filter(permission=permission, to_id=entity.id,
-                                                                            to_ct=ContentType.objects.get_for_model(
-                                                                                entity),
-                                                                            object_id=obj.id).exists()
+    return len(entities) > 0
+
+
+def _gross_status(user) -> bool | None:
+    if not getattr(user, "is_active", True) or not getattr(user, "is_authenticated", True):
+        return False
+    if getattr(user, "is_superuser", False):
+        return True
+    if not hasattr(user, "groups"):
+        warnings.warn("The user does not have a groups attribute, assuming no model level groups.")
+
+    return None
 
-    return all_have_perm
 
+def _gross_perm_query(user, perm: str, obj) -> QuerySet:
+    # Direct, group and object group grants are resolved in a single statement.
+    return type(obj)._base_manager.filter(
+        _perm_condition(user, [perm], ContentType.objects.get_for_model(obj), with_group_users=True),
+        pk=obj.pk,
+    )
 
-def has_gross_perm(users: list[get_user_model()], perm: str, obj=None) -> bool:
+
+@instrumented
+def has_gross_perm(users: list[get_user_model()], perm: str, obj=None, content_type=None) -> bool:
     """
     Same as has_perm but regards groups that a user belongs to.
     Only works with users.
@@ -76,32 +244,285 @@ def has_gross_perm(users: list[get_user_model()], perm: str, obj=None) -> bool:
         users: The users to check the permission for.
         perm (string): The permission to check.
         obj: The object to check the permission.
+        content_type (ContentType): The content type of the permission, if obj is not provided.
 
     Returns:
         bool: True if the user has the specified permission directly
         or through groups, otherwise False.
     """
 
-    has_net_perm = has_perm(users, perm, obj)
+    for user in users:
+        has_user_perm = _gross_status(user)
+
+        if has_user_perm is None:
+            if obj is None:
+                has_user_perm = _model_perm_key(perm, content_type) in get_model_perms(user).all
+            elif (obj_perms := get_cached_perms(user, obj)) is not None:
+                has_user_perm = perm in obj_perms.all or _inherits_perm(user, perm, obj, with_group_users=True)
+            else:
+                has_user_perm = _gross_perm_query(user, perm, obj).exists()
+
+        if not has_user_perm:
+            return False
+
+    return len(users) > 0
 
-    if not has_net_perm:
-        return False
+
+@instrumented
+async def ahas_gross_perm(users: list[get_user_model()], perm: str, obj=None, content_type=None) -> bool:
+    """
+    Async version of has_gross_perm. Concurrent checks of the same permission are answered by
+    a single query.
+    """
+
+    if obj is not None:
+        await _awarm_content_types(get_user_model(), Group, type(obj))
 
     for user in users:
-        if hasattr(user, "groups"):
-            for group in user.groups.all():
-                if has_perm(group, perm, obj):
-                    return True
-        else:
-            warnings.warn("The user does not have a groups attribute, assuming no model level groups.")
-        for group in get_object_group_model().objects.filter(users__in=[user], target_id=obj.id,
-                                                             target_ct=ContentType.objects.get_for_model(obj)):
-            if has_perm(group, perm, obj):
-                return True
+        has_user_perm = _gross_status(user)
+
+        if has_user_perm is None:
+            if obj is None:
+                has_user_perm = _model_perm_key(perm, content_type) in (await aget_model_perms(user)).all
+            elif (obj_perms := await aget_cached_perms(user, obj)) is not None:
+                has_user_perm = perm in obj_perms.all or \
+                    await _ainherits_perm(user, perm, obj, with_group_users=True)
+            else:
+                obj_ct = ContentType.objects.get_for_model(obj)
+                # Nobody holds a permission that does not exist on obj itself, though it may be inherited;
+                # this also registers it for the query builder.
+                if await permission_registry.aget_id(obj_ct, perm) is None:
+                    has_user_perm = await _ainherits_perm(user, perm, obj, with_group_users=True)
+                else:
+                    has_user_perm = await coalesce(_check_key("has_gross_perm", user, perm, obj_ct.id, obj.pk),
+                                                   lambda: _gross_perm_query(user, perm, obj).aexists())
+
+        if not has_user_perm:
+            return False
 
-    return False
+    return len(users) > 0
+
+
+def _perm_condition(entity, perms: list[str], ct: ContentType, with_group_users=False, with_object_groups=True):
+    """
+    Build a condition that holds for the rows of the model of ct that the entity has
+    any of the permissions on.
+
+    Args:
+        entity: The user or group to check the permissions for.
+        perms (list[str]): The permissions to check.
+        ct (ContentType): The content type of the model being filtered.
+        with_group_users (bool): Regard permissions granted to the groups of a user.
+        with_object_groups (bool): Regard permissions granted through the object groups of a user.
+            If both are regarded and ``SAFETY_EFFECTIVE_PERMISSIONS`` is enabled, the effective
+            permissions of the user are looked up instead.
+
+    Permissions granted on the ancestors of objects of hierarchical models are regarded as well.
+    """
+
+    if with_group_users and with_object_groups and isinstance(entity, get_user_model()) \
+            and effective_permissions_enabled():
+        condition = Exists(EffectivePermission.objects.filter(
+            user=entity.pk,
+            object_ct=ct,
+            permission__in=_resolve_permissions(perms, ct),
+            object_id=OuterRef("pk"),
+        ))
+    else:
+        condition = Exists(_object_grants(ct, perms).filter(_entity_grants(entity, with_group_users),
+                                                            object_id=OuterRef("pk")))
+
+        if with_object_groups and not isinstance(entity, Group):
+            condition |= Exists(get_object_group_model().objects.filter(
+                users=entity,
+                target_ct=ct,
+                target_id=OuterRef("pk"),
+                permissions__codename__in=perms,
+            ))
 
+    ancestors = _inherited_grants(entity, perms, ct, _entity_grants(entity, with_group_users), with_object_groups)
+    if ancestors is not None:
+        condition |= Exists(ancestors.filter(descendant_id=OuterRef("pk")))
 
+    return condition
+
+
+def _entity_grants(entity, with_group_users: bool) -> Q:
+    grants = Q(to_ct=ContentType.objects.get_for_model(entity), to_id=entity.pk)
+
+    if with_group_users and not isinstance(entity, Group) and hasattr(entity, "groups"):
+        grants |= Q(to_ct=ContentType.objects.get_for_model(Group), to_id__in=to_id_values(entity.groups.all()))
+
+    return grants
+
+
+def _inherited_grants(entity, perms: list[str], ct: ContentType, grants: Q, with_object_groups=True) -> \
+        QuerySet | None:
+    """
+    Select the ancestors of objects of ct on which any of the permissions is granted, which the
+    objects inherit. A single join of the ancestors of an object with the grants on them answers a
+    check, however deep the hierarchy. Grants are matched by codename, as ancestors may be of
+    other models.
+
+    Args:
+        entity: The user or group to check the permissions for.
+        perms (list[str]): The permissions to check.
+        ct (ContentType): The content type of the descendants.
+        grants (Q): The condition selecting grants to the entity, and possibly to its groups.
+        with_object_groups (bool): Regard permissions granted through the object groups of a user.
+
+    Returns:
+        QuerySet | None: The ancestor rows to filter by ``descendant_id``, or None if the model of ct
+        has no parents.
+    """
+
+    if not is_hierarchical(ct):
+        return None
+
+    on_ancestor = {"object_ct": OuterRef("ancestor_ct"), "object_id": OuterRef("ancestor_id")}
+    inherited = Exists(get_object_permission_model().objects.filter(grants, permission__codename__in=perms,
+                                                                     **on_ancestor))
+
+    for masked_ct in masked_content_types():
+        if mask_of(masked_ct, perms):
+            inherited |= Exists(mask_grants(masked_ct, perms).filter(grants, **on_ancestor))
+
+    if with_object_groups and not isinstance(entity, Group):
+        inherited |= Exists(get_object_group_model().objects.filter(
+            users=entity,
+            target_ct=OuterRef("ancestor_ct"),
+            target_id=OuterRef("ancestor_id"),
+            permissions__codename__in=perms,
+        ))
+
+    return ObjectAncestor.objects.filter(inherited, descendant_ct=ct)
+
+
+def _object_grants(ct: ContentType, perms: list[str], permission_ids: list[int] = None) -> QuerySet:
+    """
+    Select the grants of any of the permissions on objects of ct, from the permission masks if the
+    model of ct is registered in ``SAFETY_PERMISSION_MASKS``, otherwise from the object permissions.
+    Both have ``to_ct``, ``to_id``, ``object_ct`` and ``object_id`` fields.
+
+    Args:
+        ct (ContentType): The content type of the objects.
+        perms (list[str]): The permissions, any of which is granted.
+        permission_ids (list[int]): The ids of the permissions, if resolved, to spare a join.
+    """
+
+    if uses_masks(ct):
+        return mask_grants(ct, perms)
+
+    permission_filter = {"permission__codename__in": perms} if permission_ids is None \
+        else {"permission_id__in": permission_ids}
+
+    return get_object_permission_model(ct.model_class()).objects.filter(object_ct=ct, **permission_filter)
+
+
+def _has_perm_expression(entity, perm: str, ct: ContentType, with_group_users: bool):
+    """
+    Build a boolean expression that holds for the rows of the model of ct that the entity has the
+    permission on, regarding inactive, anonymous and superusers like has_perm.
+    """
+
+    if not getattr(entity, "is_active", True) or not getattr(entity, "is_authenticated", True):
+        return Value(False)
+    if getattr(entity, "is_superuser", False):
+        return Value(True)
+
+    return _perm_condition(entity, [perm], ct, with_group_users=with_group_users)
+
+
+def _has_perm_many(entity, perm: str, objects, with_group_users: bool) -> dict:
+    if isinstance(objects, QuerySet):
+        queryset = objects
+        result = {}
+    else:
+        objects = list(objects)
+        if not objects:
+            return {}
+        queryset = type(objects[0])._base_manager.filter(pk__in=[obj.pk for obj in objects])
+        result = {obj.pk: False for obj in objects}
+
+    condition = _has_perm_expression(entity, perm, ContentType.objects.get_for_model(queryset.model),
+                                     with_group_users=with_group_users)
+
+    return result | dict(queryset.annotate(safety_has_perm=condition).values_list("pk", "safety_has_perm"))
+
+
+@instrumented
+def has_perm_many(entity, perm: str, objects) -> dict:
+    """
+    Check a permission on many objects at once, with a single query regardless of how many
+    objects are checked. Like has_perm, permissions granted through object groups are regarded.
+
+    Args:
+        entity: The user or group to check the permission for.
+        perm (string): The permission to check.
+        objects: The objects to check the permission on, as a list or QuerySet of a single model.
+            A QuerySet is evaluated in the database as part of the check.
+
+    Returns:
+        dict: Whether the entity has the permission, keyed by object id.
+    """
+
+    return _has_perm_many(entity, perm, objects, with_group_users=False)
+
+
+@instrumented
+def has_gross_perm_many(user: get_user_model(), perm: str, objects) -> dict:
+    """
+    Same as has_perm_many but regards groups that the user belongs to.
+
+    Args:
+        user: The user to check the permission for.
+        perm (string): The permission to check.
+        objects: The objects to check the permission on, as a list or QuerySet of a single model.
+
+    Returns:
+        dict: Whether the user has the permission directly or through groups, keyed by object id.
+    """
+
+    return _has_perm_many(user, perm, objects, with_group_users=True)
+
+
+@instrumented
+def prefetch_object_perms(objects, entity, to_attr: str = None) -> list:
+    """
+    Load the permissions an entity holds on many objects with a single query per content type,
+    and attach them to the instances, so that has_perm, has_gross_perm and get_perms answer
+    from them without querying. Permissions changed afterwards through set_perm or lift_perm
+    on the same instance are loaded again.
+
+    Args:
+        objects: The objects to load the permissions on, as a list or QuerySet.
+        entity: The user or group to load the permissions for.
+        to_attr (string): Also store the set of codenames the entity holds on each object, including through
+            groups and object groups, in this attribute, e.g. for use in templates.
+
+    Returns:
+        list: The objects, with the QuerySet evaluated.
+    """
+
+    objects = list(objects)
+
+    grouped = {}
+    for obj in objects:
+        grouped.setdefault(ContentType.objects.get_for_model(obj), []).append(obj)
+
+    for ct, instances in grouped.items():
+        perms = load_entity_perms(entity, ct, [obj.pk for obj in instances])
+
+        for obj in instances:
+            obj_perms = perms.get(obj.pk, EMPTY_PERMS)
+            attach_prefetched_perms(entity, obj, obj_perms)
+            if to_attr is not None:
+                setattr(obj, to_attr, obj_perms.all)
+
+    return objects
+
+
+@instrumented
 def set_perm(entity: get_user_model() | Group, perm: str, obj: any = None, content_type: ContentType = None) -> bool:
     """
     Set a permission for a user or group.
@@ -122,36 +543,74 @@ def set_perm(entity: get_user_model() | Group, perm: str, obj: any = None, conte
         if content_type is None:
             raise ValueError("Content type must be provided if obj is None.")
 
-        permission = Permission.objects.get_or_create(codename=perm, content_type=content_type)[0]
+        permission_id = permission_registry.get_id(content_type, perm, create=True)
 
-        if isinstance(entity, get_user_model()):
-            entity.user_permissions.add(
-                permission
-            )
-        elif isinstance(entity, Group):
-            entity.permissions.add(
-                permission
-            )
+        if isinstance(entity, (get_user_model(), Group)):
+            _model_permissions(entity).add(permission_id)
+            invalidate_model_perms(entity)
         return True
 
-    permission = Permission.objects.get_or_create(codename=perm, content_type=ContentType.objects.get_for_model(obj))[0]
+    ct = ContentType.objects.get_for_model(obj)
+    bits = mask_of(ct, [perm], strict=True) if uses_masks(ct) else None
+    permission_id = permission_registry.get_id(ct, perm, create=True)
 
-    if isinstance(entity, get_user_model()):
-        get_object_permission_model(obj).objects.get_or_create(permission=permission, to_id=entity.id,
-                                                               to_ct=ContentType.objects.get_for_model(entity),
-                                                               object_id=obj.id,
-                                                               object_ct=ContentType.objects.get_for_model(obj))
+    if isinstance(entity, (get_user_model(), Group)):
+        if bits is None:
+            get_object_permission_model(obj).objects.get_or_create(**_object_perm_lookup(entity, obj, permission_id))
+        else:
+            masks = PermissionMask.objects.filter(**_grant_lookup(entity, obj))
+            if not masks.update(mask=with_bits(bits)):
+                if not PermissionMask.objects.get_or_create(**_grant_lookup(entity, obj), defaults={"mask": bits})[1]:
+                    masks.update(mask=with_bits(bits))
+            refresh_entities([entity], ct, [obj.pk])
+        invalidate(entity, obj)
+        return True
+
+    return False
+
+
+@instrumented
+async def aset_perm(entity: get_user_model() | Group, perm: str, obj: any = None,
+                    content_type: ContentType = None) -> bool:
+    """
+    Async version of set_perm.
+    """
+
+    if obj is None:
+        if content_type is None:
+            raise ValueError("Content type must be provided if obj is None.")
+
+        permission_id = await permission_registry.aget_id(content_type, perm, create=True)
+
+        if isinstance(entity, (get_user_model(), Group)):
+            await _model_permissions(entity).aadd(permission_id)
+            invalidate_model_perms(entity)
         return True
-    elif isinstance(entity, Group):
-        get_object_permission_model(obj).objects.get_or_create(permission=permission, to_id=entity.id,
-                                                               to_ct=ContentType.objects.get_for_model(entity),
-                                                               object_id=obj.id,
-                                                               object_ct=ContentType.objects.get_for_model(obj))
+
+    await _awarm_content_types(type(entity), type(obj))
+    ct = ContentType.objects.get_for_model(obj)
+    bits = mask_of(ct, [perm], strict=True) if uses_masks(ct) else None
+    permission_id = await permission_registry.aget_id(ct, perm, create=True)
+
+    if isinstance(entity, (get_user_model(), Group)):
+        if bits is None:
+            await get_object_permission_model(obj).objects.aget_or_create(**_object_perm_lookup(entity, obj,
+                                                                                                  permission_id))
+        else:
+            masks = PermissionMask.objects.filter(**_grant_lookup(entity, obj))
+            if not await masks.aupdate(mask=with_bits(bits)):
+                if not (await PermissionMask.objects.aget_or_create(**_grant_lookup(entity, obj),
+                                                                    defaults={"mask": bits}))[1]:
+                    await masks.aupdate(mask=with_bits(bits))
+            if effective_permissions_enabled():
+                await sync_to_async(refresh_entities)([entity], ct, [obj.pk])
+        await ainvalidate(entity, obj)
         return True
 
     return False
 
 
+@instrumented
 def lift_perm(entity, perm: str, obj=None, content_type: ContentType = None) -> bool:
     """
     Remove the permission for a user or group.
@@ -166,40 +625,310 @@ def lift_perm(entity, perm: str, obj=None, content_type: ContentType = None) ->
     if obj is None:
         if content_type is None:
             raise ValueError("Content type must be provided if obj is None.")
-        entity.user_permissions.remove(Permission.objects.get(codename=perm, content_type=content_type))
+        _model_permissions(entity).remove(_get_permission_id(content_type, perm))
+        invalidate_model_perms(entity)
         return True
 
-    permission = Permission.objects.get(codename=perm, content_type=ContentType.objects.get_for_model(obj))
-
-    if type(entity) == get_user_model():
-        user_obj_perm = get_object_permission_model(obj).objects.filter(permission=permission, to_id=entity.id,
-                                                                        to_ct=ContentType.objects.get_for_model(
-                                                                            entity),
-                                                                        object_id=obj.id,
-                                                                        object_ct=ContentType.objects.get_for_model(
-                                                                            obj))
+    ct = ContentType.objects.get_for_model(obj)
+    permission_id = _get_permission_id(ct, perm)
 
-        if not user_obj_perm.exists():
+    if uses_masks(ct):
+        if not mask_grants(ct, [perm]).filter(**_grant_lookup(entity, obj)).update(
+                mask=without_bits(mask_of(ct, [perm]))):
             return False
+        PermissionMask.objects.filter(mask=0, **_grant_lookup(entity, obj)).delete()
+        refresh_entities([entity], ct, [obj.pk])
+        invalidate(entity, obj)
+        return True
+
+    obj_perm = get_object_permission_model(obj).objects.filter(**_object_perm_lookup(entity, obj, permission_id))
+
+    if not obj_perm.exists():
+        return False
+
+    obj_perm.delete()
+    invalidate(entity, obj)
+    return True
+
+
+@instrumented
+async def alift_perm(entity, perm: str, obj=None, content_type: ContentType = None) -> bool:
+    """
+    Async version of lift_perm.
+    """
+
+    if obj is None:
+        if content_type is None:
+            raise ValueError("Content type must be provided if obj is None.")
+        await _model_permissions(entity).aremove(await _aget_permission_id(content_type, perm))
+        invalidate_model_perms(entity)
+        return True
+
+    await _awarm_content_types(type(entity), type(obj))
+    ct = ContentType.objects.get_for_model(obj)
+    permission_id = await _aget_permission_id(ct, perm)
 
-        user_obj_perm.delete()
+    if uses_masks(ct):
+        if not await mask_grants(ct, [perm]).filter(**_grant_lookup(entity, obj)).aupdate(
+                mask=without_bits(mask_of(ct, [perm]))):
+            return False
+        await PermissionMask.objects.filter(mask=0, **_grant_lookup(entity, obj)).adelete()
+        if effective_permissions_enabled():
+            await sync_to_async(refresh_entities)([entity], ct, [obj.pk])
+        await ainvalidate(entity, obj)
         return True
 
-    group_obj_perm = get_object_permission_model(obj).objects.filter(permission=permission, to_id=entity.id,
-                                                                     to_ct=ContentType.objects.get_for_model(entity),
-                                                                     object_id=obj.id,
-                                                                     object_ct=ContentType.objects.get_for_model(obj)
-                                                                     ).delete()
-    if not group_obj_perm.exists():
+    obj_perm = get_object_permission_model(obj).objects.filter(**_object_perm_lookup(entity, obj, permission_id))
+
+    if not await obj_perm.aexists():
         return False
 
-    group_obj_perm.delete()
+    await obj_perm.adelete()
+    await ainvalidate(entity, obj)
     return True
 
 
+def _require_permission_id(ct: ContentType, perm: str, permission_id: int | None) -> int:
+    if permission_id is None:
+        raise Permission.DoesNotExist(f"Permission {perm} of {ct} does not exist.")
+
+    return permission_id
+
+
+def _get_permission_id(ct: ContentType, perm: str) -> int:
+    return _require_permission_id(ct, perm, permission_registry.get_id(ct, perm))
+
+
+async def _aget_permission_id(ct: ContentType, perm: str) -> int:
+    return _require_permission_id(ct, perm, await permission_registry.aget_id(ct, perm))
+
+
+def _chunks(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _group_by_content_type(objects) -> dict[ContentType, list]:
+    """
+    Group the primary keys of model instances, or of the rows of a QuerySet, by content type.
+    """
+
+    if isinstance(objects, QuerySet):
+        return {ContentType.objects.get_for_model(objects.model): list(objects.values_list("pk", flat=True))}
+
+    grouped = {}
+    for obj in objects:
+        grouped.setdefault(ContentType.objects.get_for_model(obj), []).append(obj.pk)
+
+    return grouped
+
+
+def _resolve_permissions(perms: list[str], ct: ContentType, create=False) -> list[int]:
+    return [permission_id for permission_id in (permission_registry.get_id(ct, perm, create=create) for perm in perms)
+            if permission_id is not None]
+
+
+def _entities_condition(entities: list) -> Q:
+    grouped = {}
+    for entity in entities:
+        grouped.setdefault(ContentType.objects.get_for_model(entity), []).append(entity.pk)
+
+    return reduce(or_, [Q(to_ct=ct, to_id__in=ids) for ct, ids in grouped.items()])
+
+
+def _invalidate_many(entities: list, ct: ContentType, object_ids: list):
+    for entity in entities:
+        if not isinstance(entity, Group):
+            invalidate(entity, ct=ct)
+
+    if any(isinstance(entity, Group) for entity in entities):
+        invalidate(ct=ct, object_ids=object_ids)
+
+
+def _set_masks_many(entities: list, entity_keys: list, bits: int, ct: ContentType, object_ids: list,
+                    chunk_size: int) -> int:
+    """
+    Set bits in the masks of many entities on many objects, with one update of the existing masks
+    and one insert of the missing ones per chunk of objects.
+
+    Returns:
+        int: The number of permissions granted; bits that were already set are not counted.
+    """
+
+    created = 0
+
+    for object_chunk in _chunks(object_ids, max(1, chunk_size // len(entity_keys))):
+        masks = PermissionMask.objects.filter(_entities_condition(entities), object_ct=ct, object_id__in=object_chunk)
+        existing = {
+            (to_ct, str(to_id), str(object_id)): mask
+            for to_ct, to_id, object_id, mask in masks.values_list("to_ct", "to_id", "object_id", "mask")
+        }
+
+        if existing:
+            masks.update(mask=with_bits(bits))
+            created += sum((bits & ~mask).bit_count() for mask in existing.values())
+
+        rows = [
+            PermissionMask(to_ct=entity_ct, to_id=entity_id, object_ct=ct, object_id=object_id, mask=bits)
+            for (entity_ct, entity_id), object_id in itertools.product(entity_keys, object_chunk)
+            if (entity_ct.id, str(entity_id), str(object_id)) not in existing
+        ]
+
+        PermissionMask.objects.bulk_create(rows, batch_size=chunk_size, ignore_conflicts=True)
+        created += len(rows) * bits.bit_count()
+
+    return created
+
+
+def _lift_masks(entities: list, bits: int, ct: ContentType, object_ids: list) -> int:
+    """
+    Clear bits in the masks of many entities on objects, removing masks left empty.
+
+    Returns:
+        int: The number of permissions removed.
+    """
+
+    masks = PermissionMask.objects.filter(GreaterThan(F("mask").bitand(bits), 0), _entities_condition(entities),
+                                          object_ct=ct, object_id__in=object_ids)
+    removed = sum((mask & bits).bit_count() for mask in masks.values_list("mask", flat=True))
+
+    if removed:
+        masks.update(mask=without_bits(bits))
+        PermissionMask.objects.filter(_entities_condition(entities), object_ct=ct, object_id__in=object_ids,
+                                      mask=0).delete()
+
+    return removed
+
+
+@instrumented
+def set_perm_many(entities: list, perms: list[str] | str, objects, chunk_size: int = None) -> int:
+    """
+    Set permissions for many users or groups on many objects at once. Every entity is
+    granted every permission on every object.
+
+    The permissions are resolved once per content type and rows are inserted in chunks,
+    all inside one transaction.
+
+    Args:
+        entities: The users or groups to set the permissions for.
+        perms (list[str] | str): The permissions to set.
+        objects: The objects to set the permissions on, as a list or QuerySet.
+        chunk_size (int): The number of rows inserted per query, defaults to the
+            ``SAFETY_BULK_CHUNK_SIZE`` setting or 1000.
+
+    Returns:
+        int: The number of permissions created; permissions that already existed are not counted.
+    """
+
+    if not isinstance(perms, list):
+        perms = [perms]
+
+    chunk_size = chunk_size or getattr(settings, "SAFETY_BULK_CHUNK_SIZE", 1000)
+    entities = list(entities)
+    entity_keys = [(ContentType.objects.get_for_model(entity), entity.pk) for entity in entities]
+    created = 0
+
+    if not entities or not perms:
+        return created
+
+    with transaction.atomic():
+        for ct, object_ids in _group_by_content_type(objects).items():
+            if uses_masks(ct):
+                bits = mask_of(ct, perms, strict=True)
+                _resolve_permissions(perms, ct, create=True)
+                created += _set_masks_many(entities, entity_keys, bits, ct, object_ids, chunk_size)
+                _invalidate_many(entities, ct, object_ids)
+                refresh_entities(entities, ct, object_ids)
+                continue
+
+            perm_model = get_object_permission_model(ct.model_class())
+            permissions = _resolve_permissions(perms, ct, create=True)
+            objects_per_chunk = max(1, chunk_size // (len(entity_keys) * len(permissions)))
+
+            for object_chunk in _chunks(object_ids, objects_per_chunk):
+                existing = {
+                    (to_ct, str(to_id), permission, str(object_id))
+                    for to_ct, to_id, permission, object_id in perm_model.objects.filter(
+                        _entities_condition(entities),
+                        permission__in=permissions,
+                        object_ct=ct,
+                        object_id__in=object_chunk,
+                    ).values_list("to_ct", "to_id", "permission", "object_id")
+                }
+
+                rows = [
+                    perm_model(to_ct=entity_ct, to_id=entity_id, permission_id=permission, object_ct=ct,
+                               object_id=object_id)
+                    for (entity_ct, entity_id), permission, object_id in
+                    itertools.product(entity_keys, permissions, object_chunk)
+                    if (entity_ct.id, str(entity_id), permission, str(object_id)) not in existing
+                ]
+
+                perm_model.objects.bulk_create(rows, batch_size=chunk_size, ignore_conflicts=True)
+                created += len(rows)
+
+            _invalidate_many(entities, ct, object_ids)
+            refresh_entities(entities, ct, object_ids)
+
+    return created
+
+
+@instrumented
+def lift_perm_many(entities: list, perms: list[str] | str, objects, chunk_size: int = None) -> int:
+    """
+    Remove permissions of many users or groups on many objects at once.
+
+    The permissions are removed with one delete per chunk of objects, all inside one transaction.
+
+    Args:
+        entities: The users or groups to remove the permissions for.
+        perms (list[str] | str): The permissions to remove.
+        objects: The objects to remove the permissions on, as a list or QuerySet.
+        chunk_size (int): The number of objects handled per query, defaults to the
+            ``SAFETY_BULK_CHUNK_SIZE`` setting or 1000.
+
+    Returns:
+        int: The number of permissions removed.
+    """
+
+    if not isinstance(perms, list):
+        perms = [perms]
+
+    chunk_size = chunk_size or getattr(settings, "SAFETY_BULK_CHUNK_SIZE", 1000)
+    entities = list(entities)
+    removed = 0
+
+    if not entities:
+        return 0
+
+    with transaction.atomic():
+        for ct, object_ids in _group_by_content_type(objects).items():
+            perm_model = get_object_permission_model(ct.model_class())
+            permissions = _resolve_permissions(perms, ct)
+
+            with suspend_effective_permissions():
+                for object_chunk in _chunks(object_ids, chunk_size):
+                    if uses_masks(ct):
+                        removed += _lift_masks(entities, mask_of(ct, perms), ct, object_chunk)
+                        continue
+
+                    removed += perm_model.objects.filter(
+                        _entities_condition(entities),
+                        permission__in=permissions,
+                        object_ct=ct,
+                        object_id__in=object_chunk,
+                    ).delete()[0]
+
+            _invalidate_many(entities, ct, object_ids)
+            refresh_entities(entities, ct, object_ids)
+
+    return removed
+
+
+@instrumented
 def get_perms(entity, obj=None) -> list[str]:
     """
-    Get the permissions for a user or group.
+    Get the permissions for a user or group, sorted by codename.
 
     Args:
         entity: The user or group to get the permissions for.
@@ -207,17 +936,59 @@ def get_perms(entity, obj=None) -> list[str]:
     """
 
     if obj is None:
-        return [perm.codename for perm in
-                (entity.user_permissions.all() if isinstance(entity, get_user_model()) else entity.permissions.all())]
+        return _model_codenames(get_model_perms(entity).direct)
+
+    obj_perms = get_cached_perms(entity, obj)
+    if obj_perms is not None:
+        return sorted(obj_perms.direct)
+
+    ct = ContentType.objects.get_for_model(obj)
+    if uses_masks(ct):
+        return sorted(codenames_of(ct, _object_mask_query(entity, obj).first() or 0))
+
+    return sorted(_object_perms_query(entity, obj))
+
+
+@instrumented
+async def aget_perms(entity, obj=None) -> list[str]:
+    """
+    Async version of get_perms.
+    """
+
+    if obj is None:
+        return _model_codenames((await aget_model_perms(entity)).direct)
+
+    await _awarm_content_types(type(entity), type(obj))
+
+    obj_perms = await aget_cached_perms(entity, obj)
+    if obj_perms is not None:
+        return sorted(obj_perms.direct)
+
+    ct = ContentType.objects.get_for_model(obj)
+    if uses_masks(ct):
+        return sorted(codenames_of(ct, await _object_mask_query(entity, obj).afirst() or 0))
+
+    return sorted([codename async for codename in _object_perms_query(entity, obj)])
+
 
-    return [perm.permission.codename for perm in get_object_permission_model(obj).objects.filter(
+def _model_codenames(perms) -> list[str]:
+    return sorted(codename for _, codename in perms)
+
+
+def _object_perms_query(entity, obj) -> QuerySet:
+    return get_object_permission_model(obj).objects.filter(
         to_id=entity.id,
         to_ct=ContentType.objects.get_for_model(entity),
         object_id=obj.id,
         object_ct=ContentType.objects.get_for_model(obj)
-    )]
+    ).values_list("permission__codename", flat=True)
+
 
+def _object_mask_query(entity, obj) -> QuerySet:
+    return PermissionMask.objects.filter(**_grant_lookup(entity, obj)).values_list("mask", flat=True)
 
+
+@instrumented
 def get_gross_perms(entity, obj=None) -> list[str]:
     """
     Get the permissions for a user or group, including permissions from groups.
@@ -228,73 +999,79 @@ def get_gross_perms(entity, obj=None) -> list[str]:
     """
 
     if obj is None:
-        return get_perms(entity) + list(
-            reduce(concat,
-                   [[permission.codename for permission in group.permissions] for group in entity.groups]
-                   )
-        )
+        return _model_codenames(get_model_perms(entity).all)
+
+    obj_perms = get_cached_perms(entity, obj)
+    if obj_perms is None:
+        obj_perms = load_entity_perms(entity, ContentType.objects.get_for_model(obj), [obj.pk]).get(obj.pk,
+                                                                                                 EMPTY_PERMS)
 
-    return get_perms(entity, obj) + [perm.permission.codename for perm in get_object_group_model(obj).objects.filter(
-        users__in=[entity],
-        object=obj,
-    )]
+    return sorted(obj_perms.all)
 
 
-def get_users_with_perms(perms, obj=None, content_type=None, with_group_users=True) -> \
-        list[get_user_model()]:
+@instrumented
+def get_users_with_perms(perms, obj=None, content_type=None, with_group_users=True, ids_only=False) -> QuerySet:
     """
     Get all users that have the specified permission(s).
 
+    The users are selected with a single query, in which every source of permissions is a
+    subquery over user ids, so each user is returned once.
+
     Args:
         perms: A list of permissions to check.
         obj: The object to check the permissions on.
-        with_group_users: Include users in groups that have the permission in the result.
         content_type (ContentType): The ContentType of the object.
+        with_group_users: Include users that have the permission through their groups, and through
+            object groups if obj is provided.
+        ids_only (bool): Select only the ids of the users, e.g. to stream them with ``iterator()``.
 
     Returns:
-        list[User]: A list of users that have the permission.
+        QuerySet: The users that have the permission, ordered by id.
     """
 
     if not isinstance(perms, list):
         perms = [perms]
 
+    user_model = get_user_model()
+
     if obj is None:
         if content_type is None:
             raise ValueError("Content type must be provided if obj is None.")
 
-        permissions = get_user_model().objects.filter(
+        condition = Q(pk__in=user_model.objects.filter(
             user_permissions__codename__in=perms,
             user_permissions__content_type=content_type,
-        ).distinct()
+        ).values("pk"))
 
         if with_group_users:
-            permissions = list(permissions) + list(get_user_model().objects.filter(
+            condition |= Q(pk__in=user_model.objects.filter(
                 groups__permissions__codename__in=perms,
                 groups__permissions__content_type=content_type,
-            ).distinct())
+            ).values("pk"))
+    else:
+        ct = ContentType.objects.get_for_model(obj)
+        permission_ids = _resolve_permissions(perms, ct)
+        permissions = _object_grants(ct, perms, permission_ids).filter(object_id=obj.pk)
 
-        return permissions
+        condition = Q(pk__in=entity_pk_values(permissions.filter(to_ct=ContentType.objects.get_for_model(user_model)),
+                                              user_model))
 
-    permissions = get_object_permission_model(obj).objects.filter(
-        permission__codename__in=perms,
-    )
-
-    users = list(
-        [permission.to for permission in permissions.filter(to_ct=ContentType.objects.get_for_model(get_user_model()))]
-    )
+        if with_group_users:
+            condition |= Q(pk__in=user_model.objects.filter(groups__in=entity_pk_values(
+                permissions.filter(to_ct=ContentType.objects.get_for_model(Group)), Group)).values("pk"))
+            condition |= Q(pk__in=get_object_group_model(obj).objects.filter(
+                target_ct=ct,
+                target_id=obj.pk,
+                permissions__in=permission_ids,
+            ).values("users"))
 
-    if with_group_users:
-        if obj is None:
-            groups = Group.objects.filter(groups__permissions__codename__in=perms)
-        else:
-            groups = get_object_group_model(obj).objects.filter(permissions__codename__in=perms, target_id=obj.id,
-                                                                target_ct=ContentType.objects.get_for_model(obj))
-        users += itertools.chain(*[list(group.users.all()) for group in groups])
+    users = user_model.objects.filter(condition).order_by("pk")
 
-    return users
+    return users.values_list("pk", flat=True) if ids_only else users
 
 
-def get_groups_with_perms(perms: list[str] | str, content_type: ContentType, obj=None) -> list[Group]:
+@instrumented
+def get_groups_with_perms(perms: list[str] | str, content_type: ContentType, obj=None) -> QuerySet:
     """
     Get all groups that have the specified permission(s).
 
@@ -304,7 +1081,7 @@ def get_groups_with_perms(perms: list[str] | str, content_type: ContentType, obj
         obj: The object, if checking for object permissions.
 
     Returns:
-        list[Group]: A list of groups that have the permission.
+        QuerySet: The groups that have the permission, ordered by id.
     """
 
     if not isinstance(perms, list):
@@ -314,20 +1091,50 @@ def get_groups_with_perms(perms: list[str] | str, content_type: ContentType, obj
         raise ValueError("Content type must be provided if obj is None.")
 
     if obj is None:
-        return list(Group.objects.filter(permissions__codename__in=perms, permissions__content_type=content_type))
+        groups = Group.objects.filter(pk__in=Group.objects.filter(
+            permissions__codename__in=perms,
+            permissions__content_type=content_type,
+        ).values("pk"))
+    else:
+        ct = content_type if content_type else ContentType.objects.get_for_model(obj)
+        permission_ids = _resolve_permissions(perms, ct)
+
+        groups = Group.objects.filter(pk__in=entity_pk_values(_object_grants(ct, perms, permission_ids).filter(
+            to_ct=ContentType.objects.get_for_model(Group),
+            object_id=obj.pk,
+        ), Group))
 
-    ct = content_type if content_type else ContentType.objects.get_for_model(obj)
+    return groups.order_by("pk")
 
-    permissions = get_object_permission_model(obj).objects.filter(permission__codename__in=perms,
-                                                                  permission__content_type=ct,
-                                                                  object_ct=ct,
-                                                                  object_id=obj.id,
-                                                                  to_ct=ContentType.objects.get_for_model(Group),
-                                                                  ).distinct()
 
-    return [perm.to for perm in permissions]
+@instrumented
+def get_object_groups_with_perms(perms: list[str] | str, obj, content_type: ContentType = None) -> QuerySet:
+    """
+    Get the object groups of obj that grant the specified permission(s).
 
+    Args:
+        perms (list[str] | str): Permission string(s) to check.
+        obj: The object the object groups target.
+        content_type (ContentType): The content type of obj, looked up if not provided.
 
+    Returns:
+        QuerySet: The object groups that grant the permission, ordered by id.
+    """
+
+    if not isinstance(perms, list):
+        perms = [perms]
+
+    ct = content_type if content_type else ContentType.objects.get_for_model(obj)
+    object_group_model = get_object_group_model(obj)
+
+    return object_group_model.objects.filter(pk__in=object_group_model.objects.filter(
+        target_ct=ct,
+        target_id=obj.pk,
+        permissions__in=_resolve_permissions(perms, ct),
+    ).values("pk")).order_by("pk")
+
+
+@instrumented
 def get_objects_for_entity(entity: get_user_model() | Group, permissions: list[str] | str, ct: ContentType,
                            with_group_users=True) -> \
         list[any]:
@@ -343,22 +1150,52 @@ def get_objects_for_entity(entity: get_user_model() | Group, permissions: list[s
     assert not (with_group_users is True and isinstance(entity, Group)), \
         "Entity must be a user if with_group_users is set."
 
+    return list(get_objects_for_entity_queryset(entity, permissions, ct, with_group_users=with_group_users,
+                                                with_object_groups=False))
+
+
+@instrumented
+async def aget_objects_for_entity(entity: get_user_model() | Group, permissions: list[str] | str, ct: ContentType,
+                                  with_group_users=True) -> list[any]:
+    """
+    Async version of get_objects_for_entity.
+    """
+
+    assert not (with_group_users is True and isinstance(entity, Group)), \
+        "Entity must be a user if with_group_users is set."
+
+    await _awarm_content_types(get_user_model(), Group, type(entity))
+
+    return [obj async for obj in get_objects_for_entity_queryset(entity, permissions, ct,
+                                                                 with_group_users=with_group_users,
+                                                                 with_object_groups=False)]
+
+
+@instrumented
+def get_objects_for_entity_queryset(entity: get_user_model() | Group, permissions: list[str] | str,
+                                    ct: ContentType, with_group_users=True, with_object_groups=True,
+                                    queryset: QuerySet = None) -> QuerySet:
+    """
+    Same as get_objects_for_entity, but returns a lazy QuerySet of the objects, filtered in
+    the database, so it can be further filtered, ordered and paginated.
+
+    Args:
+        entity: The user or group that has access to the objects.
+        permissions (list[str]): The permissions required, any of which grants access.
+        ct (ContentType): The content type of the objects.
+        with_group_users (bool): Regard permissions granted to the groups of a user.
+        with_object_groups (bool): Regard permissions granted through the object groups of a user.
+        queryset (QuerySet): The objects to filter, defaults to all objects of the content type.
+
+    Returns:
+        QuerySet: The objects the entity has the permissions on.
+    """
+
     if not isinstance(permissions, list):
         permissions = [permissions]
 
-    perms = get_object_permission_model().objects.filter(
-        to_ct=ContentType.objects.get_for_model(entity),
-        to_id=entity.id,
-        permission__codename__in=permissions,
-        permission__content_type=ct,
-    )
-
-    if with_group_users:
-        perms = perms | get_object_permission_model().objects.filter(
-            to_ct=ContentType.objects.get_for_model(Group),
-            to_id__in=[group.id for group in entity.groups.all()],
-            permission__codename__in=permissions,
-            permission__content_type=ct,
-        )
+    if queryset is None:
+        queryset = ct.model_class()._default_manager.all()
 
-    return [perm.object for perm in perms]
+    return queryset.filter(_perm_condition(entity, permissions, ct, with_group_users=with_group_users,
+                                           with_object_groups=with_object_groups))
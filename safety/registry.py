@@ -0,0 +1,126 @@
+from django.contrib.auth.models import Permission
+from django.contrib.contenttypes.models import ContentType
+from django.core.signals import request_started
+from django.db import transaction
+
+
+class PermissionRegistry:
+    """
+    Maps ``(content type, codename)`` pairs to Permission ids, so that permissions are not
+    looked up in ``auth_permission`` on every call.
+
+    The registry is warmed with every permission at once and kept up to date by the
+    ``post_migrate`` signal and the save and delete signals of Permission. Permissions
+    that are not registered are looked up individually; misses are not remembered, as
+    the permission may be created by another process.
+
+    Ids found or created in a transaction are only remembered once it commits, as the
+    permission is gone if it is rolled back.
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._keys = {}
+
+    def warm(self):
+        """
+        Load every permission into the registry with a single query.
+        """
+
+        self._ids = {
+            (content_type_id, codename): permission_id
+            for content_type_id, codename, permission_id in
+            Permission.objects.order_by().values_list('content_type_id', 'codename', 'id')
+        }
+        self._keys = {permission_id: key for key, permission_id in self._ids.items()}
+
+    def clear(self):
+        self._ids = {}
+        self._keys = {}
+
+    def _store(self, key: tuple, permission_id: int):
+        self._forget(permission_id)
+        self._ids[key] = permission_id
+        self._keys[permission_id] = key
+
+    def _forget(self, permission_id: int):
+        key = self._keys.pop(permission_id, None)
+        if key is not None and self._ids.get(key) == permission_id:
+            del self._ids[key]
+
+    def register(self, permission: Permission):
+        self._store((permission.content_type_id, permission.codename), permission.id)
+
+    def unregister(self, permission: Permission):
+        self._forget(permission.id)
+
+    def get_id(self, ct: ContentType, codename: str, create=False) -> int | None:
+        """
+        Get the id of a permission.
+
+        Args:
+            ct (ContentType): The content type of the permission.
+            codename (string): The codename of the permission.
+            create (bool): Create the permission if it does not exist.
+
+        Returns:
+            int | None: The id of the permission, or None if it does not exist and create is False.
+        """
+
+        key = (ct.id, codename)
+
+        if key in self._ids:
+            return self._ids[key]
+
+        if create:
+            permission_id = Permission.objects.get_or_create(codename=codename, content_type=ct)[0].id
+        else:
+            permission_id = Permission.objects.filter(codename=codename, content_type=ct).values_list(
+                'id', flat=True).first()
+            if permission_id is None:
+                return None
+
+        transaction.on_commit(lambda: self._store(key, permission_id))
+        return permission_id
+
+    async def aget_id(self, ct: ContentType, codename: str, create=False) -> int | None:
+        """
+        Async version of get_id.
+        """
+
+        key = (ct.id, codename)
+
+        if key in self._ids:
+            return self._ids[key]
+
+        if create:
+            permission_id = (await Permission.objects.aget_or_create(codename=codename, content_type=ct))[0].id
+        else:
+            permission_id = await Permission.objects.filter(codename=codename, content_type=ct).values_list(
+                'id', flat=True).afirst()
+            if permission_id is None:
+                return None
+
+        # Async queries run in autocommit mode, so the permission is committed.
+        self._store(key, permission_id)
+        return permission_id
+
+
+permission_registry = PermissionRegistry()
+
+
+def clear_registry(**kwargs):
+    permission_registry.clear()
+
+
+def warm_registry(sender, **kwargs):
+    request_started.disconnect(warm_registry, dispatch_uid='safety_warm_registry')
+    permission_registry.warm()
+
+
+def register_permission(sender, instance, using=None, **kwargs):
+    transaction.on_commit(lambda: permission_registry.register(instance), using=using)
+
+
+def unregister_permission(sender, instance, **kwargs):
+    permission_registry.unregister(instance)
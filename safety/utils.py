@@ -1,5 +1,7 @@
 from django.conf import settings
 from django.contrib.contenttypes.models import ContentType
+from django.db.models import CharField
+from django.db.models.functions import Cast
 
 from safety.models import ObjectPermission, ObjectGroup
 
@@ -44,3 +46,41 @@ def get_object_group_model(obj=None):
     return ContentType.objects.get_model(settings.SAFETY_PERMISSION_GROUP_MODEL) \
         if hasattr(settings, 'SAFETY_OBJECT_GROUP_MODEL') \
         else ObjectGroup
+
+
+def to_id_values(queryset):
+    """
+    Selects the primary keys of a queryset in the form they are stored in the ``to_id``
+    column of object permissions, for use in ``to_id__in`` lookups. The keys are only cast
+    if ``to_id`` is a character column, see ``SAFETY_ENTITY_ID_TYPE``.
+
+    Args:
+        queryset: The users or groups to select.
+    Returns:
+        A values queryset of the primary keys.
+    """
+
+    if get_object_permission_model()._meta.get_field('to_id').get_internal_type() != 'CharField':
+        return queryset.values('pk')
+
+    return queryset.annotate(safety_to_id=Cast('pk', output_field=CharField())).values('safety_to_id')
+
+
+def entity_pk_values(queryset, model):
+    """
+    Selects the ``to_id`` column of object permissions in the form of the primary keys of
+    a user or group model, for use in ``pk__in`` lookups. The ids are only cast if ``to_id``
+    is a character column, see ``SAFETY_ENTITY_ID_TYPE``.
+
+    Args:
+        queryset: The object permissions to select.
+        model: The user or group model the permissions are granted to.
+    Returns:
+        A values queryset of the primary keys.
+    """
+
+    if queryset.model._meta.get_field('to_id').get_internal_type() != 'CharField':
+        return queryset.values('to_id')
+
+    # pylint: disable-next=protected-access
+    return queryset.annotate(safety_pk=Cast('to_id', output_field=model._meta.pk)).values('safety_pk')
@@ -1,8 +1,38 @@
 from django.db import models
 
+from safety.managers import PermissionManager
+
 
 # Create your models here.
 
 class FakePost(models.Model):
     title = models.CharField(max_length=100)
     content = models.TextField()
+
+    objects = PermissionManager()
+
+
+class Folder(models.Model):
+    name = models.CharField(max_length=100)
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, null=True, blank=True, related_name='children')
+
+    objects = PermissionManager()
+
+    class Meta:
+        permissions = [('read', 'Can read')]
+
+    def get_permission_parent(self):
+        return self.parent
+
+
+class Document(models.Model):
+    title = models.CharField(max_length=100)
+    folder = models.ForeignKey(Folder, on_delete=models.SET_NULL, null=True, blank=True, related_name='documents')
+
+    objects = PermissionManager()
+
+    class Meta:
+        permissions = [('read', 'Can read')]
+
+    def get_permission_parent(self):
+        return self.folder
@@ -1,14 +1,42 @@
+import asyncio
+import io
+import json
+import os
+import tempfile
+import threading
+from unittest import skipUnless
+
+from django.apps import apps
+from django.core.management import call_command, CommandError
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group, Permission
 from django.contrib.contenttypes.models import ContentType
-from django.db import models
-from django.test import TransactionTestCase
+from django.db import connection, models, transaction
+from django.db.models import Count, Q
+from django.db.models.signals import pre_delete
+from django.http import HttpResponse
+from django.test import RequestFactory, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django_fake_model import models as f
 
-from safety.utils import set_perm, has_perm, lift_perm, create_object_group, delete_object_group, \
-    add_user_to_object_group, remove_user_from_object_group, get_users_with_perms, get_groups_with_perms, \
-    retrieve_object_group, get_objects_for_entity
-from safety_tests.models import FakePost
+from safety.cache import permission_cache, get_shared_cache, invalidate
+from safety.cleanup import delete_orphaned_grants, track_deletions, untrack_deletions
+from safety.effective import connect_signals, disconnect_signals, refresh_effective_permissions
+from safety.fields import normalize_id_columns
+from safety.hierarchy import rebuild_ancestors, sync_ancestors
+from safety.instrumentation import permission_called
+from safety.middleware import PermissionInstrumentationMiddleware
+from safety.models import EffectivePermission, ObjectAncestor, ObjectGroup, ObjectPermission, PermissionMask
+from safety.registry import permission_registry
+from safety.object_group import create_object_group, delete_object_group, add_user_to_object_group, \
+    remove_user_from_object_group, retrieve_object_group, create_object_groups_bulk, add_users_to_object_group, \
+    remove_users_from_object_group, get_object_groups_for_user
+from safety.perms import set_perm, has_perm, lift_perm, get_users_with_perms, get_groups_with_perms, \
+    get_objects_for_entity, get_perms, has_gross_perm, has_perm_many, has_gross_perm_many, \
+    get_objects_for_entity_queryset, set_perm_many, lift_perm_many, prefetch_object_perms, ahas_perm, \
+    ahas_gross_perm, aget_perms, aset_perm, alift_perm, aget_objects_for_entity, get_gross_perms, \
+    get_object_groups_with_perms
+from safety_tests.models import Document, FakePost, Folder
 
 
 class TestObjectPermission(TransactionTestCase):
@@ -95,7 +123,7 @@ class TestObjectPermission(TransactionTestCase):
         create_object_group("editors", ["view_fakepost"], self.posts[0])
         add_user_to_object_group(self.users[0], "editors", self.posts[0])
 
-        self.assertListEqual(get_users_with_perms("view_fakepost", self.posts[0], with_group_users=True),
+        self.assertListEqual(list(get_users_with_perms("view_fakepost", self.posts[0], with_group_users=True)),
                              [self.users[0]])
 
     def test_get_users_with_group_perms_global(self):
@@ -104,21 +132,21 @@ class TestObjectPermission(TransactionTestCase):
         self.users[0].groups.add(group)
         self.users[1].groups.add(group)
 
-        self.assertListEqual(get_users_with_perms("view_fakepost", content_type=self.fake_post_ct,
-                                                  with_group_users=True), [self.users[0], self.users[1]])
+        self.assertListEqual(list(get_users_with_perms("view_fakepost", content_type=self.fake_post_ct,
+                                                       with_group_users=True)), [self.users[0], self.users[1]])
 
     def test_get_users_with_group_perms_global_with_group_users(self):
         create_object_group("editors", ["view_fakepost"], self.posts[0])
         add_user_to_object_group(self.users[0], "editors", self.posts[0])
 
-        self.assertListEqual(get_users_with_perms("view_fakepost", self.posts[0], with_group_users=True),
+        self.assertListEqual(list(get_users_with_perms("view_fakepost", self.posts[0], with_group_users=True)),
                              [self.users[0]])
 
     def test_get_groups_with_perms(self):
         set_perm(self.groups[0], "view_fakepost", self.posts[0])
         set_perm(self.groups[1], "view_fakepost", self.posts[0])
 
-        self.assertListEqual(get_groups_with_perms("view_fakepost", self.fake_post_ct, self.posts[0]),
+        self.assertListEqual(list(get_groups_with_perms("view_fakepost", self.fake_post_ct, self.posts[0])),
                              [self.groups[0], self.groups[1]])
 
     def test_get_groups_with_perms_global(self):
@@ -126,7 +154,7 @@ class TestObjectPermission(TransactionTestCase):
         set_perm(self.groups[1], "view_fakepost", content_type=self.fake_post_ct)
 
         self.assertListEqual(
-            get_groups_with_perms("view_fakepost", content_type=self.fake_post_ct),
+            list(get_groups_with_perms("view_fakepost", content_type=self.fake_post_ct)),
             [self.groups[0], self.groups[1]])
 
     def test_get_objects_for_entity(self):
@@ -211,3 +239,1360 @@ class TestObjectGroup(TransactionTestCase):
         self.posts[0].delete()
 
         self.assertFalse(has_perm([self.users[0]], "change_fakepost", post))
+
+
+class TestPermissionCache(TransactionTestCase):
+    """
+    Tests the per-request permission cache, making sure lookups are answered from memory and that changes made
+    through the permission API within the same request are visible.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(5)]
+
+    def test_single_query_per_content_type(self):
+        set_perm(self.user, "view_fakepost", self.posts[0])
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+        with permission_cache():
+            with self.assertNumQueries(1):
+                results = [has_perm([self.user], "view_fakepost", post) for post in self.posts]
+                get_perms(self.user, self.posts[0])
+
+        self.assertListEqual(results, [True, False, False, False, False])
+
+    def test_set_and_lift_perm_invalidate(self):
+        with permission_cache():
+            self.assertFalse(has_perm([self.user], "view_fakepost", self.posts[0]))
+            set_perm(self.user, "view_fakepost", self.posts[0])
+            self.assertTrue(has_perm([self.user], "view_fakepost", self.posts[0]))
+            lift_perm(self.user, "view_fakepost", self.posts[0])
+            self.assertFalse(has_perm([self.user], "view_fakepost", self.posts[0]))
+
+    def test_object_group_membership_invalidates(self):
+        create_object_group("editors", ["change_fakepost"], self.posts[0])
+
+        with permission_cache():
+            self.assertFalse(has_perm([self.user], "change_fakepost", self.posts[0]))
+            add_user_to_object_group(self.user, "editors", self.posts[0])
+            self.assertTrue(has_perm([self.user], "change_fakepost", self.posts[0]))
+            remove_user_from_object_group(self.user, "editors", self.posts[0])
+            self.assertFalse(has_perm([self.user], "change_fakepost", self.posts[0]))
+
+    def test_gross_perm_through_group(self):
+        self.user.groups.add(self.group)
+
+        with permission_cache():
+            self.assertFalse(has_gross_perm([self.user], "view_fakepost", self.posts[0]))
+            set_perm(self.group, "view_fakepost", self.posts[0])
+            self.assertTrue(has_gross_perm([self.user], "view_fakepost", self.posts[0]))
+            self.assertFalse(has_perm([self.user], "view_fakepost", self.posts[0]))
+
+
+@override_settings(SAFETY_SHARED_CACHE="safety",
+                   CACHES={"safety": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+class TestSharedPermissionCache(TransactionTestCase):
+    """
+    Tests the shared permission cache, making sure entries are reused across requests and never served after the
+    permissions they were derived from changed.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.post = FakePost.objects.create(title="TestPost", content="TestContent")
+        self.shared = get_shared_cache()
+        self.shared.backend.clear()
+        self.shared.reset_stats()
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_hit_after_miss(self):
+        set_perm(self.user, "view_fakepost", self.post)
+
+        self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+        with self.assertNumQueries(0):
+            self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+
+        self.assertDictEqual(self.shared.stats(), {"hits": 1, "misses": 1})
+
+    def test_miss_writes_back_requested_object(self):
+        posts = [self.post] + [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(20)]
+        set_perm_many([self.user], ["view_fakepost"], posts)
+        self.shared.backend.clear()
+
+        with permission_cache():
+            self.assertTrue(has_perm([self.user], "view_fakepost", posts[0]))
+            self.assertTrue(has_perm([self.user], "view_fakepost", posts[1]))
+
+        # The version counters of the entity and of one object, and one entry.
+        self.assertEqual(len(self.shared.backend._cache), 3)
+        self.assertTrue(has_perm([self.user], "view_fakepost", posts[1]))
+        self.assertDictEqual(self.shared.stats(), {"hits": 0, "misses": 2})
+
+    def test_perm_changes_bump_versions(self):
+        self.assertFalse(has_perm([self.user], "view_fakepost", self.post))
+        set_perm(self.user, "view_fakepost", self.post)
+        self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+
+        with permission_cache():
+            self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+            lift_perm(self.user, "view_fakepost", self.post)
+            self.assertFalse(has_perm([self.user], "view_fakepost", self.post))
+
+        self.assertFalse(has_perm([self.user], "view_fakepost", self.post))
+
+    def test_group_changes_bump_versions(self):
+        set_perm(self.group, "view_fakepost", self.post)
+        self.assertFalse(has_gross_perm([self.user], "view_fakepost", self.post))
+
+        self.user.groups.add(self.group)
+        self.assertTrue(has_gross_perm([self.user], "view_fakepost", self.post))
+
+        lift_perm(self.group, "view_fakepost", self.post)
+        self.assertFalse(has_gross_perm([self.user], "view_fakepost", self.post))
+
+    def test_group_deletion_bumps_versions(self):
+        self.user.groups.add(self.group)
+        set_perm(self.group, "view_fakepost", self.post)
+        self.assertTrue(has_gross_perm([self.user], "view_fakepost", self.post))
+
+        self.group.delete()
+        self.assertFalse(has_gross_perm([self.user], "view_fakepost", self.post))
+
+    def test_file_based_backend(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={"safety": {
+            "BACKEND": "django.core.cache.backends.filebased.FileBasedCache", "LOCATION": location,
+        }}):
+            create_object_group("editors", ["change_fakepost"], self.post)
+            self.assertFalse(has_perm([self.user], "change_fakepost", self.post))
+            add_user_to_object_group(self.user, "editors", self.post)
+            self.assertTrue(has_perm([self.user], "change_fakepost", self.post))
+            self.assertTrue(has_perm([self.user], "change_fakepost", self.post))
+
+        self.assertEqual(self.shared.hits, 1)
+
+
+class TestHasPermMany(TransactionTestCase):
+    """
+    Tests checking a permission on many objects at once.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.user.groups.add(self.group)
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(6)]
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_has_perm_many(self):
+        set_perm(self.user, "change_fakepost", self.posts[0])
+        create_object_group("editors", ["change_fakepost"], self.posts[1])
+        add_user_to_object_group(self.user, "editors", self.posts[1])
+        set_perm(self.group, "change_fakepost", self.posts[2])
+
+        with self.assertNumQueries(1):
+            result = has_perm_many(self.user, "change_fakepost", self.posts)
+
+        self.assertDictEqual(result, {post.id: index < 2 for index, post in enumerate(self.posts)})
+
+    def test_has_gross_perm_many_queryset(self):
+        set_perm(self.group, "change_fakepost", self.posts[2])
+        set_perm(self.user, "change_fakepost", self.posts[4])
+
+        with self.assertNumQueries(1):
+            result = has_gross_perm_many(self.user, "change_fakepost", FakePost.objects.filter(id__gt=self.posts[1].id))
+
+        self.assertDictEqual(result, {post.id: index in (2, 4) for index, post in enumerate(self.posts) if index > 1})
+
+    def test_superuser(self):
+        self.user.is_superuser = True
+
+        self.assertTrue(all(has_perm_many(self.user, "change_fakepost", FakePost.objects.all()).values()))
+
+
+class TestObjectsForEntityQueryset(TransactionTestCase):
+    """
+    Tests retrieving the objects an entity has permissions on as a QuerySet.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.user.groups.add(self.group)
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(4)]
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+
+    def test_all_sources(self):
+        set_perm(self.user, "view_fakepost", self.posts[0])
+        set_perm(self.group, "view_fakepost", self.posts[1])
+        create_object_group("viewers", ["view_fakepost"], self.posts[2])
+        add_user_to_object_group(self.user, "viewers", self.posts[2])
+
+        with self.assertNumQueries(1):
+            objects = list(get_objects_for_entity_queryset(self.user, "view_fakepost", self.fake_post_ct)
+                           .order_by("id"))
+
+        self.assertListEqual(objects, self.posts[:3])
+
+    def test_chaining(self):
+        for post in self.posts:
+            set_perm(self.user, "view_fakepost", post)
+
+        objects = get_objects_for_entity_queryset(self.user, "view_fakepost", self.fake_post_ct,
+                                                  queryset=FakePost.objects.exclude(id=self.posts[0].id))
+
+        self.assertQuerysetEqual(objects.filter(id__lte=self.posts[2].id).order_by("-id"),
+                                 [self.posts[2], self.posts[1]])
+
+
+@override_settings(AUTHENTICATION_BACKENDS=["django.contrib.auth.backends.ModelBackend",
+                                            "safety.backends.ObjectPermissionBackend"])
+class TestObjectPermissionBackend(TransactionTestCase):
+    """
+    Tests answering object permission checks made through the user model.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.user.groups.add(self.group)
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(3)]
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_has_perm(self):
+        set_perm(self.user, "view_fakepost", self.posts[0])
+        set_perm(self.group, "change_fakepost", self.posts[1])
+
+        with self.assertNumQueries(1):
+            self.assertTrue(self.user.has_perm("safety_tests.view_fakepost", self.posts[0]))
+            self.assertFalse(self.user.has_perm("safety_tests.view_fakepost", self.posts[1]))
+            self.assertTrue(self.user.has_perm("safety_tests.change_fakepost", self.posts[1]))
+            self.assertFalse(self.user.has_perm("safety_tests.change_fakepost", self.posts[2]))
+
+    def test_get_permissions(self):
+        set_perm(self.user, "view_fakepost", self.posts[0])
+        set_perm(self.group, "change_fakepost", self.posts[0])
+
+        self.assertSetEqual(self.user.get_user_permissions(self.posts[0]), {"safety_tests.view_fakepost"})
+        self.assertSetEqual(self.user.get_group_permissions(self.posts[0]), {"safety_tests.change_fakepost"})
+        self.assertSetEqual(self.user.get_all_permissions(self.posts[0]),
+                            {"safety_tests.view_fakepost", "safety_tests.change_fakepost"})
+
+    def test_inherited_permissions(self):
+        root = Folder.objects.create(name="Root")
+        folder = Folder.objects.create(name="Folder", parent=root)
+        document = Document.objects.create(title="Document", folder=folder)
+        set_perm(self.user, "read", root)
+        set_perm(self.group, "change_folder", folder)
+
+        for perm, obj in [("read", document), ("change_folder", document), ("read", folder), ("delete_folder", folder),
+                          ("change_folder", root)]:
+            self.assertEqual(self.user.has_perm(f"safety_tests.{perm}", obj),
+                             has_perm([self.user], perm, obj) or has_perm([self.group], perm, obj))
+        self.assertTrue(self.user.has_perm("safety_tests.read", document))
+        self.assertSetEqual(self.user.get_all_permissions(document), set())
+
+    def test_set_perm_clears_cache(self):
+        self.assertFalse(self.user.has_perm("safety_tests.view_fakepost", self.posts[0]))
+        set_perm(self.user, "view_fakepost", self.posts[0])
+        self.assertTrue(self.user.has_perm("safety_tests.view_fakepost", self.posts[0]))
+
+
+class TestIdColumnTypes(TransactionTestCase):
+    """
+    Tests the conversion of stored ids done before the id columns are given the types selected in the settings.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.post = FakePost.objects.create(title="TestPost", content="TestContent")
+        self.user_ct = ContentType.objects.get_for_model(get_user_model())
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+        self.permissions = Permission.objects.filter(content_type=self.fake_post_ct)
+
+    def create_permission(self, to_id, permission):
+        return ObjectPermission.objects.create(to_id=to_id, to_ct=self.user_ct, permission=permission,
+                                               object_ct=self.fake_post_ct, object_id=self.post.id)
+
+    @skipUnless(ObjectPermission._meta.get_field("to_id").get_internal_type() == "CharField",
+                "Only character ids can differ in formatting.")
+    @override_settings(SAFETY_ENTITY_ID_TYPE="integer")
+    def test_normalize_integer_ids(self):
+        self.create_permission(str(self.user.id), self.permissions[0])
+        self.create_permission(f"0{self.user.id}", self.permissions[0])
+        self.create_permission(f" {self.user.id}", self.permissions[1])
+
+        normalize_id_columns(apps, None)
+
+        self.assertListEqual(sorted(ObjectPermission.objects.values_list("to_id", "permission")),
+                             [(str(self.user.id), self.permissions[0].id), (str(self.user.id), self.permissions[1].id)])
+        self.assertTrue(has_perm([self.user], self.permissions[1].codename, self.post))
+
+    @override_settings(SAFETY_ENTITY_ID_TYPE="uuid")
+    def test_invalid_ids(self):
+        self.create_permission(str(self.user.id), self.permissions[0])
+
+        with self.assertRaises(ValueError):
+            normalize_id_columns(apps, None)
+
+
+class TestBulkPermissions(TransactionTestCase):
+    """
+    Tests setting and lifting permissions of many entities on many objects at once.
+    """
+
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(username=f"TestUser{i}", password="TestPassword")
+                      for i in range(3)]
+        self.group = Group.objects.create(name="TestGroup")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(4)]
+
+    def test_set_perm_many(self):
+        set_perm(self.users[0], "view_fakepost", self.posts[0])
+
+        created = set_perm_many(self.users + [self.group], ["view_fakepost", "change_fakepost"], self.posts,
+                                chunk_size=5)
+
+        self.assertEqual(created, 4 * 2 * 4 - 1)
+        self.assertEqual(ObjectPermission.objects.count(), 4 * 2 * 4)
+        self.assertTrue(has_perm(self.users + [self.group], "change_fakepost", self.posts[3]))
+
+    def test_set_perm_many_queries(self):
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+        Permission.objects.get_or_create(codename="view_fakepost",
+                                         content_type=ContentType.objects.get_for_model(FakePost))
+
+        with self.assertNumQueries(6):
+            set_perm_many(self.users, "view_fakepost", FakePost.objects.all())
+
+    def test_lift_perm_many(self):
+        set_perm_many(self.users, ["view_fakepost", "change_fakepost"], self.posts)
+
+        with permission_cache():
+            self.assertTrue(has_perm([self.users[1]], "change_fakepost", self.posts[1]))
+
+            removed = lift_perm_many(self.users[1:], "change_fakepost", FakePost.objects.all(), chunk_size=3)
+
+            self.assertEqual(removed, 2 * 4)
+            self.assertFalse(has_perm([self.users[1]], "change_fakepost", self.posts[1]))
+            self.assertTrue(has_perm([self.users[0]], "change_fakepost", self.posts[1]))
+
+
+class TestPermissionRegistry(TransactionTestCase):
+    """
+    Tests resolving permission ids without querying the permission table.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.post = FakePost.objects.create(title="TestPost", content="TestContent")
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_has_perm_without_permission_queries(self):
+        set_perm(self.user, "view_fakepost", self.post)
+        permission_registry.warm()
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+            self.assertFalse(has_perm([self.user], "change_fakepost", self.post))
+
+        self.assertFalse(any("auth_permission" in query["sql"] for query in context.captured_queries))
+
+    def test_codename_shared_between_content_types(self):
+        Permission.objects.create(codename="view_fakepost", name="Clash",
+                                  content_type=ContentType.objects.get_for_model(get_user_model()))
+        set_perm(self.user, "view_fakepost", self.post)
+
+        self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+
+    def test_signals_keep_registry_current(self):
+        permission = Permission.objects.create(codename="share_fakepost", name="Share", content_type=self.fake_post_ct)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(permission_registry.get_id(self.fake_post_ct, "share_fakepost"), permission.id)
+
+        permission.delete()
+
+        self.assertIsNone(permission_registry.get_id(self.fake_post_ct, "share_fakepost"))
+
+    def test_rolled_back_permission_is_forgotten(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            set_perm(self.user, "share_fakepost", self.post)
+            self.assertTrue(has_perm([self.user], "share_fakepost", self.post))
+            raise RuntimeError
+
+        self.assertIsNone(permission_registry.get_id(self.fake_post_ct, "share_fakepost"))
+        self.assertTrue(set_perm(self.user, "share_fakepost", self.post))
+        self.assertTrue(has_perm([self.user], "share_fakepost", self.post))
+
+    def test_renamed_permission(self):
+        permission = Permission.objects.create(codename="share_fakepost", name="Share", content_type=self.fake_post_ct)
+        permission.codename = "publish_fakepost"
+        permission.save()
+
+        with self.assertNumQueries(0):
+            self.assertEqual(permission_registry.get_id(self.fake_post_ct, "publish_fakepost"), permission.id)
+        self.assertIsNone(permission_registry.get_id(self.fake_post_ct, "share_fakepost"))
+
+
+class TestGrossPermission(TransactionTestCase):
+    """
+    Tests checking permissions granted directly, through groups and through object groups in a single query.
+    """
+
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(username=f"TestUser{i}", password="TestPassword")
+                      for i in range(2)]
+        self.groups = [Group.objects.create(name=f"TestGroup{i}") for i in range(10)]
+        self.users[0].groups.add(*self.groups)
+        self.post = FakePost.objects.create(title="TestPost", content="TestContent")
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_constant_queries(self):
+        set_perm(self.groups[-1], "change_fakepost", self.post)
+
+        with self.assertNumQueries(1):
+            self.assertTrue(has_gross_perm([self.users[0]], "change_fakepost", self.post))
+        with self.assertNumQueries(1):
+            self.assertFalse(has_gross_perm([self.users[0]], "delete_fakepost", self.post))
+
+    def test_all_users_need_perm(self):
+        set_perm(self.groups[0], "change_fakepost", self.post)
+        create_object_group("editors", ["change_fakepost"], self.post)
+        add_user_to_object_group(self.users[1], "editors", self.post)
+
+        self.assertTrue(has_gross_perm(self.users, "change_fakepost", self.post))
+
+        remove_user_from_object_group(self.users[1], "editors", self.post)
+
+        self.assertFalse(has_gross_perm(self.users, "change_fakepost", self.post))
+        self.assertTrue(has_gross_perm([self.users[0]], "change_fakepost", self.post))
+
+
+class TestInstrumentation(TransactionTestCase):
+    """
+    Tests reporting the duration, queries and cache usage of calls to the permission API.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.post = FakePost.objects.create(title="TestPost", content="TestContent")
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+        self.calls = []
+        permission_called.connect(self.receive, dispatch_uid="test_instrumentation")
+
+    def tearDown(self):
+        permission_called.disconnect(dispatch_uid="test_instrumentation")
+        permission_called.disconnect(dispatch_uid="safety_collect_permission_call")
+
+    def receive(self, sender, call, **kwargs):
+        self.calls.append(call)
+
+    def test_reports_queries(self):
+        set_perm(self.user, "view_fakepost", self.post)
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+
+        call = self.calls[-1]
+        self.assertEqual(call.function, "safety.perms.has_perm")
+        self.assertEqual(call.queries, len(context.captured_queries))
+        self.assertGreater(call.duration, 0)
+        self.assertIsNone(call.cache_status)
+
+    def test_reports_cache_status(self):
+        with permission_cache():
+            has_perm([self.user], "view_fakepost", self.post)
+            get_perms(self.user, self.post)
+
+        self.assertListEqual([call.cache_status for call in self.calls], ["miss", "hit"])
+        self.assertEqual(self.calls[1].queries, 0)
+
+    def test_leaves_execute_wrappers_of_new_connection(self):
+        set_perm(self.user, "view_fakepost", self.post)
+        queries = []
+        result = {}
+
+        def wrapper(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        def check():
+            from django.db import connection as thread_connection
+            try:
+                with thread_connection.execute_wrapper(wrapper):
+                    has_perm([self.user], "view_fakepost", self.post)
+                with CaptureQueriesContext(thread_connection) as context:
+                    has_perm([self.user], "view_fakepost", self.post)
+                result["queries"] = len(context.captured_queries)
+                result["wrappers"] = list(thread_connection.execute_wrappers)
+            finally:
+                thread_connection.close()
+
+        thread = threading.Thread(target=check)
+        thread.start()
+        thread.join()
+
+        self.assertListEqual(result["wrappers"], [])
+        self.assertEqual(self.calls[-2].queries, len(queries))
+        self.assertEqual(self.calls[-1].queries, result["queries"])
+
+    def test_nested_calls_reported_once(self):
+        get_objects_for_entity(self.user, "view_fakepost", ContentType.objects.get_for_model(FakePost))
+
+        self.assertListEqual([call.function for call in self.calls], ["safety.perms.get_objects_for_entity"])
+
+    @override_settings(SAFETY_INSTRUMENTATION_HEADER="X-Safety-Perms")
+    def test_middleware_header(self):
+        def view(request):
+            has_perm([self.user], "view_fakepost", self.post)
+            create_object_group("editors", ["change_fakepost"], self.post)
+            return HttpResponse()
+
+        with self.assertLogs("safety.instrumentation", "INFO"):
+            response = PermissionInstrumentationMiddleware(view)(RequestFactory().get("/"))
+
+        self.assertTrue(response["X-Safety-Perms"].startswith("calls=2;queries="))
+
+
+class TestPrefetchObjectPerms(TransactionTestCase):
+    """
+    Tests loading the permissions of a user on a page of objects at once and reusing them in permission checks.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.user.groups.add(self.group)
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(5)]
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_checks_without_queries(self):
+        set_perm(self.user, "view_fakepost", self.posts[0])
+        set_perm(self.group, "change_fakepost", self.posts[1])
+        create_object_group("editors", ["delete_fakepost"], self.posts[2])
+        add_user_to_object_group(self.user, "editors", self.posts[2])
+
+        # One query for the page of posts and one for the permissions.
+        with self.assertNumQueries(2):
+            posts = prefetch_object_perms(FakePost.objects.order_by("pk"), self.user, to_attr="perms")
+
+        with self.assertNumQueries(0):
+            self.assertListEqual([post.perms for post in posts], [
+                {"view_fakepost"}, {"change_fakepost"}, {"delete_fakepost"}, set(), set()])
+            self.assertTrue(has_perm([self.user], "view_fakepost", posts[0]))
+            self.assertFalse(has_perm([self.user], "change_fakepost", posts[1]))
+            self.assertTrue(has_gross_perm([self.user], "change_fakepost", posts[1]))
+            self.assertListEqual(get_perms(self.user, posts[0]), ["view_fakepost"])
+
+    def test_changes_reload(self):
+        posts = prefetch_object_perms(self.posts, self.user)
+
+        set_perm(self.user, "view_fakepost", posts[0])
+
+        self.assertTrue(has_perm([self.user], "view_fakepost", posts[0]))
+        self.assertFalse(has_perm([self.group], "view_fakepost", posts[0]))
+
+
+class TestWithPermAnnotation(TransactionTestCase):
+    """
+    Tests annotating querysets with whether an entity has a permission, so rows can be filtered, ordered and
+    aggregated on it in the database.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.user.groups.add(self.group)
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(4)]
+        set_perm(self.user, "change_fakepost", self.posts[1])
+        set_perm(self.group, "change_fakepost", self.posts[2])
+        create_object_group("editors", ["change_fakepost"], self.posts[3])
+        add_user_to_object_group(self.user, "editors", self.posts[3])
+
+    def test_annotation(self):
+        posts = FakePost.objects.with_perm(self.user, "change_fakepost").order_by("pk")
+
+        self.assertListEqual([post.has_change_fakepost for post in posts], [False, True, False, True])
+
+    def test_filter_order_and_aggregate(self):
+        posts = FakePost.objects.with_perm(self.user, "change_fakepost", alias="editable", with_group_users=True)
+
+        self.assertListEqual(list(posts.filter(editable=True).order_by("pk")), self.posts[1:])
+        self.assertEqual(posts.order_by("-editable", "-pk")[3], self.posts[0])
+        self.assertEqual(posts.aggregate(count=Count("pk", filter=Q(editable=True)))["count"], 3)
+
+    def test_superuser(self):
+        superuser = get_user_model().objects.create_superuser(username="TestSuperUser", password="TestPassword")
+
+        self.assertTrue(all(post.has_view_fakepost for post in FakePost.objects.with_perm(superuser, "view_fakepost")))
+
+
+class TestUsersWithPerms(TransactionTestCase):
+    """
+    Tests selecting the users that have a permission on an object in a single query, without duplicates.
+    """
+
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(username=f"TestUser{i}", password="TestPassword")
+                      for i in range(4)]
+        self.group = Group.objects.create(name="TestGroup")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(2)]
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_all_sources_without_duplicates(self):
+        set_perm(self.users[0], "view_fakepost", self.posts[0])
+        set_perm(self.group, "view_fakepost", self.posts[0])
+        self.users[0].groups.add(self.group)
+        self.users[1].groups.add(self.group)
+        create_object_group("viewers", ["view_fakepost"], self.posts[0])
+        add_user_to_object_group(self.users[0], "viewers", self.posts[0])
+        add_user_to_object_group(self.users[2], "viewers", self.posts[0])
+        set_perm(self.users[3], "view_fakepost", self.posts[1])
+
+        with self.assertNumQueries(1):
+            self.assertListEqual(list(get_users_with_perms("view_fakepost", self.posts[0])), self.users[:3])
+
+        self.assertListEqual(list(get_users_with_perms("view_fakepost", self.posts[0], with_group_users=False)),
+                             [self.users[0]])
+
+    def test_ids_only(self):
+        set_perm(self.users[1], "view_fakepost", self.posts[0])
+        set_perm(self.users[2], "change_fakepost", self.posts[0])
+
+        self.assertListEqual(list(get_users_with_perms(["view_fakepost", "change_fakepost"], self.posts[0],
+                                                       ids_only=True).iterator()),
+                             [self.users[1].pk, self.users[2].pk])
+
+
+class TestGroupsWithPerms(TransactionTestCase):
+    """
+    Tests selecting the groups and object groups that have a permission on an object in a single query each.
+    """
+
+    def setUp(self):
+        self.groups = [Group.objects.create(name=f"TestGroup{i}") for i in range(3)]
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(2)]
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def test_single_query(self):
+        for group in self.groups:
+            set_perm(group, "view_fakepost", self.posts[0])
+            set_perm(group, "change_fakepost", self.posts[0])
+        set_perm(self.groups[0], "view_fakepost", self.posts[1])
+
+        with self.assertNumQueries(1):
+            self.assertListEqual(list(get_groups_with_perms(["view_fakepost", "change_fakepost"], self.fake_post_ct,
+                                                            self.posts[0])), self.groups)
+
+        self.assertListEqual(list(get_groups_with_perms("view_fakepost", self.fake_post_ct, self.posts[1])),
+                             self.groups[:1])
+
+    def test_with_object_groups(self):
+        set_perm(self.groups[1], "view_fakepost", self.posts[0])
+        editors = create_object_group("editors", ["view_fakepost", "change_fakepost"], self.posts[0])
+        create_object_group("owners", ["delete_fakepost"], self.posts[0])
+
+        self.assertListEqual(list(get_groups_with_perms(["view_fakepost", "change_fakepost"], self.fake_post_ct,
+                                                        self.posts[0])), [self.groups[1]])
+        self.assertListEqual(list(get_object_groups_with_perms(["view_fakepost", "change_fakepost"], self.posts[0])),
+                             [editors])
+
+
+@override_settings(SAFETY_EFFECTIVE_PERMISSIONS=True)
+class TestEffectivePermissions(TransactionTestCase):
+    """
+    Tests maintaining the table of permissions users hold directly, through groups and through object groups.
+    """
+
+    def setUp(self):
+        connect_signals()
+        self.users = [get_user_model().objects.create_user(username=f"TestUser{i}", password="TestPassword")
+                      for i in range(3)]
+        self.group = Group.objects.create(name="TestGroup")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(3)]
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    def tearDown(self):
+        disconnect_signals()
+
+    def assertConsistent(self):
+        self.assertEqual(refresh_effective_permissions(dry_run=True), (0, 0))
+
+    def effective(self, user):
+        return sorted(EffectivePermission.objects.filter(user=user).values_list("permission__codename", "object_id"))
+
+    def test_maintained_on_changes(self):
+        set_perm(self.users[0], "view_fakepost", self.posts[0])
+        set_perm(self.group, "change_fakepost", self.posts[1])
+        self.users[0].groups.add(self.group)
+        self.group.user_set.add(self.users[1])
+        create_object_group("editors", ["delete_fakepost"], self.posts[2])
+        add_user_to_object_group(self.users[0], "editors", self.posts[2])
+        self.assertConsistent()
+
+        self.assertListEqual(self.effective(self.users[0]), [
+            ("change_fakepost", self.posts[1].pk), ("delete_fakepost", self.posts[2].pk),
+            ("view_fakepost", self.posts[0].pk)])
+        with CaptureQueriesContext(connection) as context:
+            self.assertTrue(has_gross_perm([self.users[1]], "change_fakepost", self.posts[1]))
+        self.assertEqual(len(context.captured_queries), 1)
+        self.assertIn("safety_effectivepermission", context.captured_queries[0]["sql"])
+        self.assertListEqual(list(get_objects_for_entity_queryset(
+            self.users[0], ["change_fakepost", "delete_fakepost"], ContentType.objects.get_for_model(FakePost))),
+            self.posts[1:])
+
+        self.users[0].groups.remove(self.group)
+        lift_perm(self.users[0], "view_fakepost", self.posts[0])
+        remove_user_from_object_group(self.users[0], "editors", self.posts[2])
+        self.assertConsistent()
+
+        self.assertListEqual(self.effective(self.users[0]), [])
+        self.assertFalse(has_gross_perm([self.users[0]], "change_fakepost", self.posts[1]))
+
+    def test_deletions(self):
+        self.group.user_set.add(*self.users)
+        set_perm(self.group, "view_fakepost", self.posts[0])
+        set_perm(self.users[0], "change_fakepost", self.posts[0])
+        create_object_group("editors", ["delete_fakepost"], self.posts[1])
+        add_user_to_object_group(self.users[1], "editors", self.posts[1])
+
+        delete_object_group("editors", self.posts[1])
+        self.assertConsistent()
+        self.users[0].delete()
+        self.assertConsistent()
+        self.group.delete()
+        self.assertConsistent()
+
+        self.assertFalse(EffectivePermission.objects.exists())
+
+    def test_failed_deletions(self):
+        permission = Permission.objects.get(codename="view_fakepost")
+
+        def fail(sender, **kwargs):
+            raise RuntimeError
+
+        pre_delete.connect(fail, sender=Permission, dispatch_uid="test_failed_deletions")
+        try:
+            with self.assertRaises(RuntimeError):
+                permission.delete()
+            set_perm(self.users[0], "view_fakepost", self.posts[0])
+
+            with transaction.atomic():
+                with self.assertRaises(RuntimeError), transaction.atomic():
+                    permission.delete()
+                set_perm(self.users[1], "view_fakepost", self.posts[0])
+        finally:
+            pre_delete.disconnect(sender=Permission, dispatch_uid="test_failed_deletions")
+
+        self.assertListEqual(self.effective(self.users[0]), [("view_fakepost", self.posts[0].pk)])
+        self.assertListEqual(self.effective(self.users[1]), [("view_fakepost", self.posts[0].pk)])
+        self.assertConsistent()
+
+    def test_bulk_changes(self):
+        self.group.user_set.add(self.users[0])
+
+        set_perm_many([self.users[1], self.group], ["view_fakepost", "change_fakepost"], self.posts)
+        self.assertConsistent()
+        self.assertEqual(EffectivePermission.objects.count(), 12)
+
+        lift_perm_many([self.group], ["view_fakepost"], self.posts)
+        self.assertConsistent()
+        self.assertEqual(EffectivePermission.objects.count(), 9)
+
+    def test_rebuild_and_check(self):
+        disconnect_signals()
+        set_perm(self.users[0], "view_fakepost", self.posts[0])
+        set_perm(self.users[1], "view_fakepost", self.posts[0])
+
+        with self.assertRaises(CommandError):
+            call_command("safety_effective_permissions", "check", stdout=io.StringIO())
+
+        call_command("safety_effective_permissions", "rebuild", "--batch-size", "1", stdout=io.StringIO())
+        call_command("safety_effective_permissions", "check", stdout=io.StringIO())
+
+        self.assertListEqual(self.effective(self.users[1]), [("view_fakepost", self.posts[0].pk)])
+
+
+class TestAsyncPermissions(TransactionTestCase):
+    """
+    Tests the async variants of the permission API, and coalescing concurrent checks of the same permission.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(5)]
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+        ContentType.objects.get_for_models(get_user_model(), Group, FakePost)
+
+    async def test_set_check_and_lift(self):
+        self.assertTrue(await aset_perm(self.user, "view_fakepost", self.posts[0]))
+
+        self.assertTrue(await ahas_perm([self.user], "view_fakepost", self.posts[0]))
+        self.assertFalse(await ahas_perm([self.user], "view_fakepost", self.posts[1]))
+        self.assertListEqual(await aget_perms(self.user, self.posts[0]), ["view_fakepost"])
+        self.assertListEqual(await aget_objects_for_entity(self.user, "view_fakepost", self.fake_post_ct),
+                             self.posts[:1])
+
+        self.assertTrue(await alift_perm(self.user, "view_fakepost", self.posts[0]))
+        self.assertFalse(await alift_perm(self.user, "view_fakepost", self.posts[0]))
+        self.assertFalse(await ahas_perm([self.user], "view_fakepost", self.posts[0]))
+
+    async def test_gross_perm(self):
+        await self.user.groups.aadd(self.group)
+        await aset_perm(self.group, "change_fakepost", self.posts[0])
+
+        self.assertTrue(await ahas_gross_perm([self.user], "change_fakepost", self.posts[0]))
+        self.assertFalse(await ahas_perm([self.user], "change_fakepost", self.posts[0]))
+        self.assertFalse(await ahas_gross_perm([self.user], "share_fakepost", self.posts[0]))
+
+    async def test_concurrent_checks_coalesced(self):
+        await aset_perm(self.user, "view_fakepost", self.posts[0])
+        calls = []
+
+        def receive(sender, call, **kwargs):
+            calls.append(call)
+
+        permission_called.connect(receive)
+        try:
+            results = await asyncio.gather(*[ahas_perm([self.user], "view_fakepost", self.posts[0]) for _ in range(5)])
+            self.assertListEqual(results, [True] * 5)
+            self.assertEqual(sum(call.queries for call in calls), 1)
+
+            calls.clear()
+            with permission_cache():
+                results = await asyncio.gather(*[ahas_perm([self.user], "view_fakepost", post) for post in self.posts])
+            self.assertListEqual(results, [True, False, False, False, False])
+            self.assertEqual(sum(call.queries for call in calls), 1)
+        finally:
+            permission_called.disconnect(receive)
+
+
+class TestOrphanCleanup(TransactionTestCase):
+    """
+    Tests removing the grants of deleted objects.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(5)]
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+
+        for post in self.posts:
+            set_perm(self.user, "view_fakepost", post)
+        create_object_group("editors", ["change_fakepost"], self.posts[0])
+        add_user_to_object_group(self.user, "editors", self.posts[0])
+
+    def test_delete_object(self):
+        FakePost.objects.get(pk=self.posts[0].pk).delete()
+
+        self.assertFalse(ObjectPermission.objects.filter(object_ct=self.fake_post_ct,
+                                                         object_id=self.posts[0].pk).exists())
+        self.assertFalse(ObjectGroup.objects.filter(target_ct=self.fake_post_ct, target_id=self.posts[0].pk).exists())
+        self.assertEqual(ObjectPermission.objects.count(), 4)
+
+    def test_queryset_delete_batched(self):
+        with CaptureQueriesContext(connection) as context:
+            FakePost.objects.filter(pk__in=[post.pk for post in self.posts[1:]]).delete()
+
+        deletes = [query for query in context.captured_queries
+                   if query["sql"].startswith('DELETE FROM "safety_objectpermission"')]
+        self.assertEqual(len(deletes), 1)
+        self.assertListEqual(list(get_objects_for_entity(self.user, "view_fakepost", self.fake_post_ct)),
+                             self.posts[:1])
+
+    def test_rolled_back_delete(self):
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            FakePost.objects.get(pk=self.posts[0].pk).delete()
+            raise RuntimeError
+
+        FakePost.objects.get(pk=self.posts[1].pk).delete()
+        self.assertTrue(has_perm([self.user], "view_fakepost", self.posts[0]))
+        self.assertEqual(retrieve_object_group("editors", self.posts[0]).users.get(), self.user)
+
+    def test_command(self):
+        untrack_deletions(FakePost)
+        try:
+            FakePost.objects.filter(pk__in=[post.pk for post in self.posts[:2]]).delete()
+        finally:
+            track_deletions(FakePost)
+
+        self.assertTupleEqual(delete_orphaned_grants(batch_size=2, dry_run=True), (2, 1))
+
+        out = io.StringIO()
+        call_command("safety_gc", "--orphans-only", "--dry-run", "--batch-size", "2", stdout=out)
+        self.assertIn("Found safety.ObjectPermission: 2 orphaned", out.getvalue())
+        self.assertIn("Found safety.ObjectGroup: 1 orphaned", out.getvalue())
+        self.assertEqual(ObjectPermission.objects.count(), 5)
+
+        call_command("safety_gc", "--orphans-only", "--batch-size", "2", stdout=io.StringIO())
+        self.assertEqual(ObjectPermission.objects.count(), 3)
+        self.assertFalse(ObjectGroup.objects.exists())
+
+
+class TestGarbageCollection(TransactionTestCase):
+    """
+    Tests removing grants referring to missing rows and merging grants whose ids differ in formatting.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.post = FakePost.objects.create(title="TestPost", content="TestContent")
+        self.user_ct = ContentType.objects.get_for_model(get_user_model())
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+        self.permission = Permission.objects.get(codename="view_fakepost")
+
+        set_perm(self.user, "view_fakepost", self.post)
+        create_object_group("editors", ["change_fakepost"], self.post)
+        add_user_to_object_group(self.user, "editors", self.post)
+
+    def create_permission(self, to_id, object_id):
+        return ObjectPermission.objects.create(to_id=to_id, to_ct=self.user_ct, permission=self.permission,
+                                               object_ct=self.fake_post_ct, object_id=object_id)
+
+    def test_orphans(self):
+        self.create_permission(self.user.pk + 100, self.post.pk)
+        self.create_permission(self.user.pk, self.post.pk + 100)
+        ObjectGroup.objects.create(name="editors", target_ct=self.fake_post_ct, target_id=self.post.pk + 100)
+
+        out = io.StringIO()
+        call_command("safety_gc", "--dry-run", stdout=out)
+        self.assertIn("Found safety.ObjectPermission: 2 orphaned", out.getvalue())
+        self.assertEqual(ObjectPermission.objects.count(), 3)
+
+        call_command("safety_gc", "--batch-size", "1", stdout=io.StringIO())
+        self.assertEqual(ObjectPermission.objects.count(), 1)
+        self.assertEqual(ObjectGroup.objects.get().target_id, self.post.pk)
+        self.assertTrue(has_perm([self.user], "view_fakepost", self.post))
+
+    @skipUnless(ObjectPermission._meta.get_field("to_id").get_internal_type() == "CharField",
+                "Only character ids can differ in formatting.")
+    def test_duplicates(self):
+        other = get_user_model().objects.create_user(username="TestUser2", password="TestPassword")
+        self.create_permission(f" {self.user.pk}", self.post.pk)
+        self.create_permission(f"{other.pk} ", self.post.pk)
+
+        out = io.StringIO()
+        call_command("safety_gc", stdout=out)
+        self.assertIn("0 orphaned, 1 duplicates, 1 normalized", out.getvalue())
+        self.assertListEqual(sorted(ObjectPermission.objects.values_list("to_id", flat=True)),
+                             sorted([str(self.user.pk), str(other.pk)]))
+        self.assertTrue(has_perm([other], "view_fakepost", self.post))
+
+    def test_resume_from_checkpoint(self):
+        first = self.create_permission(self.user.pk + 100, self.post.pk)
+        self.create_permission(self.user.pk + 101, self.post.pk)
+
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/checkpoint.json"
+            with open(path, "w") as file:
+                json.dump({"model": "safety.ObjectPermission", "pk": first.pk}, file)
+
+            call_command("safety_gc", "--batch-size", "1", "--checkpoint", path, stdout=io.StringIO())
+            self.assertFalse(os.path.exists(path))
+
+        self.assertListEqual(list(ObjectPermission.objects.filter(to_id__in=[first.to_id, self.user.pk + 101])),
+                             [first])
+
+    def test_invalid_checkpoint(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = f"{directory}/checkpoint.json"
+            with open(path, "w") as file:
+                json.dump({"model": "safety_tests.FakePost", "pk": 1}, file)
+
+            with self.assertRaisesMessage(CommandError, "safety_tests.FakePost"):
+                call_command("safety_gc", "--checkpoint", path, stdout=io.StringIO())
+
+            with open(path, "w") as file:
+                file.write("{")
+
+            with self.assertRaises(CommandError):
+                call_command("safety_gc", "--checkpoint", path, stdout=io.StringIO())
+
+
+class TestBulkObjectGroups(TransactionTestCase):
+    """
+    Tests creating object groups and adding or removing their users in bulk.
+    """
+
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(username=f"TestUser{i}", password="TestPassword")
+                      for i in range(10)]
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(2)]
+        ContentType.objects.get_for_model(FakePost)
+        permission_registry.warm()
+
+    def test_create_object_groups_bulk(self):
+        with CaptureQueriesContext(connection) as context:
+            groups = create_object_groups_bulk({"editors": ["view_fakepost", "change_fakepost"],
+                                                "viewers": ["view_fakepost"]}, self.posts)
+        self.assertLessEqual(len(context.captured_queries), 4)
+
+        self.assertEqual(len(groups), 4)
+        self.assertEqual(ObjectGroup.objects.count(), 4)
+        self.assertListEqual(sorted(retrieve_object_group("editors", self.posts[1]).permissions
+                                    .values_list("codename", flat=True)), ["change_fakepost", "view_fakepost"])
+
+    def test_add_and_remove_users(self):
+        create_object_group("editors", ["change_fakepost"], self.posts[0])
+        add_user_to_object_group(self.users[0], "editors", self.posts[0])
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(add_users_to_object_group(self.users, "editors", self.posts[0]), 9)
+        self.assertLessEqual(len(context.captured_queries), 5)
+        self.assertTrue(all(has_perm([user], "change_fakepost", self.posts[0]) for user in self.users))
+
+        with CaptureQueriesContext(connection) as context:
+            self.assertEqual(remove_users_from_object_group(get_user_model().objects.filter(
+                pk__in=[user.pk for user in self.users[:5]]), "editors", self.posts[0]), 5)
+        self.assertLessEqual(len(context.captured_queries), 5)
+        self.assertListEqual([has_perm([user], "change_fakepost", self.posts[0]) for user in self.users],
+                             [False] * 5 + [True] * 5)
+
+    @override_settings(SAFETY_EFFECTIVE_PERMISSIONS=True)
+    def test_effective_permissions(self):
+        connect_signals()
+        try:
+            create_object_groups_bulk({"editors": ["change_fakepost"]}, self.posts[:1])
+            add_users_to_object_group(self.users, "editors", self.posts[0])
+            remove_users_from_object_group(self.users[:3], "editors", self.posts[0])
+
+            self.assertEqual(EffectivePermission.objects.count(), 7)
+            self.assertEqual(refresh_effective_permissions(dry_run=True), (0, 0))
+        finally:
+            disconnect_signals()
+
+
+class TestObjectGroupsForUser(TransactionTestCase):
+    """
+    Tests listing the object groups of a user on objects of a type.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(3)]
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+
+        create_object_groups_bulk({"editors": ["change_fakepost"], "viewers": ["view_fakepost"]}, self.posts)
+        add_user_to_object_group(self.user, "editors", self.posts[0])
+        add_user_to_object_group(self.user, "viewers", self.posts[2])
+
+    def test_groups_for_user(self):
+        groups = get_object_groups_for_user(self.user, FakePost)
+
+        with self.assertNumQueries(2):
+            self.assertListEqual([(group.name, group.target) for group in groups],
+                                 [("editors", self.posts[0]), ("viewers", self.posts[2])])
+
+    def test_content_type(self):
+        self.assertEqual(get_object_groups_for_user(self.user, self.fake_post_ct).count(), 2)
+        self.assertFalse(get_object_groups_for_user(self.user, get_user_model()).exists())
+
+
+@override_settings(SAFETY_PERMISSION_MASKS={"safety_tests.FakePost": ["view_fakepost", "change_fakepost",
+                                                                      "delete_fakepost", "share_fakepost"]})
+class TestPermissionMasks(TransactionTestCase):
+    """
+    Tests storing the object permissions of a model as one bitmask per user or group and object.
+    """
+
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(username=f"TestUser{i}", password="TestPassword")
+                      for i in range(3)]
+        self.group = Group.objects.create(name="TestGroup")
+        self.posts = [FakePost.objects.create(title=f"TestPost{i}", content="TestContent") for i in range(2)]
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+
+    def test_set_and_lift(self):
+        set_perm(self.users[0], "view_fakepost", self.posts[0])
+        set_perm(self.users[0], "share_fakepost", self.posts[0])
+
+        self.assertEqual(PermissionMask.objects.get().mask, 0b1001)
+        self.assertFalse(ObjectPermission.objects.exists())
+        self.assertTrue(has_perm([self.users[0]], "share_fakepost", self.posts[0]))
+        self.assertFalse(has_perm([self.users[0]], "change_fakepost", self.posts[0]))
+        self.assertListEqual(get_perms(self.users[0], self.posts[0]), ["share_fakepost", "view_fakepost"])
+
+        self.assertTrue(lift_perm(self.users[0], "view_fakepost", self.posts[0]))
+        self.assertFalse(lift_perm(self.users[0], "view_fakepost", self.posts[0]))
+        self.assertEqual(PermissionMask.objects.get().mask, 0b1000)
+        self.assertTrue(lift_perm(self.users[0], "share_fakepost", self.posts[0]))
+        self.assertFalse(PermissionMask.objects.exists())
+
+        with self.assertRaises(ValueError):
+            set_perm(self.users[0], "add_fakepost", self.posts[0])
+
+    def test_lookups(self):
+        self.users[1].groups.add(self.group)
+        set_perm(self.users[0], "change_fakepost", self.posts[0])
+        set_perm(self.group, "change_fakepost", self.posts[1])
+
+        self.assertTrue(has_gross_perm([self.users[1]], "change_fakepost", self.posts[1]))
+        with permission_cache():
+            self.assertTrue(has_gross_perm([self.users[1]], "change_fakepost", self.posts[1]))
+            self.assertListEqual(get_perms(self.users[0], self.posts[0]), ["change_fakepost"])
+        self.assertListEqual(get_objects_for_entity(self.users[1], "change_fakepost", self.fake_post_ct),
+                             self.posts[1:])
+        self.assertListEqual(list(get_users_with_perms("change_fakepost", self.posts[1])), self.users[1:2])
+        self.assertListEqual(list(get_groups_with_perms("change_fakepost", self.fake_post_ct, self.posts[1])),
+                             [self.group])
+
+    def test_bulk(self):
+        self.assertEqual(set_perm_many(self.users, ["view_fakepost", "change_fakepost"], self.posts), 12)
+        self.assertEqual(set_perm_many(self.users, ["view_fakepost", "delete_fakepost"], self.posts), 6)
+        self.assertEqual(PermissionMask.objects.count(), 6)
+
+        self.assertEqual(lift_perm_many(self.users[:2], ["view_fakepost", "share_fakepost"], self.posts), 4)
+        self.assertListEqual(get_perms(self.users[0], self.posts[1]), ["change_fakepost", "delete_fakepost"])
+        self.assertListEqual(get_perms(self.users[2], self.posts[1]),
+                             ["change_fakepost", "delete_fakepost", "view_fakepost"])
+
+        FakePost.objects.filter(pk=self.posts[1].pk).delete()
+        self.assertEqual(PermissionMask.objects.count(), 3)
+
+    @override_settings(SAFETY_SHARED_CACHE="safety",
+                       CACHES={"safety": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"}})
+    def test_order_does_not_depend_on_cache(self):
+        set_perm(self.users[0], "view_fakepost", self.posts[0])
+        set_perm(self.users[0], "share_fakepost", self.posts[0])
+        set_perm(self.users[0], "change_fakepost", self.posts[0])
+        expected = ["change_fakepost", "share_fakepost", "view_fakepost"]
+
+        self.assertListEqual(get_perms(self.users[0], self.posts[0]), expected)
+        with override_settings(SAFETY_SHARED_CACHE=None):
+            self.assertListEqual(get_perms(self.users[0], self.posts[0]), expected)
+            with permission_cache():
+                self.assertListEqual(get_perms(self.users[0], self.posts[0]), expected)
+
+    @override_settings(SAFETY_EFFECTIVE_PERMISSIONS=True)
+    def test_effective_permissions(self):
+        connect_signals()
+        try:
+            self.group.user_set.add(*self.users[1:])
+            set_perm(self.users[0], "view_fakepost", self.posts[0])
+            set_perm_many([self.group], ["change_fakepost", "share_fakepost"], self.posts)
+            lift_perm(self.group, "share_fakepost", self.posts[1])
+
+            self.assertEqual(EffectivePermission.objects.count(), 7)
+            self.assertEqual(refresh_effective_permissions(dry_run=True), (0, 0))
+        finally:
+            disconnect_signals()
+
+    async def test_async(self):
+        await aset_perm(self.users[0], "delete_fakepost", self.posts[0])
+
+        self.assertTrue(await ahas_perm([self.users[0]], "delete_fakepost", self.posts[0]))
+        self.assertListEqual(await aget_perms(self.users[0], self.posts[0]), ["delete_fakepost"])
+        self.assertTrue(await alift_perm(self.users[0], "delete_fakepost", self.posts[0]))
+        self.assertFalse(await PermissionMask.objects.aexists())
+
+
+class TestInheritedPermissions(TransactionTestCase):
+    """
+    Tests inheriting the permissions granted on the ancestors of objects through the closure table.
+    """
+
+    def setUp(self):
+        self.users = [get_user_model().objects.create_user(username=f"TestUser{i}", password="TestPassword")
+                      for i in range(3)]
+        self.group = Group.objects.create(name="TestGroup")
+        self.root = Folder.objects.create(name="Root")
+        self.other = Folder.objects.create(name="Other")
+        self.folder = Folder.objects.create(name="Folder", parent=self.root)
+        self.document = Document.objects.create(title="Document", folder=self.folder)
+        self.document_ct = ContentType.objects.get_for_model(Document)
+
+    def ancestors(self, obj):
+        return list(ObjectAncestor.objects.filter(descendant_ct=ContentType.objects.get_for_model(obj),
+                                                  descendant_id=obj.pk)
+                    .order_by("depth").values_list("ancestor_id", "depth"))
+
+    def test_closure(self):
+        self.assertListEqual(self.ancestors(self.document), [(self.folder.pk, 1), (self.root.pk, 2)])
+
+        self.folder.name = "Renamed"
+        with self.assertNumQueries(2):
+            self.folder.save()
+        folder = Folder.objects.get(pk=self.folder.pk)
+        with self.assertNumQueries(1):
+            folder.save(update_fields=["name"])
+
+        self.folder.parent = self.other
+        self.folder.save()
+        self.assertListEqual(self.ancestors(self.folder), [(self.other.pk, 1)])
+        self.assertListEqual(self.ancestors(self.document), [(self.folder.pk, 1), (self.other.pk, 2)])
+        self.assertEqual(ObjectAncestor.objects.count(), 3)
+
+        self.other.parent = self.folder
+        with self.assertRaises(ValueError):
+            self.other.save()
+
+        Folder.objects.filter(pk=self.folder.pk).delete()
+        self.assertListEqual(self.ancestors(Document.objects.get()), [])
+        self.assertFalse(ObjectAncestor.objects.exists())
+
+    def test_inherited_checks(self):
+        set_perm(self.users[0], "read", self.root)
+        self.users[1].groups.add(self.group)
+        set_perm(self.group, "read", self.folder)
+        create_object_group("Readers", ["read"], self.folder)
+        add_user_to_object_group(self.users[2], "Readers", self.folder)
+
+        self.assertTrue(has_perm([self.users[0]], "read", self.document))
+        self.assertFalse(has_perm([self.users[1]], "read", self.document))
+        self.assertTrue(has_gross_perm([self.users[1]], "read", self.document))
+        self.assertTrue(has_perm([self.users[2]], "read", self.document))
+        self.assertFalse(has_perm([self.users[0]], "read", self.other))
+        with permission_cache():
+            self.assertTrue(has_perm([self.users[0]], "read", self.document))
+            self.assertTrue(has_gross_perm([self.users[1]], "read", self.document))
+
+        for user in self.users[:2]:
+            self.assertListEqual(get_objects_for_entity(user, "read", self.document_ct), [self.document])
+        self.assertListEqual(list(get_objects_for_entity_queryset(self.users[2], "read", self.document_ct)),
+                             [self.document])
+        self.assertDictEqual(has_perm_many(self.users[0], "read", [self.document]), {self.document.pk: True})
+
+        self.folder.parent = self.other
+        self.folder.save()
+        self.assertFalse(has_perm([self.users[0]], "read", self.document))
+        self.assertListEqual(get_objects_for_entity(self.users[0], "read", self.document_ct), [])
+
+    def test_codename_of_ancestor_model(self):
+        set_perm(self.users[0], "change_folder", self.root)
+
+        self.assertTrue(has_perm([self.users[0]], "change_folder", self.document))
+        self.assertTrue(has_gross_perm([self.users[0]], "change_folder", self.document))
+        with permission_cache():
+            self.assertTrue(has_perm([self.users[0]], "change_folder", self.document))
+            self.assertTrue(has_gross_perm([self.users[0]], "change_folder", self.document))
+        self.assertListEqual(get_objects_for_entity(self.users[0], "change_folder", self.document_ct),
+                             [self.document])
+        self.assertFalse(has_perm([self.users[1]], "change_folder", self.document))
+
+    def test_constant_queries(self):
+        set_perm(self.users[0], "read", self.root)
+        ContentType.objects.get_for_model(Group)
+
+        with self.assertNumQueries(1):
+            self.assertListEqual(get_objects_for_entity(self.users[0], "read", self.document_ct), [self.document])
+        with self.assertNumQueries(1):
+            self.assertTrue(has_gross_perm([self.users[0]], "read", self.document))
+
+    def test_bulk_writes(self):
+        Folder.objects.filter(pk=self.folder.pk).update(parent=self.other)
+        self.assertListEqual(self.ancestors(self.document), [(self.folder.pk, 1), (self.root.pk, 2)])
+
+        folder = Folder.objects.get(pk=self.folder.pk)
+        self.assertTrue(sync_ancestors(folder))
+        self.assertListEqual(self.ancestors(self.document), [(self.folder.pk, 1), (self.other.pk, 2)])
+        self.assertFalse(sync_ancestors(folder))
+
+    def test_save_stale_instance(self):
+        moved = Folder.objects.get(pk=self.folder.pk)
+        moved.parent = self.other
+        moved.save()
+
+        self.folder.name = "Renamed"
+        self.folder.save()
+        self.assertListEqual(self.ancestors(self.document), [(self.folder.pk, 1), (self.root.pk, 2)])
+
+        set_perm(self.users[0], "read", self.root)
+        self.assertTrue(has_perm([self.users[0]], "read", self.document))
+
+    def test_rebuild(self):
+        ObjectAncestor.objects.all().delete()
+
+        out = io.StringIO()
+        call_command("safety_rebuild_ancestors", stdout=out)
+        self.assertEqual(out.getvalue().strip(), "Created 3 object ancestors.")
+        self.assertListEqual(self.ancestors(self.document), [(self.folder.pk, 1), (self.root.pk, 2)])
+        self.assertEqual(rebuild_ancestors(), 3)
+
+    async def test_async(self):
+        await aset_perm(self.users[0], "read", self.root)
+
+        self.assertTrue(await ahas_perm([self.users[0]], "read", self.document))
+        self.assertTrue(await ahas_gross_perm([self.users[0]], "read", self.document))
+        self.assertFalse(await ahas_perm([self.users[1]], "read", self.document))
+
+        await aset_perm(self.users[1], "change_folder", self.folder)
+        self.assertTrue(await ahas_perm([self.users[1]], "change_folder", self.document))
+        self.assertTrue(await ahas_gross_perm([self.users[1]], "change_folder", self.document))
+
+    @override_settings(SAFETY_PERMISSION_MASKS={"safety_tests.FakePost": ["view_fakepost"]})
+    async def test_async_cold_content_types(self):
+        await aset_perm(self.users[0], "read", self.root)
+        ContentType.objects.clear_cache()
+
+        self.assertTrue(await ahas_perm([self.users[0]], "read", self.document))
+        self.assertTrue(await ahas_gross_perm([self.users[0]], "read", self.document))
+        self.assertListEqual(await aget_objects_for_entity(self.users[0], "read", self.document_ct), [self.document])
+
+
+class TestModelPermissionCache(TransactionTestCase):
+    """
+    Tests answering model level checks from the permissions of users and their groups cached on the instance.
+    """
+
+    def setUp(self):
+        self.user = get_user_model().objects.create_user(username="TestUser", password="TestPassword")
+        self.group = Group.objects.create(name="TestGroup")
+        self.user.groups.add(self.group)
+        self.user = get_user_model().objects.get(pk=self.user.pk)
+        self.post = FakePost.objects.create(title="TestPost", content="TestContent")
+        self.fake_post_ct = ContentType.objects.get_for_model(FakePost)
+        self.user_ct = ContentType.objects.get_for_model(get_user_model())
+
+        set_perm(self.user, "view_fakepost", content_type=self.fake_post_ct)
+        set_perm(self.group, "change_fakepost", content_type=self.fake_post_ct)
+        set_perm(self.group, "view_user", content_type=self.user_ct)
+
+    def test_single_load(self):
+        with self.assertNumQueries(1):
+            self.assertTrue(has_perm([self.user], "view_fakepost", content_type=self.fake_post_ct))
+            self.assertFalse(has_perm([self.user], "change_fakepost", content_type=self.fake_post_ct))
+            self.assertTrue(has_gross_perm([self.user], "change_fakepost", content_type=self.fake_post_ct))
+            self.assertFalse(has_gross_perm([self.user], "view_fakepost", content_type=self.user_ct))
+            self.assertFalse(has_perm([self.user], "view_fakepost"))
+            self.assertListEqual(get_perms(self.user), ["view_fakepost"])
+            self.assertListEqual(get_gross_perms(self.user), ["change_fakepost", "view_fakepost", "view_user"])
+
+        self.assertListEqual(get_perms(self.group), ["change_fakepost", "view_user"])
+
+    def test_set_and_lift_invalidate(self):
+        self.assertFalse(has_perm([self.user], "delete_fakepost", content_type=self.fake_post_ct))
+
+        set_perm(self.user, "delete_fakepost", content_type=self.fake_post_ct)
+        self.assertTrue(has_perm([self.user], "delete_fakepost", content_type=self.fake_post_ct))
+        self.assertTrue(self.user.has_perm("safety_tests.delete_fakepost"))
+
+        lift_perm(self.user, "delete_fakepost", content_type=self.fake_post_ct)
+        self.assertFalse(has_perm([self.user], "delete_fakepost", content_type=self.fake_post_ct))
+        self.assertFalse(self.user.has_perm("safety_tests.delete_fakepost"))
+
+        lift_perm(self.group, "change_fakepost", content_type=self.fake_post_ct)
+        invalidate(self.user)
+        self.assertFalse(has_gross_perm([self.user], "change_fakepost", content_type=self.fake_post_ct))
+
+    def test_object_gross_perms(self):
+        set_perm(self.user, "view_fakepost", self.post)
+        set_perm(self.group, "delete_fakepost", self.post)
+
+        self.assertListEqual(get_gross_perms(self.user, self.post), ["delete_fakepost", "view_fakepost"])
+        with permission_cache():
+            self.assertListEqual(get_gross_perms(self.user, self.post), ["delete_fakepost", "view_fakepost"])
+
+    async def test_async(self):
+        self.assertTrue(await ahas_perm([self.user], "view_fakepost", content_type=self.fake_post_ct))
+        self.assertTrue(await ahas_gross_perm([self.user], "view_user", content_type=self.user_ct))
+        self.assertListEqual(await aget_perms(self.user), ["view_fakepost"])
+
+        await alift_perm(self.user, "view_fakepost", content_type=self.fake_post_ct)
+        self.assertFalse(await ahas_perm([self.user], "view_fakepost", content_type=self.fake_post_ct))
+